@@ -14,6 +14,8 @@
 
 import hashlib
 import os
+import numpy as np
+from round_function import get_round_function
 
 blockSize = 16
 verboseState = False
@@ -24,23 +26,15 @@ sbox = {0: 0xE, 1: 0x4, 2: 0xD, 3: 0x1, 4: 0x2, 5: 0xF, 6: 0xB, 7: 0x8, 8: 0x3,
 sbox_inv = {0xE: 0, 0x4: 1, 0xD: 2, 0x1: 3, 0x2: 4, 0xF: 5, 0xB: 6, 0x8: 7,
             0x3: 8, 0xA: 9, 0x6: 0xA, 0xC: 0xB, 0x5: 0xC, 0x9: 0xD, 0x0: 0xE, 0x7: 0xF}
 
-# Apply sbox (1) to a 16 bit state and return the result
-
-
-def apply_sbox(state, sbox):
-    subStates = [state & 0x000f, (state & 0x00f0) >>
-                 4, (state & 0x0f00) >> 8, (state & 0xf000) >> 12][::-1]
-    for idx, subState in enumerate(subStates):
-        subStates[idx] = sbox[subState]
-    return subStates[0] | subStates[1] << 4 | subStates[2] << 8 | subStates[3] << 12
-
-
 # (2) Permutation. Applied bit-wise
 pbox = {0: 0, 1: 4, 2: 8, 3: 12, 4: 1, 5: 5, 6: 9, 7: 13,
         8: 2, 9: 6, 10: 10, 11: 14, 12: 3, 13: 7, 14: 11, 15: 15}
 pbox_inv = {0: 0, 4: 1, 8: 2, 12: 3, 1: 4, 5: 5, 9: 6, 13: 7,
             2: 8, 6: 9, 10: 10, 14: 11, 3: 12, 7: 13, 11: 14, 15: 15}
 
+# Precomputed round-function tables (split S-box/P-box byte tables, fused S∘P)
+ROUND_FUNCTION = get_round_function(sbox, pbox)
+
 # (3) Key mixing: bitwise XOR between round subkey and data block input to round
 # Key schedule: independant random round keys.
 # We take the sha-hash of a 128-bit 'random' seed and then take the first (nround*16)-bits
@@ -53,6 +47,11 @@ def keyGeneration(split_length = blockSize):
     sub_num = len(k)//sub_len
     return [k[sub_len*i:sub_len*(i+1)] for i in range(sub_num)]
 
+# Parse the hex subkeys once, the batch functions take this array directly
+def parse_subkeys(k, nround=4):
+    assert len(k) >= nround + 1, "Sub keys not enough!"
+    return np.array([int(subK, 16) for subK in k[:nround + 1]], dtype=np.uint16)
+
 # Simple SPN Cipher encrypt function
 
 
@@ -76,16 +75,12 @@ def encrypt(pt, k, nround=4):
             print(hex(state), end=' ')
 
         # Break state into nibbles, perform sbox on each nibble, write to state (1)
-        state = apply_sbox(state, sbox)
+        state = ROUND_FUNCTION.sub(state)
         if verboseState:
             print(hex(state), end=' ')
 
         # Permute the state bitwise (2)
-        state_temp = 0
-        for bitIdx in range(0, blockSize):
-            if (state & (1 << bitIdx)):
-                state_temp |= (1 << pbox[bitIdx])
-        state = state_temp
+        state = ROUND_FUNCTION.perm(state)
         if verboseState:
             print(hex(state))
 
@@ -93,7 +88,7 @@ def encrypt(pt, k, nround=4):
     state = state ^ subKeys[-2]  # penultimate subkey (key 4) mixing
     if verboseState:
         print(str(3), hex(state), end=' ')
-    state = apply_sbox(state, sbox)
+    state = ROUND_FUNCTION.sub(state)
     if verboseState:
         print(hex(state), end=' ')
     state = state ^ subKeys[-1]  # Final subkey (key 5) mixing
@@ -127,7 +122,7 @@ def decrypt(ct, k, nround=4):
         print(hex(state), end=' ')
 
     # Apply inverse s-box
-    state = apply_sbox(state, sbox_inv)
+    state = ROUND_FUNCTION.inv_sub(state)
     if verboseState:
         print(hex(state))
     state = state ^ subKeys[-2]
@@ -139,16 +134,12 @@ def decrypt(ct, k, nround=4):
             print(roundN, end=' ')
             
         # Un-permute the state bitwise (2)
-        state_temp = 0
-        for bitIdx in range(0, blockSize):
-            if (state & (1 << bitIdx)):
-                state_temp |= (1 << pbox_inv[bitIdx])
-        state = state_temp
+        state = ROUND_FUNCTION.inv_perm(state)
         if verboseState:
             print(hex(state), end=' ')
 
         # Apply inverse s-box
-        state = apply_sbox(state, sbox_inv)
+        state = ROUND_FUNCTION.inv_sub(state)
         if verboseState:
             print(hex(state), end=' ')
             
@@ -159,6 +150,28 @@ def decrypt(ct, k, nround=4):
     return state
 
 
+# Encrypt a whole numpy array of 16-bit blocks, subKeys comes from parse_subkeys
+# Same result as encrypt() on every block, each round is a single table lookup
+def encrypt_batch(pts, subKeys, nround=4):
+    assert len(subKeys) >= nround + 1, "Sub keys not enough!"
+    subKeys = np.asarray(subKeys[:nround + 1], dtype=np.uint16)
+    state = np.asarray(pts, dtype=np.uint16)
+    for roundN in range(0, nround-1):
+        state = ROUND_FUNCTION.SP[state ^ subKeys[roundN]]
+    state = ROUND_FUNCTION.S[state ^ subKeys[-2]]
+    return state ^ subKeys[-1]
+
+# Decrypt a whole numpy array of 16-bit blocks, inverse of encrypt_batch()
+def decrypt_batch(cts, subKeys, nround=4):
+    assert len(subKeys) >= nround + 1, "Sub keys not enough!"
+    subKeys = np.asarray(subKeys[:nround + 1], dtype=np.uint16)
+    state = np.asarray(cts, dtype=np.uint16)
+    state = ROUND_FUNCTION.S_INV[state ^ subKeys[-1]] ^ subKeys[-2]
+    for roundN in range(nround-2, -1, -1):
+        state = ROUND_FUNCTION.INV_SP[state] ^ subKeys[roundN]
+    return state
+
+
 if __name__ == "__main__":
     key = keyGeneration()
     print(f"[+] subkeys:   {key}")
@@ -12,13 +12,42 @@ from copy import deepcopy
 # sbox =     {0:0xE, 1:0x4, 2:0xD, 3:0x1, 4:0x2, 5:0xF, 6:0xB, 7:0x8, 8:0x3, 9:0xA, 0xA:0x6, 0xB:0xC, 0xC:0x5, 0xD:0x9, 0xE:0x0, 0xF:0x7} #key:value
 # sbox_inv = {0xE:0, 0x4:1, 0xD:2, 0x1:3, 0x2:4, 0xF:5, 0xB:6, 0x8:7, 0x3:8, 0xA:9, 0x6:0xA, 0xC:0xB, 0x5:0xC, 0x9:0xD, 0x0:0xE, 0x7:0xF}
 
+# parity of every integer below n, as an array
+def parity_table(n):
+    values = np.arange(n)
+    if hasattr(np, "bitwise_count"):
+        return (np.bitwise_count(values) & 1).astype(values.dtype)
+    parity = np.zeros(n, dtype=values.dtype)
+    while values.any():
+        parity ^= values & 1
+        values = values >> 1
+    return parity
+
+
+# fast Walsh-Hadamard transform along axis 0, the length must be a power of two
+def walsh_hadamard_transform(table):
+    n = len(table)
+    W = np.array(table, dtype=np.int64)
+    columns = W.shape[1:]
+    h = 1
+    while h < n:
+        W = W.reshape(n // (2 * h), 2, h, *columns)
+        W = np.stack((W[:, 0] + W[:, 1], W[:, 0] - W[:, 1]), axis=1)
+        h *= 2
+    return W.reshape(n, *columns)
+
+
 class Sbox():
     box_dict = None
     box_permutation = None
     box_size = None
+    box_array = None
+    box_inv_array = None
     diff_table = None
     diff_prob_table = None
     max_diff_prob = None
+    linear_table = None
+    boomerang_table = None
 
     def __init__(self, box: dict) -> None:
         box_size = len(box)
@@ -28,16 +57,18 @@ class Sbox():
         self.box_dict = deepcopy(box)
         self.box_size = box_size
         self.box_permutation = box_permutation
+        # S[x] and S^-1[y] as arrays for the vectorized tables
+        self.box_array = np.array([box[x] for x in range(box_size)], dtype=np.int64)
+        self.box_inv_array = np.argsort(self.box_array)
 
     def difference_distribution_table(self):
         if type(self.diff_table) != type(None):
             return self.diff_table
-        table = np.zeros((self.box_size, self.box_size), dtype=int)
-        for input_diff in range(self.box_size):
-            for x_1 in range(self.box_size):
-                x_2 = x_1 ^ input_diff
-                out_diff = self.box_dict[x_1] ^ self.box_dict[x_2]
-                table[input_diff, out_diff] += 1
+        # DDT[a, S[x] ^ S[x ^ a]] += 1 for all (a, x) at once
+        n = self.box_size
+        x = np.arange(n)
+        out_diff = self.box_array[None, :] ^ self.box_array[x[:, None] ^ x[None, :]]
+        table = np.bincount((x[:, None] * n + out_diff).ravel(), minlength=n * n).reshape(n, n)
         self.diff_table = table
         self.diff_prob_table = table/self.box_size
         return table
@@ -49,7 +80,9 @@ class Sbox():
 
     def maximal_difference_probability(self):
         # we will not consider zero difference
-        return np.max(self.diff_prob_table[1:, :])
+        if self.max_diff_prob is None:
+            self.max_diff_prob = np.max(self.difference_prob_table()[1:, :])
+        return self.max_diff_prob
 
     def fetch_max_prob_io(self):
         # return the (input difference, output difference) with max maximal difference probability
@@ -59,7 +92,8 @@ class Sbox():
         for inpu_diff in range(self.box_size-1):
             for out_diff in range(self.box_size):
                 if distribution_table[inpu_diff, out_diff] == max_prob:
-                    io_list.append((inpu_diff, out_diff))
+                    # row 0 of distribution_table is the input difference 1
+                    io_list.append((inpu_diff + 1, out_diff))
         return max_prob/self.box_size, io_list
 
     def difference_prob_dict(self):
@@ -67,10 +101,8 @@ class Sbox():
         diff_dict = {}
         for i in range(self.box_size):
             # diff_dict[input_diff] : [(out_diff,prob)]
-            diff_dict.setdefault(i, [])
-            for j in range(self.box_size):
-                if P[i][j] != 0:
-                    diff_dict[i].append((j, P[i][j]))
+            out_diffs = np.nonzero(P[i])[0]
+            diff_dict[i] = list(zip(out_diffs.tolist(), P[i, out_diffs].tolist()))
         return diff_dict
 
     def difference_distribution_dict(self):
@@ -78,11 +110,52 @@ class Sbox():
         diff_dict = {}
         for i in range(self.box_size):
             # diff_dict[input_diff] : [(out_diff,prob)]
-            diff_dict.setdefault(i, [])
-            for j in range(self.box_size):
-                if P[i][j] != 0:
-                    diff_dict[i].append((j, P[i][j]))
+            out_diffs = np.nonzero(P[i])[0]
+            diff_dict[i] = list(zip(out_diffs.tolist(), P[i, out_diffs].tolist()))
         return diff_dict
-    
+
+    def linear_approximation_table(self):
+        """LAT[a, b] = #{x : a.x = b.S(x)} - box_size/2, the signed bias (count - 2^(n-1)) of the
+        n-bit sbox, by the fast Walsh-Hadamard transform of the columns (-1)^(b.S(x)).
+        Returns:
+            np.ndarray: box_size x box_size table, input mask a, output mask b
+        """
+        if type(self.linear_table) != type(None):
+            return self.linear_table
+        n = self.box_size
+        parity = parity_table(n)
+        signs = 1 - 2 * parity[self.box_array[:, None] & np.arange(n)[None, :]]
+        table = walsh_hadamard_transform(signs) // 2
+        self.linear_table = table
+        return table
+
+    def maximal_linear_bias(self):
+        # we will not consider zero mask
+        return np.max(np.abs(self.linear_approximation_table()[1:, 1:])) / self.box_size
+
+    def boomerang_connectivity_table(self):
+        """BCT[a, b] = #{x : S^-1(S(x) ^ b) ^ S^-1(S(x ^ a) ^ b) = a}.
+        With g_b(x) = x ^ S^-1(S(x) ^ b) the condition is g_b(x) = g_b(x ^ a), so one table of g
+        is built for all b and compared with itself, one input difference a at a time.
+        Returns:
+            np.ndarray: box_size x box_size table, input difference a, output difference b
+        """
+        if type(self.boomerang_table) != type(None):
+            return self.boomerang_table
+        n = self.box_size
+        x = np.arange(n)
+        # g[b, x] = g_b(x)
+        g = x[None, :] ^ self.box_inv_array[self.box_array[None, :] ^ x[:, None]]
+        g = g.astype(np.uint8 if n <= 256 else np.uint32)
+        table = np.zeros((n, n), dtype=int)
+        for a in range(n):
+            table[a] = np.count_nonzero(g == g[:, x ^ a], axis=1)
+        self.boomerang_table = table
+        return table
+
+    def boomerang_uniformity(self):
+        # we will not consider zero differences
+        return np.max(self.boomerang_connectivity_table()[1:, 1:])
+
 if __name__ == "__main__":
     print("Try this on your on")
\ No newline at end of file
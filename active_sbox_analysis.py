@@ -1,10 +1,15 @@
 from SBox import Sbox
+from round_function import get_round_function
 from itertools import product, combinations
 import random
 from tqdm import tqdm
 import pickle
-import networkx as nx
-import matplotlib.pyplot as plt
+import numpy as np
+from spn_core import (sbox, sbox_inv, pbox, pbox_inv, do_sbox, do_inv_sbox, do_pbox, do_inv_pbox,
+                      parse_Sbox_input, active_sbox_array, active_sbox_table)
+from search_stats import SearchStats, stats_phase
+from table_cache import TableCache, box_parameters, cached_bounds
+# networkx and matplotlib are imported where they are used, they are slow to import
 
 
 def generate_Sbox(nbits = 4):
@@ -20,85 +25,11 @@ def generate_permutation(LEN = 16):
     return {i:j for i,j in enumerate(L)},{j:i for i,j in enumerate(L)}
 
     
-# (1) Substitution: 4x4 bijective, one sbox used for all 4 sub-blocks of size 4. Nibble wise
-sbox = {0: 0xE, 1: 0x4, 2: 0xD, 3: 0x1, 4: 0x2, 5: 0xF, 6: 0xB, 7: 0x8, 8: 0x3,
-        9: 0xA, 0xA: 0x6, 0xB: 0xC, 0xC: 0x5, 0xD: 0x9, 0xE: 0x0, 0xF: 0x7}  # key:value
-sbox_inv = {0xE: 0, 0x4: 1, 0xD: 2, 0x1: 3, 0x2: 4, 0xF: 5, 0xB: 6, 0x8: 7,
-            0x3: 8, 0xA: 9, 0x6: 0xA, 0xC: 0xB, 0x5: 0xC, 0x9: 0xD, 0x0: 0xE, 0x7: 0xF}
-
-# (2) Permutation. Applied bit-wise
-pbox = {0: 0, 1: 4, 2: 8, 3: 12, 4: 1, 5: 5, 6: 9, 7: 13,
-        8: 2, 9: 6, 10: 10, 11: 14, 12: 3, 13: 7, 14: 11, 15: 15}
-pbox_inv = {0: 0, 4: 1, 8: 2, 12: 3, 1: 4, 5: 5, 9: 6, 13: 7,
-            2: 8, 6: 9, 10: 10, 14: 11, 3: 12, 7: 13, 11: 14, 15: 15}
-
-# if you wanna test new sboxes and pboxes, you can set new_box = True
-new_box = False
-if new_box:
-    sbox,sbox_inv = generate_Sbox()
-    pbox,pbox_inv = generate_permutation()
-    S = Sbox(sbox)
-    print(f"[+] sbox = {sbox} \n[+] pbox = {pbox}")
-    
-    print(f"[+] new box table :\n {S.difference_distribution_table() = }")
-# modify accordingly
-def do_sbox(number):
-    return sbox[number]
-
-# modify accordingly
-def do_inv_sbox(number):
-    return sbox_inv[number]
-
-# modify accordingly
-def do_pbox(number):
-    number_temp = 0
-    for bitIdx in range(0, 16):
-        if (number & (1 << bitIdx)):
-            number_temp |= (1 << pbox[bitIdx])
-    number = number_temp
-    return number
-
-
-def do_inv_pbox(state):
-    state_temp = 0
-    for bitIdx in range(0, 16):
-        if (state & (1 << bitIdx)):
-            state_temp |= (1 << pbox_inv[bitIdx])
-    state = state_temp
-    return state
-
-# convert an integer to the input of Sbox
-def parse_Sbox_input(input_number, SBOX_BITS=4, NUM_SBOXES=4):
-    mask = (1 << SBOX_BITS) - 1
-    STATE = []
-    for i in range(NUM_SBOXES):
-        STATE.append(mask & input_number)
-        input_number = input_number >> SBOX_BITS
-    return STATE[::-1]
-
-# merge the output of Sbox to an integer
-def merge_Sbox_output(STATE, SBOX_BITS=4, NUM_SBOXES=4):
-    assert len(STATE) == NUM_SBOXES
-    out_number = 0
-    for state in STATE:
-        out_number = (out_number << SBOX_BITS) | state
-    return out_number
-
-
-def compute_active_sbox_table():
-    table = []
-    for i in range(2**16):
-        diff_ls = parse_Sbox_input(i)
-        cnt = 0
-        for sub_diff in diff_ls:
-            if sub_diff !=0:
-                cnt+=1
-        table.append(cnt)
-    return table
-
 # setup directed graph
 namespace = globals()
 def draw_directed_graph(source, title):
+    import networkx as nx
+    import matplotlib.pyplot as plt
     # source is a list like [ (start node, [(end node, edge weight)]) ]
     G1 = nx.DiGraph()
     # load
@@ -141,9 +72,128 @@ def draw_directed_graph(source, title):
     plt.show()
     plt.savefig(title + ".png")
     
-ACTIVE_SBOX_TABLE = compute_active_sbox_table()
-def count_active_sbox(dc):
-    return sum([ACTIVE_SBOX_TABLE[diff] for diff in dc])
+# drop the nodes without successors (they can not be on a cycle), until none is left
+# graph in CSR form: the successors of node v are targets[offsets[v]:offsets[v+1]]
+# return the kept node indices and the CSR graph on them
+def prune_dead_ends(offsets, targets):
+    n = len(offsets) - 1
+    sources = np.repeat(np.arange(n), np.diff(offsets))
+    alive = np.ones(n, dtype=bool)
+    while True:
+        edge_alive = alive[sources] & alive[targets]
+        out_degree = np.bincount(sources[edge_alive], minlength=n)
+        new_alive = alive & (out_degree > 0)
+        if (new_alive == alive).all():
+            break
+        alive = new_alive
+    kept = np.nonzero(alive)[0]
+    new_index = np.full(n, -1, dtype=np.int64)
+    new_index[kept] = np.arange(len(kept))
+    edge_alive = alive[sources] & alive[targets]
+    new_offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(new_index[sources[edge_alive]], minlength=len(kept)), out=new_offsets[1:])
+    return kept, new_offsets, new_index[targets[edge_alive]]
+
+# Howard's policy iteration for the minimum mean cycle, node v costs weights[v] on every edge leaving it
+# every node must have a successor (see prune_dead_ends)
+# return (cycle as a list of node indices, mean weight of the cycle)
+def min_mean_cycle(offsets, targets, weights, max_iter=10000, eps=1e-9):
+    n = len(offsets) - 1
+    lengths = np.diff(offsets)
+    sources = np.repeat(np.arange(n), lengths)
+    weights = np.asarray(weights, dtype=np.float64)
+    # start from the lightest successor of every node
+    edge_weight = weights[targets]
+    policy = targets[first_argmin_by_segment(edge_weight, offsets)]
+    for _ in range(max_iter):
+        # value determination on the functional graph v -> policy[v]
+        eta, x, cycles = evaluate_policy(policy, weights)
+        # 1. move to a successor reaching a cycle of smaller mean
+        edge_eta = eta[targets]
+        best = first_argmin_by_segment(edge_eta, offsets)
+        improve = edge_eta[best] < eta - eps
+        if improve.any():
+            policy = np.where(improve, targets[best], policy)
+            continue
+        # 2. same cycle mean, smaller potential
+        value = np.where(np.abs(edge_eta - eta[sources]) <= eps, weights[sources] - eta[sources] + x[targets], np.inf)
+        best = first_argmin_by_segment(value, offsets)
+        improve = value[best] < x - eps
+        if not improve.any():
+            break
+        policy = np.where(improve, targets[best], policy)
+    cycle = min(cycles, key=lambda c: eta[c[0]])
+    return cycle, float(eta[cycle[0]])
+
+# index (into the whole edge array) of the first smallest value of every CSR segment
+def first_argmin_by_segment(values, offsets):
+    lengths = np.diff(offsets)
+    segment_min = np.minimum.reduceat(values, offsets[:-1])
+    hits = np.nonzero(values == np.repeat(segment_min, lengths))[0]
+    segments = np.repeat(np.arange(len(lengths)), lengths)[hits]
+    _, first = np.unique(segments, return_index=True)
+    return hits[first]
+
+# cycle means (eta) and potentials (x) of a policy: x[v] = w[v] - eta[v] + x[policy[v]]
+def evaluate_policy(policy, weights):
+    n = len(policy)
+    policy_ls = policy.tolist()
+    weights_ls = weights.tolist()
+    eta = [0.0] * n
+    x = [0.0] * n
+    state = [0] * n  # 0: new, 1: on the current walk, 2: done
+    cycles = []
+    for start in range(n):
+        if state[start] != 0:
+            continue
+        walk = []
+        v = start
+        while state[v] == 0:
+            state[v] = 1
+            walk.append(v)
+            v = policy_ls[v]
+        if state[v] == 1:
+            # a new cycle, from v to the end of the walk
+            cycle = walk[walk.index(v):]
+            mean = sum(weights_ls[u] for u in cycle) / len(cycle)
+            cycles.append(cycle)
+            x[cycle[0]] = 0.0
+            for u in reversed(cycle[1:]):
+                x[u] = weights_ls[u] - mean + x[policy_ls[u]]
+            for u in cycle:
+                eta[u] = mean
+                state[u] = 2
+            walk = walk[:walk.index(v)]
+        for u in reversed(walk):
+            eta[u] = eta[policy_ls[u]]
+            x[u] = weights_ls[u] - eta[u] + x[policy_ls[u]]
+            state[u] = 2
+    return np.array(eta), np.array(x), cycles
+
+# differential -> the number of active sbox, built on first access (see spn_core.active_sbox_table)
+def __getattr__(name):
+    if name == "ACTIVE_SBOX_TABLE":
+        return active_sbox_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# the rows of a CSR table (offsets, values) one after the other:
+# (index in rows of every gathered value, the gathered values)
+def csr_gather(offsets, values, rows):
+    counts = offsets[rows + 1] - offsets[rows]
+    starts = np.cumsum(counts) - counts
+    positions = np.repeat(offsets[rows] - starts, counts) + np.arange(int(counts.sum()), dtype=np.int64)
+    return np.repeat(np.arange(len(rows)), counts), values[positions]
+
+# min-plus product of cost (one entry per differential) with the sbox layer, one sbox at a time:
+# result[y] = min{ cost[x] + sum_j step_cost[x_j, y_j] } on a (2^SBOX_BITS, ..., 2^SBOX_BITS) array
+def sbox_layer_min_plus(cost, step_cost, NUM_SBOXES):
+    box_size = len(step_cost)
+    layer = cost.reshape((box_size,) * NUM_SBOXES)
+    for axis in range(NUM_SBOXES):
+        layer = np.moveaxis(layer, axis, -1)
+        layer = np.min(layer[..., :, None] + step_cost, axis=-2)
+        layer = np.moveaxis(layer, -1, axis)
+    return layer.reshape(-1)
 
 class active_sbox_analyzr():
     cipherN_paras = {
@@ -161,12 +211,36 @@ class active_sbox_analyzr():
         "do_pbox": do_pbox,
         "do_inv_pbox": do_inv_pbox
     }
+    # opt-in instrumentation (see enable_stats)
+    stats = None
+    # opt-in TableCache of the derived tables (see use_table_cache)
+    table_cache = None
 
     def __init__(self, cipherN_paras = None) -> None:
         if cipherN_paras != None:
             self.cipherN_paras = cipherN_paras
         self.Sbox = Sbox(self.cipherN_paras["Sbox"])
         self.Sbox_difference_table = self.Sbox.difference_distribution_dict()
+        self.round_function = get_round_function(
+            self.cipherN_paras["Sbox"], self.cipherN_paras["Pbox"],
+            self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
+        self.active_sbox_table = active_sbox_table(
+            self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
+
+    def enable_stats(self, stream=None):
+        # start collecting SearchStats, stream: optional JSON-lines file (path or file object)
+        self.stats = SearchStats(stream)
+        return self.stats
+
+    def disable_stats(self):
+        if self.stats is not None:
+            self.stats.close()
+        self.stats = None
+
+    def use_table_cache(self, cache=None, cache_dir="./table_cache", max_bytes=4 << 30):
+        # keep the bound tables in a TableCache (a new one in cache_dir if None)
+        self.table_cache = cache if cache is not None else TableCache(cache_dir, max_bytes)
+        return self.table_cache
        
     def compute_sbox_perm_diff(self, IN_NUM, filter=True):
         # IN_NUM: the input differential
@@ -175,25 +249,213 @@ class active_sbox_analyzr():
             IN_NUM, self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
         OUT_STATE = [self.Sbox_difference_table[state] for state in IN_STATE]
         temp_table = product(*OUT_STATE)
+        SBOX_BITS = self.cipherN_paras["SBOX_BITS"]
+        scale = 1 << (SBOX_BITS * self.cipherN_paras["NUM_SBOXES"])
         result_table = []
         for item in temp_table:
             prob = 1
-            out_state = []
+            out_number = 0
             for out_diff, p in item:
-                out_state.append(out_diff)
+                out_number = (out_number << SBOX_BITS) | out_diff
                 prob *= p
-            prob = prob / \
-                (1 << (self.cipherN_paras["SBOX_BITS"]
-                 * self.cipherN_paras["NUM_SBOXES"]))
+            prob = prob / scale
             if filter and prob < self.cipherN_paras["MIN_PROB"]:
                 # drop this item
                 continue
-            out_number = merge_Sbox_output(
-                out_state, self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
-            permed_state = do_pbox(out_number)
+            permed_state = self.round_function.perm(out_number)
             result_table.append((permed_state, prob))
         return result_table
     
+    def compute_active_sbox_lower_bounds(self, max_rounds = None, verbose = True, use_cache = True):
+        """Exact minimum number of active sboxes of r-round characteristics, r = 1, ..., max_rounds.
+        A min-plus dynamic program over all the differentials: cost[r][d] is the least number of
+        active sboxes of an r-round characteristic whose last sbox layer input is d, and
+            cost[r+1][e] = ACTIVE(e) + min{ cost[r][d] : e reachable from d through sbox layer and permutation }
+        Every DDT-possible transition is allowed (no MIN_PROB filter), so the numbers are guaranteed bounds.
+        The sbox layer is done one sbox at a time on a (2^SBOX_BITS, ..., 2^SBOX_BITS) array.
+        use_cache: go through the table cache (see use_table_cache) if there is one
+        Returns:
+            list: the minimum number of active sboxes of round 1, ..., max_rounds
+        """
+        if max_rounds is None:
+            max_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        if self.table_cache is not None and use_cache:
+            bounds = cached_bounds(self.table_cache, "active_sbox_bounds", box_parameters(self.cipherN_paras), max_rounds,
+                                   lambda r: self.compute_active_sbox_lower_bounds(r, False, use_cache=False))
+            if verbose:
+                for r, bound in enumerate(bounds, 1):
+                    print(f"[+] round {r}: minimum number of active sboxes = {bound}")
+            return bounds
+        SBOX_BITS, NUM_SBOXES = self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"]
+        box_size = 1 << SBOX_BITS
+        states = np.arange(1 << (SBOX_BITS * NUM_SBOXES), dtype=np.int64)
+        active = np.zeros(len(states), dtype=np.int64)
+        for j in range(NUM_SBOXES):
+            active += ((states >> (SBOX_BITS * j)) & (box_size - 1)) != 0
+        INF = 1 << 40
+        # step_cost[x, y] = 0 if x -> y is possible through the sbox, else INF
+        step_cost = np.where(self.Sbox.difference_distribution_table() > 0, 0, INF).astype(np.int64)
+        perm = self.round_function.perm_array(states)
+
+        cost = active.copy()
+        cost[0] = INF  # the zero differential is not a characteristic
+        bounds = [int(cost.min())]
+        if self.stats is not None:
+            self.stats.record_round(1, int(np.count_nonzero(cost < INF)), cost.nbytes, emit=True)
+        for r in range(2, max_rounds + 1):
+            with stats_phase(self.stats, "lower_bounds"):
+                permed = np.empty_like(cost)
+                permed[perm] = sbox_layer_min_plus(cost, step_cost, NUM_SBOXES)
+                cost = np.minimum(permed + active, INF)
+                bounds.append(int(cost.min()))
+            if self.stats is not None:
+                # live: the differentials reachable by an r-round characteristic, bytes: one sbox step of the DP
+                self.stats.record_round(r, int(np.count_nonzero(cost < INF)), cost.nbytes * (box_size + 2), emit=True)
+        if verbose:
+            for r, bound in enumerate(bounds, 1):
+                print(f"[+] round {r}: minimum number of active sboxes = {bound}")
+        return bounds
+
+    def compute_best_characteristic_weights(self, max_rounds = None, verbose = True, use_cache = True):
+        """Exact weight (-log2 of the probability) of the best r-round characteristics, r = 1, ..., max_rounds.
+        The same dynamic program as compute_active_sbox_lower_bounds with the sbox weights -log2(DDT[x, y] / 2^SBOX_BITS)
+        as costs: the max-product over the characteristics factorizes over the sboxes, so no sp_table is needed.
+        Returns:
+            list: the best weight of round 1, ..., max_rounds (prob = 2^-weight)
+        """
+        if max_rounds is None:
+            max_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        if self.table_cache is not None and use_cache:
+            weights = cached_bounds(self.table_cache, "best_weights", box_parameters(self.cipherN_paras), max_rounds,
+                                    lambda r: self.compute_best_characteristic_weights(r, False, use_cache=False))
+            if verbose:
+                for r, weight in enumerate(weights, 1):
+                    print(f"[+] round {r}: best characteristic probability = 2^-{weight:g}")
+            return weights
+        SBOX_BITS, NUM_SBOXES = self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"]
+        states = np.arange(1 << (SBOX_BITS * NUM_SBOXES), dtype=np.int64)
+        ddt = self.Sbox.difference_distribution_table()
+        with np.errstate(divide="ignore"):
+            step_cost = np.where(ddt > 0, SBOX_BITS - np.log2(np.maximum(ddt, 1)), np.inf)
+        perm = self.round_function.perm_array(states)
+
+        # cost[d]: best weight of the characteristics whose next sbox layer input is d
+        cost = np.zeros(len(states), dtype=np.float64)
+        cost[0] = np.inf  # the zero differential is not a characteristic
+        weights = []
+        for r in range(1, max_rounds + 1):
+            with stats_phase(self.stats, "best_weights"):
+                permed = np.empty_like(cost)
+                permed[perm] = sbox_layer_min_plus(cost, step_cost, NUM_SBOXES)
+                cost = permed
+                weights.append(float(cost.min()))
+        if verbose:
+            for r, weight in enumerate(weights, 1):
+                print(f"[+] round {r}: best characteristic probability = 2^-{weight:g}")
+        return weights
+
+    def compute_sbox_perm_support(self, IN_NUM):
+        # all the output differentials reachable from IN_NUM (DDT support, no MIN_PROB filter), as an array
+        SBOX_BITS = self.cipherN_paras["SBOX_BITS"]
+        ddt = self.Sbox.difference_distribution_table()
+        out_number = np.zeros(1, dtype=np.int64)
+        for state in parse_Sbox_input(IN_NUM, SBOX_BITS, self.cipherN_paras["NUM_SBOXES"]):
+            outs = np.nonzero(ddt[state])[0]
+            out_number = ((out_number[:, None] << SBOX_BITS) | outs[None, :]).ravel()
+        return self.round_function.perm_array(out_number)
+
+    def set_up_array_graph(self, filter_bound = None):
+        """Array-backed directed graph of the differentials with 1 ... filter_bound active sboxes
+        (all the nonzero differentials if filter_bound is None), edges are the DDT-possible transitions.
+        Returns:
+            (nodes, offsets, targets): node i is the differential nodes[i], its successors are the
+            node indices targets[offsets[i]:offsets[i+1]]
+        """
+        SBOX_BITS, NUM_SBOXES = self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"]
+        active = active_sbox_array(SBOX_BITS, NUM_SBOXES)
+        if filter_bound is None:
+            filter_bound = NUM_SBOXES
+        nodes = np.nonzero((active >= 1) & (active <= filter_bound))[0]
+        node_index = np.full(len(active), -1, dtype=np.int64)
+        node_index[nodes] = np.arange(len(nodes))
+        # the permutation is linear: the successors of a node are the XORs of the permuted outputs
+        # of its high sboxes with the ones of its low sboxes, both tabulated in CSR form
+        low = NUM_SBOXES // 2
+        low_bits = SBOX_BITS * low
+        high_offsets, high_values = self.sbox_layer_support(NUM_SBOXES - low, low_bits)
+        low_offsets, low_values = self.sbox_layer_support(low)
+        row_sizes = np.diff(high_offsets)[nodes >> low_bits] * np.diff(low_offsets)[nodes & ((1 << low_bits) - 1)]
+        # the rows are built for blocks of about 2^22 edges
+        bounds = np.searchsorted(np.cumsum(row_sizes), np.arange(1 << 22, int(row_sizes.sum()), 1 << 22))
+        lengths, blocks = [], []
+        for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(nodes)]])):
+            block = nodes[lo:hi]
+            rows, high_outs = csr_gather(high_offsets, high_values, block >> low_bits)
+            pairs, low_outs = csr_gather(low_offsets, low_values, (block & ((1 << low_bits) - 1))[rows])
+            successors = node_index[high_outs[pairs] ^ low_outs]
+            kept = successors >= 0
+            kept_before = np.zeros(len(kept) + 1, dtype=np.int64)
+            np.cumsum(kept, out=kept_before[1:])
+            row_ends = np.zeros(hi - lo + 1, dtype=np.int64)
+            np.cumsum(row_sizes[lo:hi], out=row_ends[1:])
+            lengths.append(np.diff(kept_before[row_ends]))
+            blocks.append(successors[kept])
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        if len(nodes) != 0:
+            np.cumsum(np.concatenate(lengths), out=offsets[1:])
+        targets = np.concatenate(blocks) if len(blocks) != 0 else np.zeros(0, dtype=np.int64)
+        return nodes, offsets, targets
+
+    def sbox_layer_support(self, num_sboxes, shift = 0):
+        """The DDT-possible outputs of num_sboxes sboxes placed at bit shift, through the permutation.
+        Returns:
+            (offsets, values): the permuted outputs of the input v (v << shift in the state) are
+            values[offsets[v]:offsets[v+1]], in the order of compute_sbox_perm_support
+        """
+        SBOX_BITS = self.cipherN_paras["SBOX_BITS"]
+        ddt = self.Sbox.difference_distribution_table()
+        support_offsets = np.zeros(len(ddt) + 1, dtype=np.int64)
+        np.cumsum(np.count_nonzero(ddt, axis=1), out=support_offsets[1:])
+        support = np.nonzero(ddt)[1].astype(np.int64)
+        inputs = np.arange(1 << (SBOX_BITS * num_sboxes), dtype=np.int64)
+        owners, outputs = np.arange(len(inputs)), np.zeros(len(inputs), dtype=np.int64)
+        # one sbox at a time, the most significant first (as parse_Sbox_input)
+        for j in reversed(range(num_sboxes)):
+            rows, outs = csr_gather(support_offsets, support, (inputs[owners] >> (SBOX_BITS * j)) & (len(ddt) - 1))
+            owners, outputs = owners[rows], (outputs[rows] << SBOX_BITS) | outs
+        offsets = np.zeros(len(inputs) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners, minlength=len(inputs)), out=offsets[1:])
+        return offsets, self.round_function.perm_array(outputs << shift)
+
+    def find_min_mean_active_sbox_cycle(self, filter_bound = 2, verbose = True):
+        """The cycle of differentials with the lowest average number of active sboxes per round,
+        among the differentials with at most filter_bound active sboxes (all of them if None).
+        Howard's policy iteration on the whole array graph, no candidate enumeration.
+        Returns:
+            (circle, avg_active_sbox_num), circle is a list of differentials (None if there is no cycle)
+        """
+        with stats_phase(self.stats, "set_up_array_graph"):
+            nodes, offsets, targets = self.set_up_array_graph(filter_bound)
+        with stats_phase(self.stats, "prune_dead_ends"):
+            kept, offsets, targets = prune_dead_ends(offsets, targets)
+        if self.stats is not None:
+            self.stats.count("graph_nodes", len(nodes))
+            self.stats.count("pruned_dead_ends", len(nodes) - len(kept))
+            self.stats.count("graph_edges", len(targets))
+        if len(kept) == 0:
+            if verbose:
+                print("[+] no circle found")
+            return None, None
+        nodes = nodes[kept]
+        weights = np.array(self.active_sbox_table)[nodes]
+        with stats_phase(self.stats, "min_mean_cycle"):
+            cycle, avg_active_sbox = min_mean_cycle(offsets, targets, weights)
+        circle = nodes[cycle].tolist()
+        if verbose:
+            print(f"[+] {len(nodes) = }, {len(targets) = }")
+            print(f"[+] circle with avg_active_sbox  ({circle}, {avg_active_sbox})")
+        return circle, avg_active_sbox
+
     def set_up_directed_graph(self, filter_bound = 1):
         """_summary_
         We view all the input differentials (s1,s2,s3,s4) as nodes in directed_graph
@@ -203,18 +465,23 @@ class active_sbox_analyzr():
             dict: key: start node, valus: [(end node, edge weight)]) ]
         """
         edges_table = {}
-        for IN_NUM in range(1 , 1 << (self.cipherN_paras["SBOX_BITS"]*self.cipherN_paras["NUM_SBOXES"])):
-                if ACTIVE_SBOX_TABLE[IN_NUM] > filter_bound :
-                    continue
-                OUT_NUMS = self.compute_sbox_perm_diff(IN_NUM,False)
-                candidate = []
-                for OUT_NUM, prob in OUT_NUMS:
-                    if ACTIVE_SBOX_TABLE[OUT_NUM] > filter_bound:
+        with stats_phase(self.stats, "set_up_directed_graph"):
+            for IN_NUM in range(1 , 1 << (self.cipherN_paras["SBOX_BITS"]*self.cipherN_paras["NUM_SBOXES"])):
+                    if self.active_sbox_table[IN_NUM] > filter_bound :
                         continue
-                    else:
-                        candidate.append((OUT_NUM,prob))
-                # print(f"{IN_NUM = } ,{candidate = }")
-                edges_table.setdefault(IN_NUM,candidate)
+                    OUT_NUMS = self.compute_sbox_perm_diff(IN_NUM,False)
+                    candidate = []
+                    for OUT_NUM, prob in OUT_NUMS:
+                        if self.active_sbox_table[OUT_NUM] > filter_bound:
+                            continue
+                        else:
+                            candidate.append((OUT_NUM,prob))
+                    # print(f"{IN_NUM = } ,{candidate = }")
+                    edges_table.setdefault(IN_NUM,candidate)
+                    if self.stats is not None:
+                        self.stats.count("nodes_expanded")
+                        self.stats.count("successors_generated", len(OUT_NUMS))
+                        self.stats.count("pruned_filter_bound", len(OUT_NUMS) - len(candidate))
         return edges_table
     
     def draw_directed_graph_of_active_sbox(self, filter_bound = 1):
@@ -224,6 +491,7 @@ class active_sbox_analyzr():
         draw_directed_graph(source,"Directed Graph of Active Sbox")
         
     def find_circle_of_one_active_sbox_path(self):
+        import networkx as nx
         source = self.set_up_directed_graph()
         G = nx.DiGraph()
         # load
@@ -235,7 +503,10 @@ class active_sbox_analyzr():
         print(f"[+] {len(G.nodes()) = }")
         print(f"[+] {len(G.edges()) = }")
         
-        cs = list(nx.simple_cycles(G))
+        with stats_phase(self.stats, "simple_cycles"):
+            cs = list(nx.simple_cycles(G))
+        if self.stats is not None:
+            self.stats.count("cycles_found", len(cs))
         if len(cs) != 0 :
             print("[+] circle found")
             for circle in cs:
@@ -252,11 +523,12 @@ class active_sbox_analyzr():
                 print(f"[+] {dag_longest_path = }")
                 
     def find_circle_with_extra_n_active_sbox_path(self, active_num_ls = [2,3], extra_nodes_num = 2):
+        import networkx as nx
         source = self.set_up_directed_graph(filter_bound = max(active_num_ls))
         G = nx.DiGraph()
         # load all one active_sbox
-        set_of_n_active_diffs = [x for x in source if ACTIVE_SBOX_TABLE[x] in active_num_ls]
-        set_of_1_active_diff = [x for x in source if ACTIVE_SBOX_TABLE[x]==1]
+        set_of_n_active_diffs = [x for x in source if self.active_sbox_table[x] in active_num_ls]
+        set_of_1_active_diff = [x for x in source if self.active_sbox_table[x]==1]
         assert len(set_of_1_active_diff) == 4*15
         candidates = combinations(set_of_n_active_diffs, extra_nodes_num)
         
@@ -265,7 +537,7 @@ class active_sbox_analyzr():
             edges = source[start_node]
             for end_node, w in edges:
                 if end_node in set_of_1_active_diff:
-                    G.add_edge(start_node, end_node, weight = ACTIVE_SBOX_TABLE[start_node] + ACTIVE_SBOX_TABLE[end_node])
+                    G.add_edge(start_node, end_node, weight = self.active_sbox_table[start_node] + self.active_sbox_table[end_node])
         print("[+] Nodes number : " , len(G.nodes()))
         print("[+] Edges number : " , len(G.edges())) 
         
@@ -276,24 +548,28 @@ class active_sbox_analyzr():
                 edges = source[start_node]
                 G.add_node(start_node)
                 for end_node, w in edges:
-                    if ACTIVE_SBOX_TABLE[end_node] == 2 and end_node not in candidate:
+                    if self.active_sbox_table[end_node] == 2 and end_node not in candidate:
                         continue
-                    G.add_edge(start_node, end_node, weight = ACTIVE_SBOX_TABLE[start_node] + ACTIVE_SBOX_TABLE[end_node])
+                    G.add_edge(start_node, end_node, weight = self.active_sbox_table[start_node] + self.active_sbox_table[end_node])
             for start_node in set_of_1_active_diff:
                 # add edges with start node = old node
                 edges = source[start_node]
                 for end_node, w in edges:
                     if end_node not in candidate:
                         continue
-                    G.add_edge(start_node, end_node, weight = ACTIVE_SBOX_TABLE[start_node] + ACTIVE_SBOX_TABLE[end_node])
+                    G.add_edge(start_node, end_node, weight = self.active_sbox_table[start_node] + self.active_sbox_table[end_node])
         
-            simple_cycles = list(nx.simple_cycles(G))
+            with stats_phase(self.stats, "simple_cycles"):
+                simple_cycles = list(nx.simple_cycles(G))
+            if self.stats is not None:
+                self.stats.count("candidates_tried")
+                self.stats.count("cycles_found", len(simple_cycles))
             if len(simple_cycles) == 0:
                 for start_node in candidate:
                     G.remove_node(start_node)
                 continue
             for circle in simple_cycles:
-                avg_active_sbox = count_active_sbox(circle)/len(circle)
+                avg_active_sbox = sum(self.active_sbox_table[x] for x in circle)/len(circle)
                 if best_circle[1] >= avg_active_sbox:
                     best_circle = (circle,avg_active_sbox)
                     print("[+] circle with avg_active_sbox " , best_circle)
@@ -304,4 +580,6 @@ if __name__ == "__main__":
     analyzer = active_sbox_analyzr()
     analyzer.find_circle_of_one_active_sbox_path()
     # analyzer.find_circle_with_extra_n_active_sbox_path([2,3],2)
+    analyzer.compute_active_sbox_lower_bounds(10)
+    analyzer.find_min_mean_active_sbox_cycle(2)
     
\ No newline at end of file
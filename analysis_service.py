@@ -0,0 +1,281 @@
+"""
+Long-running analysis service: the analyzers (DDT, active sbox table, sp_table) are set up
+once and kept warm, queries are answered over a local Unix socket.
+
+Protocol: one JSON object per line, in both directions
+    request:  {"id": 1, "method": "best_characteristic", "params": {"rounds": 5}}
+    response: {"id": 1, "result": ...}  or  {"id": 1, "error": "..."}
+Requests of a connection are served concurrently (the responses carry the request id), the
+queries are run by a fork process pool whose workers inherit the warm analyzers, and the
+answers are memoized in the server (LRU of MAX_CACHED_ANSWERS).
+
+    python analysis_service.py serve --socket ./analysis.sock --workers 4
+    python analysis_service.py query best_characteristic rounds=5
+    python analysis_service.py query top_characteristics input_diff=2816 rounds=4 topN=5
+
+Methods (see AnalysisService.METHODS): ping, best_characteristic, top_characteristics,
+active_sbox_bound, best_weights, cluster_probability, shutdown.
+
+Author: tl2cents 2022.11.22
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from collections import OrderedDict
+from differential_analysis import CipherN_analyzer
+from active_sbox_analysis import active_sbox_analyzr
+
+DEFAULT_SOCKET = "./analysis.sock"
+# memoized answers of the server, the least recently used ones are dropped beyond this
+MAX_CACHED_ANSWERS = 1024
+
+
+# numpy scalars / tuples -> plain JSON values
+def to_json_value(value):
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): to_json_value(v) for k, v in value.items()}
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class AnalysisService():
+    METHODS = ("ping", "best_characteristic", "top_characteristics", "active_sbox_bound", "best_weights",
+               "cluster_probability")
+
+    def __init__(self, cipherN_paras=None, sp_table_path="./sp_table", verbose=True) -> None:
+        start = time.time()
+        self.differential_analyzer = CipherN_analyzer(cipherN_paras)
+        if not self.differential_analyzer.load_sbox_perm_table(sp_table_path):
+            self.differential_analyzer.compute_sbox_perm_table(path=sp_table_path)
+        self.active_analyzer = active_sbox_analyzr(cipherN_paras)
+        self.setup_seconds = time.time() - start
+        if verbose:
+            print(f"[+] analyzers ready in {self.setup_seconds:.2f}s")
+
+    def run(self, method, params):
+        # answer one query, params: dict of keyword arguments of the method
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown method {method}!")
+        return to_json_value(getattr(self, method)(**params))
+
+    def ping(self):
+        return {"pid": os.getpid(), "setup_seconds": self.setup_seconds}
+
+    def best_characteristic(self, rounds=5, exact=False):
+        # the best characteristic of `rounds` rounds (Matsui search on sp_table): {"dc", "prob", "active_sbox_num"}
+        results = self.differential_analyzer.search_best_differential_characteristics(rounds, verbose=False, exact=exact)
+        if len(results) < rounds:
+            return None
+        dc, prob = results[-1]
+        active = sum(int(self.differential_analyzer.active_sbox_table[s]) for s in dc[:-1])
+        return {"dc": dc, "prob": prob, "active_sbox_num": active}
+
+    def top_characteristics(self, input_diff, rounds=5, topN=10, exact=False):
+        # the topN characteristics of input_diff by probability: [(dc, active_sbox_num, prob)]
+        by_prob, _, _ = self.differential_analyzer.rank_input_differences(input_diff, input_diff + 1, rounds, topN, exact)
+        return by_prob
+
+    def active_sbox_bound(self, rounds=10):
+        # minimum number of active sboxes of round 1, ..., rounds
+        return self.active_analyzer.compute_active_sbox_lower_bounds(rounds, verbose=False)
+
+    def best_weights(self, rounds=10):
+        # -log2 of the best characteristic probability of round 1, ..., rounds
+        return self.active_analyzer.compute_best_characteristic_weights(rounds, verbose=False)
+
+    def cluster_probability(self, input_diff, rounds=5, topN=10, output_diff=None):
+        # differential probabilities from input_diff: the topN [(output_diff, prob)], or the one of output_diff
+        # the output differentials are given before the last permutation (see compute_differential_probabilities)
+        analyzer = self.differential_analyzer
+        if output_diff is None:
+            return analyzer.compute_differential_probabilities(input_diff, rounds, topN, verbose=False)
+        res = analyzer.compute_differential_probabilities(input_diff, rounds, len(analyzer.sp_table), verbose=False)
+        return dict(res).get(output_diff, 0.0)
+
+
+# pool workers inherit the service through fork
+_WORKER_SERVICE = None
+
+def _init_worker(service):
+    global _WORKER_SERVICE
+    _WORKER_SERVICE = service
+
+def _run_query(method, params):
+    return _WORKER_SERVICE.run(method, params)
+
+
+class AnalysisServer():
+    def __init__(self, service, socket_path=DEFAULT_SOCKET, workers=None, max_cached=MAX_CACHED_ANSWERS) -> None:
+        self.service = service
+        self.socket_path = socket_path
+        self.workers = multiprocessing.cpu_count() if workers is None else workers
+        # (method, params) -> answer, an LRU of at most max_cached answers
+        self.cache = OrderedDict()
+        self.max_cached = max_cached
+        self.pool = None
+        self.server = None
+        self.stopped = None
+
+    def make_pool(self):
+        if self.workers <= 0:
+            return None
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+        return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context,
+                                                      initializer=_init_worker, initargs=(self.service,))
+
+    def remember(self, key, result):
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+
+    async def answer(self, request):
+        request_id = request.get("id")
+        try:
+            method, params = request["method"], request.get("params", {})
+            if method == "shutdown":
+                self.stopped.set()
+                return {"id": request_id, "result": "bye"}
+            if method not in AnalysisService.METHODS:
+                raise ValueError(f"Unknown method {method}!")
+            key = (method, json.dumps(params, sort_keys=True))
+            if method != "ping" and key in self.cache:
+                self.cache.move_to_end(key)
+                return {"id": request_id, "result": self.cache[key]}
+            if self.pool is None:
+                result = self.service.run(method, params)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.pool, _run_query, method, params)
+            if method != "ping":
+                self.remember(key, result)
+            return {"id": request_id, "result": result}
+        except Exception as error:
+            return {"id": request_id, "error": f"{type(error).__name__}: {error}"}
+
+    async def handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+
+        async def respond(request):
+            response = await self.answer(request)
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    request = {"method": None, "invalid": str(error)}
+                task = asyncio.create_task(respond(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except (asyncio.CancelledError, ConnectionResetError):
+            # the server is shutting down or the client went away
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.stopped = asyncio.Event()
+        self.pool = self.make_pool()
+        self.server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path)
+        print(f"[+] serving on {self.socket_path} with {self.workers} workers")
+        try:
+            async with self.server:
+                await self.stopped.wait()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(cancel_futures=True)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            print("[+] server stopped")
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+
+class AnalysisClient():
+    # blocking client, for notebooks and CI jobs: AnalysisClient().query("active_sbox_bound", rounds=8)
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.file = self.sock.makefile("rwb")
+        self.next_id = 0
+
+    def query(self, method, **params):
+        self.next_id += 1
+        self.file.write((json.dumps({"id": self.next_id, "method": method, "params": params}) + "\n").encode())
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# "name=value" -> (name, JSON value, or the string itself)
+def parse_param(item):
+    name, value = item.split("=", 1)
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CipherN analysis service.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="set up the analyzers and serve queries")
+    serve.add_argument("--workers", type=int, default=None, help="pool size (cpu count by default, 0: no pool)")
+    serve.add_argument("--sp-table", default="./sp_table")
+    serve.add_argument("--max-cached", type=int, default=MAX_CACHED_ANSWERS, help="memoized answers kept (LRU)")
+    query = commands.add_parser("query", help="send one query and print the JSON answer")
+    query.add_argument("method")
+    query.add_argument("params", nargs="*", help="name=value, values are parsed as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        AnalysisServer(AnalysisService(sp_table_path=args.sp_table), args.socket, args.workers,
+                       args.max_cached).serve_forever()
+        return 0
+    with AnalysisClient(args.socket) as client:
+        print(json.dumps(client.query(args.method, **dict(parse_param(p) for p in args.params))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Benchmarks of the hot paths: the cipher, the Sbox tables, the sp_table build,
+the characteristic expansion and the active sbox cycle searches.
+
+Every benchmark is timed `repeat` times (the best time is kept) and run once more
+under tracemalloc for its peak memory. The results are written as JSON and can be
+compared with a stored baseline, a benchmark slower (or bigger) than the baseline by
+more than the tolerance is reported as a regression and the exit status is 1.
+
+    python benchmark.py --quick --output bench.json
+    python benchmark.py --save-baseline                  # store ./benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json
+    python benchmark.py --check                          # best characteristic search against the DP
+
+Author: tl2cents 2022.11.22
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+# name -> function(quick) returning (run, items): run() does the timed work, items is the work size
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+_ANALYZERS = {}
+
+# one analyzer with a loaded (or computed, in memory only) sp_table per NUM_ROUNDS, the setup is not timed
+def differential_analyzer(num_rounds=10):
+    from differential_analysis import CipherN_analyzer
+    if num_rounds not in _ANALYZERS:
+        paras = dict(CipherN_analyzer.cipherN_paras)
+        paras["NUM_ROUNDS"] = num_rounds
+        analyzer = CipherN_analyzer(paras)
+        if not analyzer.load_sbox_perm_table():
+            # the benchmarks do not write ./sp_table
+            analyzer.compute_sbox_perm_table(saved=False)
+        _ANALYZERS[num_rounds] = analyzer
+    return _ANALYZERS[num_rounds]
+
+
+@benchmark("cipher_encrypt")
+def bench_cipher_encrypt(quick):
+    from CipherN import keyGeneration, encrypt
+    key = keyGeneration()
+    pts = range(1 << (12 if quick else 16))
+    return lambda: [encrypt(pt, key) for pt in pts], len(pts)
+
+
+@benchmark("cipher_decrypt")
+def bench_cipher_decrypt(quick):
+    from CipherN import keyGeneration, decrypt
+    key = keyGeneration()
+    cts = range(1 << (12 if quick else 16))
+    return lambda: [decrypt(ct, key) for ct in cts], len(cts)
+
+
+@benchmark("cipher_encrypt_batch")
+def bench_cipher_encrypt_batch(quick):
+    from CipherN import keyGeneration, parse_subkeys, encrypt_batch
+    subKeys = parse_subkeys(keyGeneration())
+    pts = np.random.default_rng(0).integers(0, 1 << 16, 1 << (20 if quick else 24), dtype=np.uint16)
+    return lambda: encrypt_batch(pts, subKeys), len(pts)
+
+
+@benchmark("cipher_decrypt_batch")
+def bench_cipher_decrypt_batch(quick):
+    from CipherN import keyGeneration, parse_subkeys, decrypt_batch
+    subKeys = parse_subkeys(keyGeneration())
+    cts = np.random.default_rng(0).integers(0, 1 << 16, 1 << (20 if quick else 24), dtype=np.uint16)
+    return lambda: decrypt_batch(cts, subKeys), len(cts)
+
+
+def random_box(nbits, seed=0):
+    permutation = np.random.default_rng(seed).permutation(1 << nbits).tolist()
+    return dict(enumerate(permutation))
+
+
+@benchmark("ddt_4bit")
+def bench_ddt_4bit(quick):
+    from SBox import Sbox
+    from spn_core import sbox
+    return lambda: Sbox(sbox).difference_distribution_table(), 1
+
+
+@benchmark("ddt_8bit")
+def bench_ddt_8bit(quick):
+    from SBox import Sbox
+    box = random_box(8)
+    return lambda: Sbox(box).difference_distribution_table(), 1
+
+
+@benchmark("lat_8bit")
+def bench_lat_8bit(quick):
+    from SBox import Sbox
+    box = random_box(8)
+    return lambda: Sbox(box).linear_approximation_table(), 1
+
+
+@benchmark("bct_8bit")
+def bench_bct_8bit(quick):
+    from SBox import Sbox
+    box = random_box(8)
+    return lambda: Sbox(box).boomerang_connectivity_table(), 1
+
+
+def sp_table_benchmark(quick, filter):
+    analyzer = differential_analyzer()
+    if quick:
+        rows = range(0, 1 << 16, 16)
+        return lambda: sum(len(analyzer.compute_sbox_perm_row(i, filter)[0]) for i in rows), len(rows)
+    return lambda: len(analyzer.compute_sbox_perm_table(saved=False, filter=filter).dests), 1 << 16
+
+
+@benchmark("sp_table_filter")
+def bench_sp_table_filter(quick):
+    return sp_table_benchmark(quick, True)
+
+
+@benchmark("sp_table_no_filter")
+def bench_sp_table_no_filter(quick):
+    return sp_table_benchmark(quick, False)
+
+
+# expand_differential_characteristics on every step-th input differential, one benchmark per round count
+def characteristics_benchmark(num_rounds):
+    def bench(quick):
+        analyzer = differential_analyzer(num_rounds)
+        inputs = range(1, 1 << 16, 256 if quick else 16)
+
+        def run():
+            return sum(len(analyzer.expand_differential_characteristics(i)[num_rounds]) for i in inputs)
+        return run, len(inputs)
+    return bench
+
+
+# the same expansion in a PathArena, all the inputs at once
+def path_arena_benchmark(num_rounds):
+    def bench(quick):
+        analyzer = differential_analyzer(num_rounds)
+        inputs = range(1, 1 << 16, 256 if quick else 16)
+        return lambda: analyzer.build_path_arena(inputs, num_rounds).level_size(num_rounds), len(inputs)
+    return bench
+
+
+for _num_rounds in range(1, 6):
+    benchmark(f"characteristics_round_{_num_rounds}")(characteristics_benchmark(_num_rounds))
+    benchmark(f"path_arena_round_{_num_rounds}")(path_arena_benchmark(_num_rounds))
+
+
+@benchmark("active_sbox_one_cycle")
+def bench_active_sbox_one_cycle(quick):
+    from active_sbox_analysis import active_sbox_analyzr
+    analyzer = active_sbox_analyzr()
+    return analyzer.find_circle_of_one_active_sbox_path, 1
+
+
+@benchmark("active_sbox_extra_cycle")
+def bench_active_sbox_extra_cycle(quick):
+    from active_sbox_analysis import active_sbox_analyzr
+    analyzer = active_sbox_analyzr()
+    active_num_ls = [2] if quick else [2, 3]
+    return lambda: analyzer.find_circle_with_extra_n_active_sbox_path(active_num_ls, 1), 1
+
+
+@benchmark("active_sbox_min_mean_cycle")
+def bench_active_sbox_min_mean_cycle(quick):
+    from active_sbox_analysis import active_sbox_analyzr
+    analyzer = active_sbox_analyzr()
+    return lambda: analyzer.find_min_mean_active_sbox_cycle(2, verbose=False), 1
+
+
+def run_benchmark(name, quick=False, repeat=3, memory=True):
+    run, items = BENCHMARKS[name](quick)
+    times = []
+    # the benchmarked functions print their results, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        peak = None
+        if memory:
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return {
+        "wall_time": min(times),
+        "wall_times": times,
+        "peak_bytes": peak,
+        "items": items,
+        "items_per_second": items / min(times) if min(times) > 0 else None,
+    }
+
+
+def run_benchmarks(names=None, quick=False, repeat=3, memory=True, verbose=True):
+    names = list(BENCHMARKS) if not names else names
+    results = {}
+    for name in names:
+        results[name] = run_benchmark(name, quick, repeat, memory)
+        if verbose:
+            peak = results[name]["peak_bytes"]
+            peak = f"{peak / 2**20:10.2f} MiB" if peak is not None else " " * 14
+            print(f"[+] {name:<30} {results[name]['wall_time']:10.4f} s {peak}")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "quick": quick,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare_with_baseline(report, baseline, tolerance=0.2, verbose=True):
+    """Compare wall time and peak memory of the benchmarks present in both reports.
+    Returns:
+        list: [(name, metric, baseline value, value, ratio)] of the regressions (ratio > 1 + tolerance)
+    """
+    if baseline["meta"].get("quick") != report["meta"].get("quick"):
+        print("[!] the baseline and this run do not use the same --quick setting")
+    regressions = []
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        for metric in ("wall_time", "peak_bytes"):
+            old, new = baseline["results"][name].get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            ratio = new / old
+            if verbose:
+                flag = "REGRESSION" if ratio > 1 + tolerance else ("faster" if ratio < 1 - tolerance else "")
+                print(f"[+] {name:<30} {metric:<10} {old:14.4f} -> {new:14.4f} ({ratio:6.2f}x) {flag}")
+            if ratio > 1 + tolerance:
+                regressions.append((name, metric, old, new, ratio))
+    return regressions
+
+
+# the best characteristic search against the DP on random designs filtered by MIN_PROB, where the
+# best path of a round often ends at an empty sp_table row (the generate_design seeds 0 and 9 do)
+def check_best_characteristics(seeds=(0, 9), min_prob=0.03, max_rounds=8, verbose=True):
+    from differential_analysis import CipherN_analyzer
+    from design_exploration import generate_design
+    failures = []
+    for seed in seeds:
+        sbox, pbox = generate_design(seed)
+        paras = dict(CipherN_analyzer.cipherN_paras)
+        paras.update({"Sbox": sbox, "Pbox": pbox, "MIN_PROB": min_prob, "NUM_ROUNDS": max_rounds})
+        analyzer = CipherN_analyzer(paras)
+        with contextlib.redirect_stderr(io.StringIO()):
+            analyzer.compute_sbox_perm_table(saved=False)
+        for exact in (False, True):
+            mismatches = analyzer.check_best_differential_characteristics(max_rounds, exact)
+            failures += [(seed, exact) + mismatch for mismatch in mismatches]
+            if verbose:
+                print(f"[+] design seed {seed} (exact = {exact}): {'ok' if not mismatches else mismatches}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the CipherN analysis hot paths.")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, for a fast check")
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="run these benchmarks only")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the best one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON report of this run")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare with")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="also write this run to --baseline (./benchmark_baseline.json by default)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown / growth")
+    parser.add_argument("--check", action="store_true",
+                        help="only check the best characteristic search against the DP, no benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = check_best_characteristics()
+        if failures:
+            print(f"[!] {len(failures)} rounds where the search and the DP differ")
+            return 1
+        print("[+] the search matches the DP")
+        return 0
+
+    report = run_benchmarks(args.only, args.quick, args.repeat, not args.no_memory)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[+] report written to {args.output}")
+
+    if args.save_baseline:
+        baseline_path = args.baseline or "benchmark_baseline.json"
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[+] baseline written to {baseline_path}")
+    elif args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"[!] {len(regressions)} regressions against {args.baseline}")
+            return 1
+        print(f"[+] no regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Full-codebook mode: with a 16-bit block the codebook of a key is only 2^16 blocks, so the
+reduced-round cipher DDT of a fixed key can be computed exactly.
+
+The codebook is encrypt_batch over all the plaintexts (one vectorized pass), then the
+row of an input difference a is
+    DDT_k[a, b] = #{x : C_k(x) ^ C_k(x ^ a) = b}
+computed with one XOR and one bincount (blocks of rows at once). The output difference of
+encrypt(nround=r) is the one of r rounds before the last permutation, as returned by
+CipherN_analyzer.compute_differential_probabilities(.., round_num=r), so the per-key exact
+probabilities DDT_k[a, b] / 2^16 can be compared with the Markov-cipher estimates and the
+key dependence measured over many keys.
+
+Author: tl2cents 2022.11.22
+"""
+
+import multiprocessing
+import time
+import numpy as np
+from CipherN import keyGeneration, parse_subkeys, encrypt_batch, blockSize
+
+CODEBOOK_SIZE = 1 << blockSize
+
+
+def full_codebook(subKeys, nround=4):
+    # C_k(x) for every plaintext x, subKeys from parse_subkeys
+    return encrypt_batch(np.arange(CODEBOOK_SIZE, dtype=np.uint16), subKeys, nround)
+
+
+def random_subkeys(nround=4, rng=None):
+    # independent uniform round keys (keyGeneration if rng is None)
+    if rng is None:
+        return parse_subkeys(keyGeneration(), nround)
+    return rng.integers(0, CODEBOOK_SIZE, nround + 1, dtype=np.uint16)
+
+
+def codebook_ddt(codebook, input_diffs):
+    """Exact counts of the output differences of the codebook for the given input differences.
+    Returns:
+        np.ndarray: (len(input_diffs), 2^16) uint32 table, row i is the DDT row of input_diffs[i]
+        (every row sums to 2^16, a pair is counted from both of its plaintexts)
+    """
+    input_diffs = np.asarray(input_diffs, dtype=np.int64).reshape(-1)
+    x = np.arange(CODEBOOK_SIZE, dtype=np.int64)
+    out_diffs = codebook[None, :] ^ codebook[x[None, :] ^ input_diffs[:, None]]
+    index = (np.arange(len(input_diffs), dtype=np.int64)[:, None] << blockSize) | out_diffs
+    counts = np.bincount(index.ravel(), minlength=len(input_diffs) << blockSize)
+    return counts.reshape(len(input_diffs), CODEBOOK_SIZE).astype(np.uint32)
+
+
+def iter_codebook_ddt(codebook, input_diffs=None, block_size=64):
+    # (input_diffs block, codebook_ddt of the block), over all the nonzero input differences if None
+    # the full table is 2^32 counts, so it is only ever held block_size rows at a time
+    if input_diffs is None:
+        input_diffs = np.arange(1, CODEBOOK_SIZE)
+    input_diffs = np.asarray(input_diffs, dtype=np.int64)
+    for start in range(0, len(input_diffs), block_size):
+        block = input_diffs[start:start + block_size]
+        yield block, codebook_ddt(codebook, block)
+
+
+def codebook_max_differentials(codebook, input_diffs=None, block_size=64):
+    """The best output difference of every input difference for this key.
+    Returns:
+        (input_diffs, best_out_diffs, best_counts): arrays, prob = count / 2^16
+    """
+    diffs, outs, counts = [], [], []
+    for block, table in iter_codebook_ddt(codebook, input_diffs, block_size):
+        best = table.argmax(axis=1)
+        diffs.append(block)
+        outs.append(best)
+        counts.append(table[np.arange(len(block)), best])
+    return np.concatenate(diffs), np.concatenate(outs), np.concatenate(counts)
+
+
+def _uniformity_job(args):
+    key_index, subKeys, nround, block_size = args
+    diffs, outs, counts = codebook_max_differentials(full_codebook(subKeys, nround), None, block_size)
+    best = int(np.argmax(counts))
+    return key_index, int(diffs[best]), int(outs[best]), int(counts[best])
+
+
+def codebook_differential_uniformity(nround=4, num_keys=4, seed=None, workers=None, block_size=64, verbose=True):
+    """The best (input_diff, output_diff, count) over all the input differences, for num_keys random keys.
+    Returns:
+        list: [(subKeys, input_diff, output_diff, count)] one per key, prob = count / 2^16
+    """
+    rng = np.random.default_rng(seed)
+    keys = [random_subkeys(nround, rng) for _ in range(num_keys)]
+    jobs = [(i, subKeys, nround, block_size) for i, subKeys in enumerate(keys)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    start_time = time.time()
+    if workers > 1:
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+        with context.Pool(workers) as pool:
+            results = sorted(pool.imap_unordered(_uniformity_job, jobs))
+    else:
+        results = [_uniformity_job(job) for job in jobs]
+    results = [(keys[i].tolist(), a, b, count) for i, a, b, count in results]
+    if verbose:
+        print(f"[+] {nround}-round codebook DDTs of {num_keys} keys in {time.time() - start_time:.1f}s")
+        for subKeys, a, b, count in results:
+            print(f"[+] subKeys = {subKeys}: best differential {a} -> {b}, prob = {count}/2^{blockSize}")
+        print()
+    return results
+
+
+def key_dependence(input_diff, output_diffs, nround=4, num_keys=64, seed=None):
+    """Exact per-key probabilities of the differentials input_diff -> output_diffs over num_keys random keys.
+    Returns:
+        np.ndarray: (num_keys, len(output_diffs)) probabilities
+    """
+    rng = np.random.default_rng(seed)
+    output_diffs = np.asarray(output_diffs, dtype=np.int64)
+    probs = np.zeros((num_keys, len(output_diffs)), dtype=np.float64)
+    for i in range(num_keys):
+        row = codebook_ddt(full_codebook(random_subkeys(nround, rng), nround), [input_diff])[0]
+        probs[i] = row[output_diffs] / CODEBOOK_SIZE
+    return probs
+
+
+def compare_with_markov(analyzer, input_diff, nround=4, topN=10, num_keys=64, seed=None, verbose=True):
+    """The Markov-cipher estimates of analyzer.compute_differential_probabilities (topN output differences)
+    against the exact per-key probabilities of the codebook.
+    Returns:
+        list: [{"output_diff", "markov_prob", "mean", "std", "min", "max"}], the statistics are over the keys
+    """
+    markov = analyzer.compute_differential_probabilities(input_diff, nround, topN, verbose=False)
+    probs = key_dependence(input_diff, [out for out, _ in markov], nround, num_keys, seed)
+    result = []
+    for j, (out, markov_prob) in enumerate(markov):
+        column = probs[:, j]
+        result.append({"output_diff": out, "markov_prob": markov_prob, "mean": float(column.mean()),
+                       "std": float(column.std()), "min": float(column.min()), "max": float(column.max())})
+    if verbose:
+        print(f"[+] {nround}-round differentials from input_diff = {input_diff}, exact over {num_keys} keys")
+        for entry in result:
+            print(f"output_diff = {entry['output_diff']}: markov = {entry['markov_prob']:.6g}, "
+                  f"key mean = {entry['mean']:.6g}, std = {entry['std']:.3g}, "
+                  f"range = [{entry['min']:.6g}, {entry['max']:.6g}]")
+        print()
+    return result
+
+
+if __name__ == "__main__":
+    from differential_analysis import CipherN_analyzer
+    analyzer = CipherN_analyzer()
+    if not analyzer.load_sbox_perm_table():
+        analyzer.compute_sbox_perm_table()
+    dc, _ = analyzer.search_best_differential_characteristics(3, verbose=False)[-1]
+    compare_with_markov(analyzer, dc[0], 3)
+    codebook_differential_uniformity(3, num_keys=2)
@@ -0,0 +1,197 @@
+"""
+Design space exploration: random (Sbox, Pbox) candidates scored over a process pool.
+
+Every candidate is made from its own seed (so a result can be rebuilt from the file)
+and goes through the filters from the cheapest to the most expensive one, the first
+failing filter abandons it:
+    1. Sbox: maximal difference probability (fetch_max_prob_io) and maximal linear bias
+    2. Pbox: diffusion, the least number of sboxes reached by the outputs of one sbox
+    3. active sbox lower bound of `rounds` rounds (compute_active_sbox_lower_bounds)
+    4. best characteristic probability of `rounds` rounds (compute_best_characteristic_weights)
+The surviving designs are ranked by best characteristic weight (higher is better), then
+active sbox bound, then Sbox uniformity, and the topN are written to a JSON file.
+
+    python design_exploration.py -n 5000 --rounds 5 --output design_results.json
+
+Author: tl2cents 2022.11.22
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import time
+from SBox import Sbox
+from round_function import get_round_function
+from active_sbox_analysis import active_sbox_analyzr
+from differential_analysis import atomic_write
+
+
+def generate_design(seed, SBOX_BITS=4, NUM_SBOXES=4):
+    # the (sbox, pbox) of a seed, the same way as generate_Sbox / generate_permutation
+    rng = random.Random(seed)
+    S = list(range(2**SBOX_BITS))
+    rng.shuffle(S)
+    P = list(range(SBOX_BITS * NUM_SBOXES))
+    rng.shuffle(P)
+    return {i: j for i, j in enumerate(S)}, {i: j for i, j in enumerate(P)}
+
+
+# the least number of sboxes reached by the (single bit) outputs of one sbox through the permutation
+def pbox_diffusion(round_function, SBOX_BITS=4, NUM_SBOXES=4):
+    mask = (1 << SBOX_BITS) - 1
+    diffusion = NUM_SBOXES
+    for j in range(NUM_SBOXES):
+        reached = set()
+        for bit in range(SBOX_BITS):
+            permed = round_function.perm(1 << (SBOX_BITS * j + bit))
+            reached.update(k for k in range(NUM_SBOXES) if (permed >> (SBOX_BITS * k)) & mask)
+        diffusion = min(diffusion, len(reached))
+    return diffusion
+
+
+def evaluate_design(seed, settings):
+    """Score the design of seed, settings: the filters (see explore_designs).
+    Returns:
+        dict: seed, the scores computed so far and "rejected" (the failed filter, None if the design passed all)
+    """
+    SBOX_BITS, NUM_SBOXES, rounds = settings["SBOX_BITS"], settings["NUM_SBOXES"], settings["rounds"]
+    sbox, pbox = generate_design(seed, SBOX_BITS, NUM_SBOXES)
+    result = {"seed": seed, "rejected": None}
+
+    S = Sbox(sbox)
+    result["max_diff_prob"] = float(S.fetch_max_prob_io()[0])
+    result["max_linear_bias"] = float(S.maximal_linear_bias())
+    if result["max_diff_prob"] > settings["max_diff_prob"] or result["max_linear_bias"] > settings["max_linear_bias"]:
+        result["rejected"] = "sbox"
+        return result
+
+    round_function = get_round_function(sbox, pbox, SBOX_BITS, NUM_SBOXES)
+    result["diffusion"] = pbox_diffusion(round_function, SBOX_BITS, NUM_SBOXES)
+    if result["diffusion"] < settings["min_diffusion"]:
+        result["rejected"] = "pbox"
+        return result
+
+    paras = dict(active_sbox_analyzr.cipherN_paras)
+    paras.update({"NUM_ROUNDS": rounds, "SBOX_BITS": SBOX_BITS, "NUM_SBOXES": NUM_SBOXES, "Sbox": sbox, "Pbox": pbox})
+    analyzer = active_sbox_analyzr(paras)
+    result["active_sbox_bounds"] = analyzer.compute_active_sbox_lower_bounds(rounds, verbose=False)
+    if result["active_sbox_bounds"][-1] < settings["min_active"]:
+        result["rejected"] = "active_sbox"
+        return result
+
+    result["best_weights"] = analyzer.compute_best_characteristic_weights(rounds, verbose=False)
+    if result["best_weights"][-1] < settings["min_weight"]:
+        result["rejected"] = "probability"
+        return result
+    result["sbox"] = [sbox[i] for i in range(len(sbox))]
+    result["pbox"] = [pbox[i] for i in range(len(pbox))]
+    return result
+
+
+_WORKER_SETTINGS = None
+
+def _init_worker(settings):
+    global _WORKER_SETTINGS
+    _WORKER_SETTINGS = settings
+
+def _evaluate_design(seed):
+    return evaluate_design(seed, _WORKER_SETTINGS)
+
+
+def design_rank_key(result):
+    return (-result["best_weights"][-1], -result["active_sbox_bounds"][-1], result["max_diff_prob"],
+            result["max_linear_bias"], result["seed"])
+
+
+def explore_designs(num_candidates=1000, rounds=5, SBOX_BITS=4, NUM_SBOXES=4, seed=0, workers=None, topN=20,
+                    max_diff_prob=None, max_linear_bias=None, min_diffusion=None, min_active=0, min_weight=0.0,
+                    output="design_results.json", verbose=True):
+    """Score the candidates of seeds seed, ..., seed + num_candidates - 1 over a process pool.
+    max_diff_prob, max_linear_bias: Sbox filters, both 4 / 2^SBOX_BITS (optimal 4-bit sboxes) if None
+    min_diffusion: Pbox filter, NUM_SBOXES - 1 if None (full diffusion is rare for random permutations, ~0.5% of 16-bit ones)
+    min_active, min_weight: least active sbox bound / best characteristic weight of `rounds` rounds
+    Returns:
+        dict: the settings, the rejection counts per filter, the topN designs (ranked) and the timing,
+        also written to output (if not None)
+    """
+    settings = {
+        "SBOX_BITS": SBOX_BITS,
+        "NUM_SBOXES": NUM_SBOXES,
+        "rounds": rounds,
+        "max_diff_prob": 4 / 2**SBOX_BITS if max_diff_prob is None else max_diff_prob,
+        "max_linear_bias": 4 / 2**SBOX_BITS if max_linear_bias is None else max_linear_bias,
+        "min_diffusion": NUM_SBOXES - 1 if min_diffusion is None else min_diffusion,
+        "min_active": min_active,
+        "min_weight": min_weight,
+    }
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    seeds = range(seed, seed + num_candidates)
+    rejected = {"sbox": 0, "pbox": 0, "active_sbox": 0, "probability": 0}
+    passed = []
+    start = time.time()
+    if workers <= 1:
+        results = (evaluate_design(s, settings) for s in seeds)
+        pool = None
+    else:
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+        pool = context.Pool(workers, initializer=_init_worker, initargs=(settings,))
+        results = pool.imap_unordered(_evaluate_design, seeds, chunksize=16)
+    try:
+        for result in results:
+            if result["rejected"] is None:
+                passed.append(result)
+            else:
+                rejected[result["rejected"]] += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.time() - start
+    passed.sort(key=design_rank_key)
+    report = {
+        "settings": dict(settings, seed=seed, num_candidates=num_candidates),
+        "rejected": rejected,
+        "passed": len(passed),
+        "seconds": elapsed,
+        "candidates_per_hour": num_candidates / elapsed * 3600 if elapsed > 0 else None,
+        "designs": passed[:topN],
+    }
+    if output is not None:
+        atomic_write(output, json.dumps(report, indent=2).encode())
+    if verbose:
+        print(f"[+] {num_candidates} candidates in {elapsed:.1f}s, rejected: {rejected}, passed: {len(passed)}")
+        for rank, design in enumerate(passed[:topN], 1):
+            print(f"[+] #{rank} seed = {design['seed']}: best {rounds}-round weight = {design['best_weights'][-1]:g}, "
+                  f"active sbox bound = {design['active_sbox_bounds'][-1]}, max_diff_prob = {design['max_diff_prob']}")
+        if output is not None:
+            print(f"[+] ranked designs written to {output}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Random (Sbox, Pbox) design space exploration.")
+    parser.add_argument("-n", "--num-candidates", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5, help="rounds of the active sbox bound and characteristic scores")
+    parser.add_argument("--seed", type=int, default=0, help="first candidate seed")
+    parser.add_argument("--workers", type=int, default=None, help="pool size, cpu count by default")
+    parser.add_argument("--top", type=int, default=20, help="number of designs kept in the results file")
+    parser.add_argument("--max-diff-prob", type=float, default=None)
+    parser.add_argument("--max-linear-bias", type=float, default=None)
+    parser.add_argument("--min-diffusion", type=int, default=None)
+    parser.add_argument("--min-active", type=int, default=0)
+    parser.add_argument("--min-weight", type=float, default=0.0)
+    parser.add_argument("--output", default="design_results.json")
+    args = parser.parse_args(argv)
+    explore_designs(args.num_candidates, args.rounds, seed=args.seed, workers=args.workers, topN=args.top,
+                    max_diff_prob=args.max_diff_prob, max_linear_bias=args.max_linear_bias,
+                    min_diffusion=args.min_diffusion, min_active=args.min_active, min_weight=args.min_weight,
+                    output=args.output)
+
+
+if __name__ == "__main__":
+    main()
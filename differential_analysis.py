@@ -1,74 +1,23 @@
 from SBox import Sbox
+from round_function import get_round_function
 from itertools import product
 from tqdm import tqdm
 import pickle
-
-# (1) Substitution: 4x4 bijective, one sbox used for all 4 sub-blocks of size 4. Nibble wise
-sbox = {0: 0xE, 1: 0x4, 2: 0xD, 3: 0x1, 4: 0x2, 5: 0xF, 6: 0xB, 7: 0x8, 8: 0x3,
-        9: 0xA, 0xA: 0x6, 0xB: 0xC, 0xC: 0x5, 0xD: 0x9, 0xE: 0x0, 0xF: 0x7}  # key:value
-sbox_inv = {0xE: 0, 0x4: 1, 0xD: 2, 0x1: 3, 0x2: 4, 0xF: 5, 0xB: 6, 0x8: 7,
-            0x3: 8, 0xA: 9, 0x6: 0xA, 0xC: 0xB, 0x5: 0xC, 0x9: 0xD, 0x0: 0xE, 0x7: 0xF}
-
-# (2) Permutation. Applied bit-wise
-pbox = {0: 0, 1: 4, 2: 8, 3: 12, 4: 1, 5: 5, 6: 9, 7: 13,
-        8: 2, 9: 6, 10: 10, 11: 14, 12: 3, 13: 7, 14: 11, 15: 15}
-pbox_inv = {0: 0, 4: 1, 8: 2, 12: 3, 1: 4, 5: 5, 9: 6, 13: 7,
-            2: 8, 6: 9, 10: 10, 14: 11, 3: 12, 7: 13, 11: 14, 15: 15}
-
-# modify accordingly
-def do_sbox(number):
-    return sbox[number]
-
-# modify accordingly
-def do_inv_sbox(number):
-    return sbox_inv[number]
-
-# modify accordingly
-def do_pbox(number):
-    number_temp = 0
-    for bitIdx in range(0, 16):
-        if (number & (1 << bitIdx)):
-            number_temp |= (1 << pbox[bitIdx])
-    number = number_temp
-    return number
-
-# modify accordingly
-def do_inv_pbox(state):
-    state_temp = 0
-    for bitIdx in range(0, 16):
-        if (state & (1 << bitIdx)):
-            state_temp |= (1 << pbox_inv[bitIdx])
-    state = state_temp
-    return state
-
-# convert an integer to the input of Sbox
-def parse_Sbox_input(input_number, SBOX_BITS=4, NUM_SBOXES=4):
-    mask = (1 << SBOX_BITS) - 1
-    STATE = []
-    for i in range(NUM_SBOXES):
-        STATE.append(mask & input_number)
-        input_number = input_number >> SBOX_BITS
-    return STATE[::-1]
-
-# merge the output of Sbox to an integer
-def merge_Sbox_output(STATE, SBOX_BITS=4, NUM_SBOXES=4):
-    assert len(STATE) == NUM_SBOXES
-    out_number = 0
-    for state in STATE:
-        out_number = (out_number << SBOX_BITS) | state
-    return out_number
-
-# compute the active sbox number table of 16-bit differential
-def compute_active_sbox_table():
-    table = []
-    for i in range(2**16):
-        diff_ls = parse_Sbox_input(i)
-        cnt = 0
-        for sub_diff in diff_ls:
-            if sub_diff !=0:
-                cnt+=1
-        table.append(cnt)
-    return table
+import heapq
+import os
+import shutil
+import tempfile
+import multiprocessing
+import math
+import json
+from fractions import Fraction
+import numpy as np
+from sp_table import SPTable, SP_TABLE_FILES
+from path_arena import PathArena
+from search_stats import SearchStats, stats_phase, approx_path_bytes
+from table_cache import TableCache, box_parameters, canonical_parameters
+from spn_core import (sbox, sbox_inv, pbox, pbox_inv, do_sbox, do_inv_sbox, do_pbox, do_inv_pbox,
+                      parse_Sbox_input, active_sbox_array, active_sbox_table)
 
 
 from multiprocessing import Process
@@ -78,20 +27,114 @@ def multi_work(iter_function, totalProcess = 8, lenList = 2**16, base=0):
     print("Totally %d processes" % totalProcess)
 
     for i in range(totalProcess):
-        process = Process(target=iter_function, args=(base + i * gap, base + (i + 1) * gap))
+        # the last process also takes the remainder
+        end = base + lenList if i == totalProcess - 1 else base + (i + 1) * gap
+        process = Process(target=iter_function, args=(base + i * gap, end))
         process.start()
         process_list.append(process)
 
     for t in process_list:
         t.join()
     print("Exiting Main Process")
-    
-# a global table : differential -> the number of active sbox of the input differential 
-ACTIVE_SBOX_TABLE = compute_active_sbox_table()
 
-# count the number of of active sbox of the input differential characteristics
-def count_active_sbox(dc):
-    return sum([ACTIVE_SBOX_TABLE[diff] for diff in dc])
+# split range(base, base + lenList) into chunks of (almost) the same cost
+# costs: the cost of each index, equal sizes if None
+def balanced_chunks(chunks_num, lenList = 2**16, base=0, costs=None):
+    if costs is None:
+        costs = np.ones(lenList, dtype=np.int64)
+    cumulative = np.concatenate([[0], np.cumsum(costs)])
+    bounds = np.searchsorted(cumulative, np.linspace(0, cumulative[-1], chunks_num + 1), side="left")
+    bounds[0], bounds[-1] = 0, lenList
+    bounds = np.unique(bounds)
+    return [(base + int(lo), base + int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+# process pool whose workers inherit the analyzer through fork (no pickling of big tables)
+_WORKER_ANALYZER = None
+
+def _init_worker(analyzer):
+    global _WORKER_ANALYZER
+    _WORKER_ANALYZER = analyzer
+
+def analyzer_pool(analyzer, workers):
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        context = multiprocessing.get_context()
+    return context.Pool(workers, initializer=_init_worker, initargs=(analyzer,))
+
+def _fill_sbox_perm_rows(args):
+    # write rows [lo, hi) straight into the memory-mapped table at path
+    lo, hi, filter, path = args
+    offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+    dests = np.load(os.path.join(path, "dests.npy"), mmap_mode="r+")
+    probs = np.load(os.path.join(path, "probs.npy"), mmap_mode="r+")
+    for i in range(lo, hi):
+        row_dests, row_probs = _WORKER_ANALYZER.compute_sbox_perm_row(i, filter)
+        dests[offsets[i]:offsets[i + 1]] = row_dests
+        probs[offsets[i]:offsets[i + 1]] = row_probs
+    dests.flush()
+    probs.flush()
+    return hi - lo
+
+def _build_sbox_perm_rows(args):
+    # build rows [lo, hi) once, save them to chunk_dir and return their lengths
+    lo, hi, filter, chunk_dir = args
+    rows = [_WORKER_ANALYZER.compute_sbox_perm_row(i, filter) for i in range(lo, hi)]
+    np.save(os.path.join(chunk_dir, f"dests_{lo:05d}.npy"), np.concatenate([dests for dests, _ in rows]))
+    np.save(os.path.join(chunk_dir, f"probs_{lo:05d}.npy"), np.concatenate([probs for _, probs in rows]))
+    return lo, hi, np.array([len(dests) for dests, _ in rows], dtype=np.int64)
+
+def _rank_input_differences(args):
+    lo, hi, round_num, topN, exact = args
+    return _WORKER_ANALYZER.rank_input_differences(lo, hi, round_num, topN, exact)
+
+# write a file so that it is either complete or absent: temporary file in the same directory + rename
+def atomic_write(path, data: bytes):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# a global table : differential -> the number of active sbox of the input differential
+# built on first access (see spn_core.active_sbox_table)
+def __getattr__(name):
+    if name == "ACTIVE_SBOX_TABLE":
+        return active_sbox_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# integer weight ceil(-log2 prob) of an exact characteristic: prob = count / 2^(state_bits * round_num)
+def characteristic_weight(count, round_num, state_bits=16):
+    return state_bits * round_num - (count.bit_length() - 1)
+
+# keep the topN characteristics (dc, active_sbox_num, dc_prob) of a stream, both by dc_prob and by active_sbox_num
+# bounded heaps: O(total * log(topN)) time and O(topN) memory, ties keep the earlier characteristic
+def top_differential_characteristics(characteristics, topN=10):
+    by_prob, by_active_sbox_num = [], []
+    total = 0
+    for item in characteristics:
+        total += 1
+        active_sbox_num, prob = item[1], item[-1]
+        # the heap roots are the worst characteristics kept so far
+        entry = (prob, -active_sbox_num, -total, item)
+        if len(by_prob) < topN:
+            heapq.heappush(by_prob, entry)
+        elif entry[:3] > by_prob[0][:3]:
+            heapq.heapreplace(by_prob, entry)
+        entry = (-active_sbox_num, prob, -total, item)
+        if len(by_active_sbox_num) < topN:
+            heapq.heappush(by_active_sbox_num, entry)
+        elif entry[:3] > by_active_sbox_num[0][:3]:
+            heapq.heapreplace(by_active_sbox_num, entry)
+    by_prob = [entry[-1] for entry in sorted(by_prob, key=lambda x: x[:3], reverse=True)]
+    by_active_sbox_num = [entry[-1] for entry in sorted(by_active_sbox_num, key=lambda x: x[:3], reverse=True)]
+    return by_prob, by_active_sbox_num, total
 
 # the differential characteristic analyzer
 class CipherN_analyzer():
@@ -111,14 +154,54 @@ class CipherN_analyzer():
         "do_inv_pbox": do_inv_pbox
     }
     sp_table = None
-    differential_characteristic_table = []
+    # all the characteristics of the nonzero input differentials as a PathArena (see compute_path_arena)
+    path_arena = None
+    # the transposed sp_table (backward transitions) and the table it was made from
+    sp_table_transposed = None
+    sp_table_transposed_source = None
+    # opt-in instrumentation (see enable_stats), the counters of pool workers are not collected
+    stats = None
+    # opt-in TableCache of the derived tables (see use_table_cache)
+    table_cache = None
 
     def __init__(self, cipherN_paras = None) -> None:
         if cipherN_paras != None:
             self.cipherN_paras = cipherN_paras
         self.Sbox = Sbox(self.cipherN_paras["Sbox"])
         self.Sbox_difference_table = self.Sbox.difference_distribution_dict()
+        self.round_function = get_round_function(
+            self.cipherN_paras["Sbox"], self.cipherN_paras["Pbox"],
+            self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
+        self.active_sbox_table = active_sbox_table(
+            self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
+        self.state_bits = self.cipherN_paras["SBOX_BITS"] * self.cipherN_paras["NUM_SBOXES"]
+        # integer counts and sorted rows of sp_table, derived on first use (see set_sbox_perm_table)
+        self.sp_counts = None
+        self.sorted_sp_rows = {}
+        # whether sp_table was built with the MIN_PROB filter (None before there is one)
+        self.sp_table_filter = None
+        # the characteristics of every input differential (see compute_all_differential_characteristics)
+        self.differential_characteristic_table = []
+        # DDT support of every sbox input difference, as arrays for compute_sbox_perm_row
+        ddt = self.Sbox.difference_distribution_table()
+        self.Sbox_support = [np.nonzero(ddt[a])[0].astype(np.uint64) for a in range(self.Sbox.box_size)]
+        self.Sbox_counts = [ddt[a][ddt[a] != 0].astype(np.float64) for a in range(self.Sbox.box_size)]
        
+    def enable_stats(self, stream=None):
+        # start collecting SearchStats, stream: optional JSON-lines file (path or file object)
+        self.stats = SearchStats(stream)
+        return self.stats
+
+    def disable_stats(self):
+        if self.stats is not None:
+            self.stats.close()
+        self.stats = None
+
+    def use_table_cache(self, cache=None, cache_dir="./table_cache", max_bytes=4 << 30):
+        # keep the derived tables in a TableCache (a new one in cache_dir if None)
+        self.table_cache = cache if cache is not None else TableCache(cache_dir, max_bytes)
+        return self.table_cache
+
     def compute_sbox_perm_diff(self, IN_NUM, filter=True):
         # IN_NUM: the input differential
         # IN_STATE is a list of 4 4-bit number in this cipher
@@ -126,127 +209,717 @@ class CipherN_analyzer():
             IN_NUM, self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
         OUT_STATE = [self.Sbox_difference_table[state] for state in IN_STATE]
         temp_table = product(*OUT_STATE)
+        SBOX_BITS = self.cipherN_paras["SBOX_BITS"]
+        scale = 1 << (SBOX_BITS * self.cipherN_paras["NUM_SBOXES"])
         result_table = []
         for item in temp_table:
             prob = 1
-            out_state = []
+            out_number = 0
             for out_diff, p in item:
-                out_state.append(out_diff)
+                out_number = (out_number << SBOX_BITS) | out_diff
                 prob *= p
-            prob = prob / \
-                (1 << (self.cipherN_paras["SBOX_BITS"]
-                 * self.cipherN_paras["NUM_SBOXES"]))
+            prob = prob / scale
             if filter and prob < self.cipherN_paras["MIN_PROB"]:
                 # drop this item
                 continue
-            out_number = merge_Sbox_output(
-                out_state, self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
-            permed_state = do_pbox(out_number)
+            permed_state = self.round_function.perm(out_number)
             result_table.append((permed_state, prob))
         return result_table
         
-    def compute_sbox_perm_table(self, saved  = True, filter = True):
-        sp_table = []
-        for i in tqdm(range(2**16)):
-            table = self.compute_sbox_perm_diff(i,filter)
-            sp_table.append(table)
+    def compute_sbox_perm_row(self, IN_NUM, filter=True):
+        # numpy version of compute_sbox_perm_diff, same rows in the same order
+        # return (permed_states, probs) arrays
+        SBOX_BITS = self.cipherN_paras["SBOX_BITS"]
+        IN_STATE = parse_Sbox_input(
+            IN_NUM, SBOX_BITS, self.cipherN_paras["NUM_SBOXES"])
+        out_number = np.zeros(1, dtype=np.uint64)
+        count = np.ones(1, dtype=np.float64)
+        for state in IN_STATE:
+            out_number = ((out_number[:, None] << np.uint64(SBOX_BITS))
+                          | self.Sbox_support[state][None, :]).ravel()
+            count = (count[:, None] * self.Sbox_counts[state][None, :]).ravel()
+        probs = count / (1 << (SBOX_BITS * self.cipherN_paras["NUM_SBOXES"]))
+        if self.stats is not None:
+            self.stats.count("successors_generated", len(probs))
+        if filter:
+            keep = probs >= self.cipherN_paras["MIN_PROB"]
+            out_number, probs = out_number[keep], probs[keep]
+            if self.stats is not None:
+                self.stats.count("pruned_min_prob", len(keep) - len(probs))
+        return self.round_function.perm_array(out_number).astype(np.uint16), probs
+
+    def compute_sbox_perm_table(self, saved  = True, filter = True, path="./sp_table", workers=1):
+        # the table is kept in CSR form (see sp_table.py), saved as memory-mappable .npy files
+        if workers > 1:
+            with stats_phase(self.stats, "sp_table"):
+                return self.compute_sbox_perm_table_parallel(saved, filter, path, workers)
+        row_dests, row_probs = [], []
+        with stats_phase(self.stats, "sp_table"):
+            for i in tqdm(range(2**16)):
+                dests, probs = self.compute_sbox_perm_row(i, filter)
+                row_dests.append(dests)
+                row_probs.append(probs)
+            sp_table = SPTable.from_arrays(row_dests, row_probs)
+        if self.stats is not None:
+            self.stats.count("sp_table_entries", len(sp_table.dests))
+            self.stats.count("sp_table_bytes", sp_table.nbytes())
         if saved:
-            pickle.dump(sp_table, open("./sp_table.pickle", "wb"))
-        self.sp_table = sp_table
+            self.discard_sbox_perm_table_parameters(path)
+            sp_table.save(path)
+            self.save_sbox_perm_table_parameters(path, filter)
+        self.set_sbox_perm_table(sp_table, filter)
+        return sp_table
+
+    def compute_sbox_perm_table_parallel(self, saved = True, filter = True, path="./sp_table", workers=8):
+        # without the filter the row lengths are the products of the DDT row supports: the offsets give
+        # a memory-mapped table on disk and the workers write chunks of rows straight into it
+        # with the filter: the workers build chunks of rows once into temporary files and return their
+        # lengths, then the offsets give the table on disk and the chunks are copied in
+        # (the chunks are balanced by the unfiltered row sizes in both cases)
+        out_path = path if saved else tempfile.mkdtemp(prefix="sp_table_")
+        self.discard_sbox_perm_table_parameters(out_path)
+        SBOX_BITS, NUM_SBOXES = self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"]
+        support_lengths = np.array([len(support) for support in self.Sbox_support], dtype=np.int64)
+        states = np.arange(2**16, dtype=np.int64)
+        costs = np.ones(2**16, dtype=np.int64)
+        for j in range(NUM_SBOXES):
+            costs *= support_lengths[(states >> (SBOX_BITS * j)) & ((1 << SBOX_BITS) - 1)]
+        chunks = balanced_chunks(workers * 4, costs=costs)
+        offsets = np.zeros(2**16 + 1, dtype=np.int64)
+        if not filter:
+            np.cumsum(costs, out=offsets[1:])
+            SPTable.create(out_path, offsets)
+            with analyzer_pool(self, workers) as pool, tqdm(total=2**16) as bar:
+                for done in pool.imap_unordered(_fill_sbox_perm_rows, [(lo, hi, filter, out_path) for lo, hi in chunks]):
+                    bar.update(done)
+        else:
+            chunk_dir = tempfile.mkdtemp(prefix="sp_table_chunks_", dir=os.path.dirname(os.path.abspath(out_path)))
+            try:
+                row_lengths = np.zeros(2**16, dtype=np.int64)
+                with analyzer_pool(self, workers) as pool, tqdm(total=2**16) as bar:
+                    for lo, hi, lengths in pool.imap_unordered(_build_sbox_perm_rows,
+                                                               [(lo, hi, filter, chunk_dir) for lo, hi in chunks]):
+                        row_lengths[lo:hi] = lengths
+                        bar.update(hi - lo)
+                np.cumsum(row_lengths, out=offsets[1:])
+                SPTable.create(out_path, offsets)
+                dests = np.load(os.path.join(out_path, "dests.npy"), mmap_mode="r+")
+                probs = np.load(os.path.join(out_path, "probs.npy"), mmap_mode="r+")
+                for lo, hi in chunks:
+                    dests[offsets[lo]:offsets[hi]] = np.load(os.path.join(chunk_dir, f"dests_{lo:05d}.npy"))
+                    probs[offsets[lo]:offsets[hi]] = np.load(os.path.join(chunk_dir, f"probs_{lo:05d}.npy"))
+                dests.flush()
+                probs.flush()
+                del dests, probs
+            finally:
+                shutil.rmtree(chunk_dir, ignore_errors=True)
+        if saved:
+            sp_table = SPTable.load(out_path)
+            self.save_sbox_perm_table_parameters(out_path, filter)
+        else:
+            sp_table = SPTable.load(out_path, mmap=False)
+            shutil.rmtree(out_path)
+        self.set_sbox_perm_table(sp_table, filter)
         return sp_table
 
-    def load_sbox_perm_table(self, path="./sp_table.pickle"):
+    def set_sbox_perm_table(self, sp_table, filter=True):
+        # the tables derived from the previous sp_table are dropped with it
+        # filter: whether sp_table was built with the MIN_PROB filter
+        self.sp_table = sp_table
+        self.sp_table_filter = filter
+        self.sp_counts = None
+        self.sorted_sp_rows = {}
+
+    def sbox_perm_table_parameters(self, filter=True):
+        # the parameters sp_table depends on
+        parameters = box_parameters(self.cipherN_paras)
+        parameters["MIN_PROB"] = self.cipherN_paras["MIN_PROB"] if filter else None
+        return parameters
+
+    def save_sbox_perm_table_parameters(self, path, filter=True):
+        atomic_write(os.path.join(path, "parameters.json"),
+                     json.dumps(canonical_parameters(self.sbox_perm_table_parameters(filter))).encode())
+
+    def discard_sbox_perm_table_parameters(self, path):
+        # the table in path is about to be rewritten, it has no parameters until it is complete
+        parameters_path = os.path.join(path, "parameters.json")
+        if os.path.exists(parameters_path):
+            os.remove(parameters_path)
+
+    def check_sbox_perm_table_parameters(self, path, filter=True):
+        # a table is only trusted with the parameters.json saved along with it, and they must match
+        parameters_path = os.path.join(path, "parameters.json")
+        if not os.path.exists(parameters_path):
+            return False
+        with open(parameters_path, "r") as f:
+            return json.load(f) == canonical_parameters(self.sbox_perm_table_parameters(filter))
+
+    def load_sbox_perm_table(self, path="./sp_table", filter=True):
+        # path: a CSR table directory (memory mapped) with its parameters.json
+        # a table made for other parameters (Sbox, Pbox, MIN_PROB filter) or without parameters.json
+        # (an old table or pickled table) is not loaded, it has to be computed again
         try:
-            with open(path, "rb") as f:
-                self.sp_table = pickle.load(f)
+            if not self.check_sbox_perm_table_parameters(path, filter):
+                print(f"[!] {path} has no parameters.json or was made for other parameters, it is not loaded")
+                return False
+            self.set_sbox_perm_table(SPTable.load(path), filter)
             return True
         except Exception as error:
             print(error)
             return False
 
-    def compute_all_differential_characteristics(self):
+    def load_or_compute_sbox_perm_table(self, filter=True, workers=1):
+        """sp_table from the table cache (see use_table_cache), computed and stored on a miss.
+        Without a table cache, ./sp_table is loaded if its parameters.json matches the parameters, else it is
+        computed and saved again with its parameters.json.
+        """
+        if self.table_cache is None:
+            if not self.load_sbox_perm_table(filter=filter):
+                self.compute_sbox_perm_table(filter=filter, workers=workers)
+            return self.sp_table
+
+        def compute():
+            table = self.compute_sbox_perm_table(saved=False, filter=filter, workers=workers)
+            return {name: getattr(table, name) for name in SP_TABLE_FILES}
+
+        arrays = self.table_cache.get_or_compute("sp_table", self.sbox_perm_table_parameters(filter), compute, mmap=True)
+        self.set_sbox_perm_table(SPTable(*[arrays[name] for name in SP_TABLE_FILES]), filter)
+        return self.sp_table
+
+    def sbox_perm_counts(self):
+        # exact integer counts of sp_table (out of 2^state_bits), computed once per table
+        if self.sp_counts is None:
+            self.sp_counts = self.sp_table.counts(self.state_bits)
+        return self.sp_counts
+
+    def sbox_perm_row(self, IN_NUM, exact=False):
+        # row of sp_table as python lists, probs or exact integer counts
+        dests, probs = self.sp_table.row(IN_NUM)
+        if exact:
+            counts = self.sbox_perm_counts()
+            probs = counts[self.sp_table.offsets[IN_NUM]:self.sp_table.offsets[IN_NUM + 1]]
+        return dests.tolist(), probs.tolist()
+
+    def path_min_counts(self, num_rounds):
+        # PATH_MIN_PROB as exact integer counts: r-round paths need count >= min_counts[r] (out of 2^(state_bits * r))
+        path_min_prob = Fraction(self.cipherN_paras["PATH_MIN_PROB"])
+        return [math.ceil(path_min_prob * 2**(self.state_bits * r)) for r in range(num_rounds + 1)]
+
+    def expand_differential_characteristics(self, IN_NUM, num_rounds=None, exact=False):
+        # all the characteristics starting from IN_NUM with prob >= PATH_MIN_PROB, one list per round
+        # exact: the characteristics carry integer counts (prob = count / 2^(state_bits * round)) instead of probs
+        if num_rounds is None:
+            num_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        differential_characteristics_table = [[([IN_NUM],0, 1)]]
+        # ([i],1): ([input_diff,..,output_diff], the diff prob)
+        if exact:
+            min_probs = self.path_min_counts(num_rounds)
+        else:
+            min_probs = [self.cipherN_paras["PATH_MIN_PROB"]] * (num_rounds + 1)
+        stats = self.stats
+        for Round in range(1, num_rounds + 1):
+            diff_table = []
+            generated = 0
+            for item in differential_characteristics_table[Round - 1]:
+                prob = item[2]
+                active_sbox_num = item[1]
+                differential_characteristic = item[0][:]  # copy by slice
+                current_diff = differential_characteristic[-1]
+                # if it's the last round, we will not add the active sbox num since it's over
+                # new_active_sbox_num : new_diff is not included
+                new_active_sbox_num = active_sbox_num + self.active_sbox_table[current_diff]
+                next_diffs, next_probs = self.sbox_perm_row(current_diff, exact)
+                generated += len(next_diffs)
+                for diff, p in zip(next_diffs, next_probs):
+                    new_prob = prob*p
+                    if new_prob < min_probs[Round]:
+                        # drop low probablity item
+                        continue
+                    else:
+                        new_diff = differential_characteristic + [diff]
+                        diff_table.append((new_diff, new_active_sbox_num, new_prob))
+            differential_characteristics_table.append(diff_table)
+            if stats is not None:
+                # every successor not kept was dropped by PATH_MIN_PROB
+                stats.count("nodes_expanded", len(differential_characteristics_table[Round - 1]))
+                stats.count("successors_generated", generated)
+                stats.count("pruned_path_min_prob", generated - len(diff_table))
+                stats.record_round(Round, len(diff_table), len(diff_table) * approx_path_bytes(Round + 1))
+        return differential_characteristics_table
+
+    def compute_all_differential_characteristics(self, checkpoint_dir=None, chunk_size=1024):
+        # checkpoint_dir: flush the finished input differential ranges there, a rerun resumes (see below)
+        if checkpoint_dir is not None:
+            return self.compute_all_differential_characteristics_checkpointed(checkpoint_dir, chunk_size)
         # have been computed 
         table = []
         for i in tqdm(range(2**16)):
-            differential_characteristics_table = [[([i],0, 1)]]
-            # ([i],1): ([input_diff,..,output_diff], the diff prob)
-            for Round in range(1, self.cipherN_paras["NUM_ROUNDS"] + 1):
-                diff_table = []
-                for item in differential_characteristics_table[Round - 1]:
-                    prob = item[2]
-                    active_sbox_num = item[1]
-                    differential_characteristic = item[0][:]  # copy by slice
-                    current_diff = differential_characteristic[-1]
-                    # if it's the last round, we will not add the active sbox num since it's over
-                    # new_active_sbox_num : new_diff is not included
-                    new_active_sbox_num = active_sbox_num + ACTIVE_SBOX_TABLE[current_diff]
-                    next_diffs = self.sp_table[current_diff]
-                    for diff, p in next_diffs:
-                        new_prob = prob*p
-                        if new_prob < self.cipherN_paras["PATH_MIN_PROB"]:
-                            # drop low probablity item
-                            continue
-                        else:
-                            new_diff = differential_characteristic + [diff]
-                            diff_table.append((new_diff, new_active_sbox_num, new_prob))
-                differential_characteristics_table.append(diff_table)
-            table.append(differential_characteristics_table)
-        self.differential_characteristic_table.extend(table)
+            table.append(self.expand_differential_characteristics(i))
+        self.differential_characteristic_table = table
         return table
-        
-    def sort_differential_characteristics_by_prob(self, round_num=5, topN=10):
-        if len(self.differential_characteristic_table) != 0:
-            all_input_differential_characteristics = self.differential_characteristic_table
+
+    def checkpoint_parameters(self, chunk_size):
+        # the parameters a checkpoint was made with (boxes and sp_table included), a resumed run must use the same
+        parameters = box_parameters(self.cipherN_paras)
+        parameters.update({
+            "NUM_ROUNDS": self.cipherN_paras["NUM_ROUNDS"],
+            "MIN_PROB": self.cipherN_paras["MIN_PROB"],
+            "PATH_MIN_PROB": self.cipherN_paras["PATH_MIN_PROB"],
+            "sp_table_filter": self.sp_table_filter,
+            "chunk_size": chunk_size,
+        })
+        # as stored in manifest.json (the box dicts as item lists)
+        return canonical_parameters(parameters)
+
+    def load_checkpoint_manifest(self, checkpoint_dir, chunk_size=1024):
+        # manifest.json: {"parameters": .., "completed": [[lo, hi], ..]}, a new one if there is none
+        manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+        parameters = self.checkpoint_parameters(chunk_size)
+        if not os.path.exists(manifest_path):
+            return {"parameters": parameters, "completed": []}
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        assert manifest["parameters"] == parameters, \
+            f"Checkpoint {checkpoint_dir} was made with {manifest['parameters']}, not {parameters}!"
+        return manifest
+
+    def compute_all_differential_characteristics_checkpointed(self, checkpoint_dir="./dc_checkpoint", chunk_size=1024):
+        """compute_all_differential_characteristics in ranges of chunk_size input differentials.
+        Every finished range is pickled to checkpoint_dir/chunk_<lo>_<hi>.pickle and recorded in
+        checkpoint_dir/manifest.json, both written atomically (a crash loses the current range at most).
+        A rerun with the same checkpoint_dir skips the recorded ranges, the chunks are merged at the end.
+        Returns:
+            list: the same table as compute_all_differential_characteristics
+        """
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        manifest = self.load_checkpoint_manifest(checkpoint_dir, chunk_size)
+        completed = set(tuple(r) for r in manifest["completed"])
+        ranges = [(lo, min(lo + chunk_size, 2**16)) for lo in range(0, 2**16, chunk_size)]
+        with tqdm(total=2**16, initial=sum(hi - lo for lo, hi in completed)) as bar:
+            for lo, hi in ranges:
+                if (lo, hi) in completed:
+                    continue
+                chunk = [self.expand_differential_characteristics(i) for i in range(lo, hi)]
+                atomic_write(os.path.join(checkpoint_dir, f"chunk_{lo:05d}_{hi:05d}.pickle"), pickle.dumps(chunk))
+                completed.add((lo, hi))
+                manifest["completed"] = sorted(completed)
+                atomic_write(os.path.join(checkpoint_dir, "manifest.json"), json.dumps(manifest).encode())
+                bar.update(hi - lo)
+        table = self.load_differential_characteristics(checkpoint_dir, chunk_size)
+        return table
+
+    def load_differential_characteristics(self, checkpoint_dir="./dc_checkpoint", chunk_size=1024):
+        # merge the finished chunks of a checkpoint in input differential order (a partial run gives a partial table)
+        manifest = self.load_checkpoint_manifest(checkpoint_dir, chunk_size)
+        table = []
+        for lo, hi in sorted(tuple(r) for r in manifest["completed"]):
+            with open(os.path.join(checkpoint_dir, f"chunk_{lo:05d}_{hi:05d}.pickle"), "rb") as f:
+                table.extend(pickle.load(f))
+        if len(table) == 2**16:
+            self.differential_characteristic_table = table
+        return table
+
+    def build_path_arena(self, IN_NUMS, num_rounds=None, exact=False):
+        # expand the input differentials IN_NUMS together, round by round, into a PathArena
+        # same characteristics (in the same order) as expand_differential_characteristics
+        if num_rounds is None:
+            num_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        arena = PathArena(IN_NUMS)
+        active = active_sbox_array(self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
+        counts = self.sbox_perm_counts() if exact else None
+        for Round in range(1, num_rounds + 1):
+            generated = arena.extend(self.sp_table, active, self.cipherN_paras["PATH_MIN_PROB"], counts)
+            if self.stats is not None:
+                self.stats.count("nodes_expanded", arena.level_size(Round - 1))
+                self.stats.count("successors_generated", generated)
+                self.stats.count("pruned_path_min_prob", generated - arena.level_size(Round))
+                self.stats.record_round(Round, arena.level_size(Round), arena.level_nbytes(Round))
+        return arena
+
+    def compute_path_arena(self, num_rounds=None, exact=False):
+        # all the characteristics of the nonzero input differentials, kept as one PathArena
+        # the compact counterpart of compute_all_differential_characteristics, used by the ranking if present
+        self.path_arena = self.build_path_arena(range(1, 2**16), num_rounds, exact)
+        return self.path_arena
+
+    def rank_input_differences(self, lo, hi, round_num=5, topN=10, exact=False, chunk_size=4096):
+        """Top-N characteristics of round round_num over the input differentials lo, .., hi - 1.
+        The inputs are expanded chunk by chunk in a PathArena, only the top-N paths of every chunk are rebuilt.
+        Returns:
+            (by_prob, by_active_sbox_num, total) as top_differential_characteristics
+        """
+        candidates, total = [], 0
+        for start in range(lo, hi, chunk_size):
+            arena = self.build_path_arena(range(start, min(start + chunk_size, hi)), round_num, exact)
+            by_prob, by_active_sbox_num = arena.top(round_num, topN)
+            # in arena order, which is the order of the stream, so that ties are broken the same way
+            candidates += arena.characteristics(round_num, np.union1d(by_prob, by_active_sbox_num), exact)
+            total += arena.level_size(round_num)
+        by_prob, by_active_sbox_num, _ = top_differential_characteristics(candidates, topN)
+        return by_prob, by_active_sbox_num, total
+
+    def generate_differential_characteristics(self, round_num=5, exact=False, chunk_size=4096):
+        # yield the characteristics of round round_num one by one, the zero input differential is skipped
+        # without a computed table, the input differentials are expanded chunk by chunk in a PathArena
+        if self.path_arena is not None and self.path_arena.num_rounds >= round_num and \
+                (not exact or len(self.path_arena.counts[-1]) == self.path_arena.level_size(-1)):
+            yield from self.path_arena.iter_characteristics(round_num, exact)
+        elif len(self.differential_characteristic_table) != 0 and not exact:
+            for differential_characteristic_i in self.differential_characteristic_table[1:]:
+                yield from differential_characteristic_i[round_num]
         else:
-            all_input_differential_characteristics = self.compute_all_differential_characteristics()
-        final_table = []
-        for input_diff, differential_characteristic_i in enumerate(all_input_differential_characteristics):
-            # item in  differential_characteristics[round_num] is:  (dc, dc_prob), sorted by dc_prob
-            differential_characteristic_i_of_roundN = differential_characteristic_i[round_num]
-            if len(differential_characteristic_i_of_roundN) == 0:
-                # bad differential_characteristic prob < 2^-16
-                continue
+            for start in tqdm(range(1, 2**16, chunk_size)):
+                arena = self.build_path_arena(range(start, min(start + chunk_size, 2**16)), round_num, exact)
+                yield from arena.iter_characteristics(round_num, exact)
+
+    def compute_differential_probabilities(self, IN_NUM, round_num=5, topN=10, threshold=0.0, verbose=True):
+        """Differential (cluster) probabilities of all the output differentials of IN_NUM after round_num rounds.
+        sp_table is used as a sparse Markov transition matrix: a probability vector starting at IN_NUM
+        is multiplied by it round_num times, entries not above threshold are pruned after every round.
+        Sums over all the paths of sp_table, exact when it was built with filter=False.
+        Returns:
+            list: topN [(output_diff, prob)], the output_diff is given before the last permutation as in the dc
+        """
+        vector = np.zeros(len(self.sp_table), dtype=np.float64)
+        vector[IN_NUM] = 1.0
+        for r in range(1, round_num + 1):
+            vector = self.sp_table.propagate(vector, threshold)
+            if self.stats is not None:
+                self.stats.record_round(r, int(np.count_nonzero(vector > threshold)), vector.nbytes, emit=True)
+        vector[vector <= threshold] = 0
+        top = np.nonzero(vector)[0]
+        if len(top) > topN:
+            top = top[np.argpartition(-vector[top], topN)[:topN]]
+        top = top[np.lexsort((top, -vector[top]))]
+        res = [(self.round_function.inv_perm(out), float(vector[out])) for out in top.tolist()]
+        if verbose:
+            print(f"[+] Top {topN}/{np.count_nonzero(vector)} differentials of round {round_num} from input_diff = {IN_NUM}")
+            for i, (out, prob) in enumerate(res):
+                print(f"Top {i+1}: output_diff = {parse_Sbox_input(out)} = {out}, differential_probablity = {prob}")
+            print()
+        return res
+
+    def sorted_sbox_perm_row(self, IN_NUM, exact=False):
+        # row of sp_table as [(out_diff, prob)] sorted by prob (descending), cached per row
+        # exact: [(out_diff, count)] with integer counts
+        if (IN_NUM, exact) not in self.sorted_sp_rows:
+            dests, probs = self.sp_table.row(IN_NUM)
+            order = np.argsort(-probs, kind="stable")
+            if exact:
+                probs = self.sbox_perm_counts()[self.sp_table.offsets[IN_NUM]:self.sp_table.offsets[IN_NUM + 1]]
+            self.sorted_sp_rows[(IN_NUM, exact)] = list(zip(dests[order].tolist(), probs[order].tolist()))
+        return self.sorted_sp_rows[(IN_NUM, exact)]
+
+    def search_best_differential_characteristics(self, max_rounds=None, verbose=True, exact=False):
+        """Matsui-style branch-and-bound search of the best differential characteristic.
+        The best r-round probability B[r] is found depth-first for r = 1, ..., max_rounds,
+        pruning every partial path whose probability times B[rounds left] can not reach
+        the current bound. The transitions are the ones in sp_table (MIN_PROB filter included).
+        exact: the search runs on integer counts, an r-round path has prob = count / 2^(state_bits * r)
+        Returns:
+            list: [(dc, dc_prob)] for round 1, ..., max_rounds, dc = [input_diff,..,output_diff]
+                  dc_prob is the integer count if exact
+        """
+        if max_rounds is None:
+            max_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        self.sorted_sp_rows = {}
+        # input differences sorted by their best one-round transition
+        row_max = np.zeros(len(self.sp_table), dtype=np.float64)
+        row_lengths = self.sp_table.row_lengths()
+        non_empty = np.nonzero(row_lengths)[0]
+        row_max[non_empty] = np.maximum.reduceat(self.sp_table.probs, self.sp_table.offsets[non_empty])
+        row_max[0] = 0  # skip the trivial zero differential
+        starts = [(row_max[i], i) for i in np.argsort(-row_max, kind="stable").tolist() if row_max[i] > 0]
+        if exact:
+            starts = [(round(math.ldexp(p, self.state_bits)), i) for p, i in starts]
+
+        B = [1.0] if not exact else [1]
+        results = []
+        for r in range(1, max_rounds + 1):
+            best = {"prob": 0, "dc": None}
+
+            counters = {"nodes_expanded": 0, "successors_generated": 0, "pruned_bound": 0}
+
+            def search(dc, prob, rounds_left):
+                if rounds_left == 0:
+                    if prob >= best["prob"]:
+                        best["prob"], best["dc"] = prob, dc
+                    return
+                row = self.sorted_sbox_perm_row(dc[-1], exact)
+                counters["nodes_expanded"] += 1
+                tried = 0
+                for diff, p in row:
+                    new_prob = prob * p
+                    if new_prob * B[rounds_left - 1] < best["prob"]:
+                        # the row is sorted, the rest can not do better
+                        break
+                    tried += 1
+                    search(dc + [diff], new_prob, rounds_left - 1)
+                counters["successors_generated"] += tried
+                counters["pruned_bound"] += len(row) - tried
+
+            # the initial bound: the best (r-1)-round path extended by its best transition,
+            # or Matsui's estimate B[r-1] * B[1] lowered until some path is found
+            # (the best (r-1)-round path may end at an empty row of the filtered sp_table)
+            greedy = None
+            if r > 1 and len(self.sorted_sbox_perm_row(results[-1][0][-1], exact)) != 0:
+                diff, p = self.sorted_sbox_perm_row(results[-1][0][-1], exact)[0]
+                greedy = (results[-1][0] + [diff], results[-1][1] * p)
+                bound = greedy[1]
             else:
-                final_table += differential_characteristic_i_of_roundN
-        res = sorted(final_table, key=lambda x: (-x[-1],x[1]))[1:topN+1]
-        
-        print(f"[+] Top {topN}/{len(final_table)} differential_characteristic (dc) of round {round_num} sorted by dc_prob")
-        for i in range(min(topN, len(res))):
-            # undo the permutation in the last round
-            res[i][0][-1] = do_inv_pbox(res[i][0][-1])
-            print("*"*32,f"Top {i+1}","*"*32)
-            print(f"dc = {tuple([parse_Sbox_input(s) for s in res[i][0]])}")
-            print(f"dc = {res[i][0]}")
-            print(f"dc_probablity = {res[i][-1]}")
-            print(f"active_sbox_num = {res[i][1]}")
-        print()
-        
-            
-    def sort_differential_characteristics_by_active_sbox_num(self, round_num=5, topN=10):
-        if len(self.differential_characteristic_table) != 0:
-            all_input_differential_characteristics = self.differential_characteristic_table
-        else:
-            all_input_differential_characteristics = self.compute_all_differential_characteristics()
-        final_table = []
-        for input_diff, differential_characteristic_i in enumerate(all_input_differential_characteristics):
-            # item in  differential_characteristics[round_num] is:  (dc, dc_prob), sorted by dc_prob
-            differential_characteristic_i_of_roundN = differential_characteristic_i[round_num]
-            if len(differential_characteristic_i_of_roundN) == 0:
-                # bad differential_characteristic prob < 2^-16
+                bound = B[r - 1] * starts[0][0] if len(starts) != 0 else 0
+            with stats_phase(self.stats, f"search_round_{r}"):
+                while True:
+                    # every pass prunes with the current bound, a pass finding nothing lowers it
+                    if greedy is not None and bound <= greedy[1]:
+                        best["dc"], best["prob"] = greedy
+                    else:
+                        best["prob"] = bound
+                    for start_prob, IN_NUM in starts:
+                        if start_prob * B[r - 1] < best["prob"]:
+                            break
+                        search([IN_NUM], B[0], r)
+                    if best["dc"] is not None or bound == 0:
+                        break
+                    bound = bound // 2 if exact else bound / 2
+            if self.stats is not None:
+                for name, value in counters.items():
+                    self.stats.count(name, value)
+                # depth-first: at most one path per depth is alive
+                self.stats.record_round(r, r, approx_path_bytes(r + 1), emit=True, **counters)
+            if best["dc"] is None:
+                # no characteristic of this length in sp_table
+                break
+            B.append(best["prob"])
+            results.append((best["dc"], best["prob"]))
+            if verbose:
+                dc = best["dc"][:-1] + [self.round_function.inv_perm(best["dc"][-1])]
+                print(f"[+] Best differential_characteristic (dc) of round {r}")
+                print(f"dc = {tuple([parse_Sbox_input(s) for s in dc])}")
+                print(f"dc = {dc}")
+                self.print_probability(best["prob"], r)
+                print(f"active_sbox_num = {sum(self.active_sbox_table[s] for s in best['dc'][:-1])}")
+        return results
+
+    def check_best_differential_characteristics(self, max_rounds=None, exact=False):
+        """The branch-and-bound search against the max-product DP over the same sp_table (best_path_probabilities).
+        Returns:
+            list: [(round, search_prob, dp_prob)] of the rounds where they differ, empty if the search is right
+                  (search_prob is None for a round the search did not reach)
+        """
+        if max_rounds is None:
+            max_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        results = self.search_best_differential_characteristics(max_rounds, verbose=False, exact=exact)
+        best = self.best_path_probabilities(max_rounds)
+        mismatches = []
+        for r in range(1, max_rounds + 1):
+            dp_prob = float(best[r][1:].max())
+            if r > len(results):
+                if dp_prob > 0:
+                    mismatches.append((r, None, dp_prob))
                 continue
-            else:
-                final_table += differential_characteristic_i_of_roundN
-        res = sorted(final_table, key=lambda x: (x[1],-x[-1]))[1:topN+1]
-            
-        print(f"[+] Top {topN} differential_characteristic (dc) of round {round_num} sorted by active_sbox_num")
-        for i in range(min(topN, len(res))):
+            prob = results[r - 1][1]
+            if exact:
+                prob = math.ldexp(prob, -self.state_bits * r)
+            if not math.isclose(prob, dp_prob, rel_tol=1e-9):
+                mismatches.append((r, prob, dp_prob))
+        return mismatches
+
+    def transposed_sbox_perm_table(self):
+        # backward transitions: row j of the result lists the (i, prob) of the sp_table entries i -> j
+        if self.sp_table_transposed is None or self.sp_table_transposed_source is not self.sp_table:
+            self.sp_table_transposed = self.sp_table.transpose()
+            self.sp_table_transposed_source = self.sp_table
+        return self.sp_table_transposed
+
+    def best_path_probabilities(self, max_rounds, backward=False):
+        """Max-product dynamic program over sp_table.
+        Returns:
+            list: best[r][d] = the best probability of an r-round path starting at d (ending at d if backward),
+                  r = 0, ..., max_rounds
+        """
+        table = self.transposed_sbox_perm_table() if backward else self.sp_table
+        best = [np.ones(len(table), dtype=np.float64)]
+        for _ in range(max_rounds):
+            best.append(table.max_propagate(best[-1]))
+        return best
+
+    def search_differential_characteristics_mitm(self, round_num, topN=10, min_prob=None, input_diffs=None,
+                                                output_diffs=None, max_paths=1 << 24, verbose=True):
+        """Meet-in-the-middle search of the topN characteristics (by dc_prob) of round_num rounds.
+        ceil(round_num/2) rounds are expanded forward from the input differentials in a PathArena and the
+        other rounds backward from the output differentials with the transposed sp_table, then the two halves
+        are joined on the middle differential through an index array over all the differentials.
+        Every partial path is pruned with the best probability its missing rounds can reach (max-product DP),
+        so only the paths of characteristics with prob >= min_prob are kept on both sides.
+        min_prob: None to start from the best probability and lower it (by 4) until topN characteristics are found
+        input_diffs, output_diffs: all the nonzero differentials if None, the outputs are given after the last permutation
+        Returns:
+            list: [(dc, active_sbox_num, dc_prob)] sorted by dc_prob, dc = [input_diff,..,output_diff]
+        """
+        forward_rounds = (round_num + 1) // 2
+        backward_rounds = round_num - forward_rounds
+        if input_diffs is None:
+            input_diffs = np.arange(1, len(self.sp_table))
+        if output_diffs is None:
+            output_diffs = np.arange(1, len(self.sp_table))
+        input_diffs = np.asarray(input_diffs, dtype=np.int64)
+        output_diffs = np.asarray(output_diffs, dtype=np.int64)
+        best_from = self.best_path_probabilities(round_num)
+        best_to = self.best_path_probabilities(round_num, backward=True)
+        backward_table = self.transposed_sbox_perm_table()
+        active = active_sbox_array(self.cipherN_paras["SBOX_BITS"], self.cipherN_paras["NUM_SBOXES"])
+
+        search_min_prob = min_prob
+        if search_min_prob is None:
+            search_min_prob = best_from[round_num][input_diffs].max() if len(input_diffs) != 0 else 0.0
+        results = []
+        while search_min_prob > 0:
+            with stats_phase(self.stats, f"mitm_round_{round_num}"):
+                # forward half: r rounds done, the other round_num - r can reach best_from[round_num - r] at most
+                starts = input_diffs[best_from[round_num][input_diffs] >= search_min_prob]
+                forward = PathArena(starts)
+                for r in range(1, forward_rounds + 1):
+                    forward.extend(self.sp_table, active, search_min_prob, bound=best_from[round_num - r])
+                # backward half from the outputs, level r holds the differential of round round_num - r
+                ends = output_diffs[best_to[round_num][output_diffs] >= search_min_prob]
+                backward = PathArena(ends)
+                for r in range(1, backward_rounds + 1):
+                    backward.extend(backward_table, active, search_min_prob, bound=best_to[round_num - r])
+                too_large = len(forward) > max_paths or len(backward) > max_paths
+                if self.stats is not None:
+                    self.stats.count("mitm_forward_paths", len(forward))
+                    self.stats.count("mitm_backward_paths", len(backward))
+                if not too_large:
+                    results = self.join_path_arenas(forward, forward_rounds, backward, backward_rounds,
+                                                    topN, search_min_prob)
+            if too_large:
+                print(f"[!] more than {max_paths} partial paths for min_prob = {search_min_prob}, "
+                      f"{len(results)} characteristics found")
+                break
+            if min_prob is not None or len(results) >= topN:
+                break
+            search_min_prob = search_min_prob / 4
+
+        if verbose:
+            self.print_differential_characteristics(
+                results, f"[+] Top {len(results)} differential_characteristic (dc) of round {round_num} "
+                         f"by meet-in-the-middle, dc_prob >= {search_min_prob}")
+        return results
+
+    def join_path_arenas(self, forward, forward_rounds, backward, backward_rounds, topN, min_prob):
+        # the topN products of a forward path and a backward path meeting on the same middle differential
+        forward_diffs, forward_probs = forward.diffs[forward_rounds], forward.probs[forward_rounds]
+        backward_diffs, backward_probs = backward.diffs[backward_rounds], backward.probs[backward_rounds]
+        if len(forward_diffs) == 0 or len(backward_diffs) == 0:
+            return []
+        # index arrays over all the middle differentials: the best forward and backward probability
+        best_forward = np.zeros(len(self.sp_table), dtype=np.float64)
+        best_backward = np.zeros(len(self.sp_table), dtype=np.float64)
+        np.maximum.at(best_forward, forward_diffs, forward_probs)
+        np.maximum.at(best_backward, backward_diffs, backward_probs)
+        # the topN-th best product over the middles is a lower bound of the topN-th characteristic
+        middle_best = best_forward * best_backward
+        threshold = min_prob
+        if np.count_nonzero(middle_best) >= topN:
+            threshold = max(threshold, -np.partition(-middle_best, topN - 1)[topN - 1])
+        forward_index = np.nonzero(forward_probs * best_backward[forward_diffs] >= threshold)[0]
+        backward_index = np.nonzero(backward_probs * best_forward[backward_diffs] >= threshold)[0]
+        # join: the backward candidates sorted by middle differential, a range of them for every forward candidate
+        backward_index = backward_index[np.argsort(backward_diffs[backward_index], kind="stable")]
+        sorted_middles = backward_diffs[backward_index]
+        lo = np.searchsorted(sorted_middles, forward_diffs[forward_index], side="left")
+        hi = np.searchsorted(sorted_middles, forward_diffs[forward_index], side="right")
+        lengths = hi - lo
+        pair_forward = np.repeat(forward_index, lengths)
+        pair_backward = backward_index[np.repeat(lo - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())]
+        probs = forward_probs[pair_forward] * backward_probs[pair_backward]
+        keep = probs >= threshold
+        pair_forward, pair_backward, probs = pair_forward[keep], pair_backward[keep], probs[keep]
+        order = np.lexsort((pair_backward, pair_forward, -probs))[:topN]
+        forward_paths = forward.paths(forward_rounds, pair_forward[order]).tolist()
+        backward_paths = backward.paths(backward_rounds, pair_backward[order]).tolist()
+        results = []
+        for forward_path, backward_path, prob in zip(forward_paths, backward_paths, probs[order].tolist()):
+            dc = forward_path + backward_path[::-1][1:]
+            results.append((dc, sum(self.active_sbox_table[s] for s in dc[:-1]), prob))
+        return results
+
+    def rank_differential_characteristics(self, round_num=5, topN=10, characteristics=None, workers=1, exact=False):
+        # streaming top-N by dc_prob and by active_sbox_num, in one pass over a generator
+        # workers > 1: the input differentials are expanded and ranked in chunks by a process pool
+        # exact: the characteristics are expanded with integer counts (see expand_differential_characteristics)
+        computed = self.path_arena is not None or (len(self.differential_characteristic_table) != 0 and not exact)
+        if characteristics is None and workers > 1 and not computed:
+            by_prob, by_active_sbox_num, total = self.rank_differential_characteristics_parallel(
+                round_num, topN, workers, exact)
+        elif characteristics is None and not computed:
+            with stats_phase(self.stats, f"rank_round_{round_num}"):
+                by_prob, by_active_sbox_num, total = self.rank_input_differences(1, 2**16, round_num, topN, exact)
+        elif characteristics is None and self.path_arena is not None and self.path_arena.num_rounds >= round_num \
+                and not exact:
+            with stats_phase(self.stats, f"rank_round_{round_num}"):
+                by_prob, by_active_sbox_num = [self.path_arena.characteristics(round_num, top)
+                                               for top in self.path_arena.top(round_num, topN)]
+                total = self.path_arena.level_size(round_num)
+        else:
+            if characteristics is None:
+                characteristics = self.generate_differential_characteristics(round_num, exact)
+            with stats_phase(self.stats, f"rank_round_{round_num}"):
+                by_prob, by_active_sbox_num, total = top_differential_characteristics(characteristics, topN)
+        self.print_differential_characteristics(
+            by_prob, f"[+] Top {topN}/{total} differential_characteristic (dc) of round {round_num} sorted by dc_prob")
+        self.print_differential_characteristics(
+            by_active_sbox_num, f"[+] Top {topN} differential_characteristic (dc) of round {round_num} sorted by active_sbox_num")
+        return by_prob, by_active_sbox_num
+
+    def rank_differential_characteristics_parallel(self, round_num=5, topN=10, workers=8, exact=False):
+        # every chunk keeps its own top-N, the chunk results are merged in input order
+        jobs = [(lo, hi, round_num, topN, exact) for lo, hi in balanced_chunks(workers * 16, 2**16 - 1, base=1)]
+        by_prob, by_active_sbox_num, total = [], [], 0
+        with analyzer_pool(self, workers) as pool:
+            for chunk_by_prob, chunk_by_active_sbox_num, chunk_total in tqdm(
+                    pool.imap(_rank_input_differences, jobs), total=len(jobs)):
+                by_prob += chunk_by_prob
+                by_active_sbox_num += chunk_by_active_sbox_num
+                total += chunk_total
+        by_prob = top_differential_characteristics(by_prob, topN)[0]
+        by_active_sbox_num = top_differential_characteristics(by_active_sbox_num, topN)[1]
+        return by_prob, by_active_sbox_num, total
+
+    def sort_differential_characteristics_by_prob(self, round_num=5, topN=10):
+        res, _, total = top_differential_characteristics(
+            self.generate_differential_characteristics(round_num), topN)
+        self.print_differential_characteristics(
+            res, f"[+] Top {topN}/{total} differential_characteristic (dc) of round {round_num} sorted by dc_prob")
+        return res
+
+    def sort_differential_characteristics_by_active_sbox_num(self, round_num=5, topN=10):
+        _, res, _ = top_differential_characteristics(
+            self.generate_differential_characteristics(round_num), topN)
+        self.print_differential_characteristics(
+            res, f"[+] Top {topN} differential_characteristic (dc) of round {round_num} sorted by active_sbox_num")
+        return res
+
+    def print_probability(self, prob, round_num):
+        # an integer prob is an exact count out of 2^(state_bits * round_num)
+        if isinstance(prob, int):
+            bits = self.state_bits * round_num
+            print(f"dc_count = {prob}/2^{bits}, weight = {characteristic_weight(prob, round_num, self.state_bits)}")
+            prob = prob / 2**bits
+        print(f"dc_probablity = {prob}")
+
+    def print_differential_characteristics(self, res, title):
+        print(title)
+        for i, (dc, active_sbox_num, prob) in enumerate(res):
+            round_num = len(dc) - 1
             # undo the permutation in the last round
-            res[i][0][-1] = do_inv_pbox(res[i][0][-1])
+            dc = dc[:-1] + [self.round_function.inv_perm(dc[-1])]
             print("*"*32,f"Top {i+1}","*"*32)
-            print(f"dc = {tuple([parse_Sbox_input(s) for s in res[i][0]])}")
-            print(f"dc = {res[i][0]}")
-            print(f"dc_probablity = {res[i][-1]}")
-            print(f"active_sbox_num = {res[i][1]}")
+            print(f"dc = {tuple([parse_Sbox_input(s) for s in dc])}")
+            print(f"dc = {dc}")
+            self.print_probability(prob, round_num)
+            print(f"active_sbox_num = {active_sbox_num}")
         print()
 
 if __name__ == "__main__":
@@ -255,6 +928,6 @@ if __name__ == "__main__":
         analyzer.compute_sbox_perm_table()
     # analyzer.compute_sbox_perm_table()
     # analyzer.compute_all_differential_characteristics()
+    # analyzer.search_best_differential_characteristics(12)
     for nround in range(1,11):
-        analyzer.sort_differential_characteristics_by_prob(nround, 10)
-        analyzer.sort_differential_characteristics_by_active_sbox_num(nround, 10)
\ No newline at end of file
+        analyzer.rank_differential_characteristics(nround, 10)
\ No newline at end of file
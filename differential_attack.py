@@ -0,0 +1,139 @@
+"""
+Last-round subkey recovery attack on CipherN, following the differential
+attack of 'A Tutorial on Linear and Differential Cryptanalysis' by Howard M. Heys.
+
+An (nround-1)-round differential characteristic from CipherN_analyzer predicts the
+difference u entering the last sbox layer. For chosen plaintext pairs with the
+input difference of the characteristic:
+    (1) pairs whose ciphertext difference is not zero on the inactive nibbles of u are dropped
+    (2) every candidate of the last subkey nibbles above the active nibbles of u partially
+        decrypts the remaining pairs through the inverse sbox, all candidates x pairs at once
+    (3) the candidate which gives u most often is the right subkey (with high probability)
+
+Author: tl2cents 2022.11.22
+"""
+
+import time
+import math
+import numpy as np
+from itertools import product
+from CipherN import keyGeneration, parse_subkeys, encrypt_batch, ROUND_FUNCTION, blockSize
+from differential_analysis import CipherN_analyzer, parse_Sbox_input
+
+
+# the active nibbles (from the least significant one) and the mask of them
+def active_nibbles(diff, SBOX_BITS=4, NUM_SBOXES=4):
+    nibble_mask = (1 << SBOX_BITS) - 1
+    positions = [j for j in range(NUM_SBOXES) if (diff >> (SBOX_BITS * j)) & nibble_mask]
+    mask = 0
+    for j in positions:
+        mask |= nibble_mask << (SBOX_BITS * j)
+    return positions, mask
+
+
+# all the values of the last subkey on the active nibbles, as an array of 16-bit keys
+def subkey_candidates(positions, SBOX_BITS=4):
+    candidates = [0]
+    for j in positions:
+        candidates = [k | (v << (SBOX_BITS * j)) for k, v in product(candidates, range(1 << SBOX_BITS))]
+    return np.array(candidates, dtype=np.uint16)
+
+
+# chosen plaintext pairs (p, p ^ input_diff) with random p
+def generate_chosen_pairs(num_pairs, input_diff, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+    pt1 = rng.integers(0, 1 << blockSize, num_pairs, dtype=np.uint16)
+    return pt1, pt1 ^ np.uint16(input_diff)
+
+
+# drop the pairs with a nonzero ciphertext difference on the inactive nibbles of target_diff
+def filter_pairs(ct1, ct2, target_diff):
+    _, mask = active_nibbles(target_diff)
+    inactive = np.uint16(~mask & ((1 << blockSize) - 1))
+    keep = ((ct1 ^ ct2) & inactive) == 0
+    return ct1[keep], ct2[keep]
+
+
+# number of pairs giving target_diff before the last sbox layer, for every subkey candidate
+# the partial decryption is a (candidates x pairs) array operation, pairs are taken in chunks
+def count_subkey_candidates(ct1, ct2, target_diff, candidates, chunk_size=1 << 16):
+    _, mask = active_nibbles(target_diff)
+    counts = np.zeros(len(candidates), dtype=np.int64)
+    S_INV = ROUND_FUNCTION.S_INV
+    for start in range(0, len(ct1), chunk_size):
+        c1 = ct1[None, start:start + chunk_size] ^ candidates[:, None]
+        c2 = ct2[None, start:start + chunk_size] ^ candidates[:, None]
+        diff = (S_INV[c1] ^ S_INV[c2]) & np.uint16(mask)
+        counts += np.count_nonzero(diff == target_diff, axis=1)
+    return counts
+
+
+def last_round_attack(nround=4, key=None, dc=None, dc_prob=None, num_pairs=None,
+                      analyzer=None, pairs_factor=8, rng=None, verbose=True):
+    """Recover the last subkey nibbles of nround-round CipherN.
+    dc: (nround-1)-round characteristic [input_diff,..,u] as given by CipherN_analyzer,
+        the best one of sp_table is searched if None.
+    num_pairs: chosen plaintext pairs, pairs_factor / dc_prob by default.
+    Returns:
+        dict: recovered and real subkey nibbles, counts and time / data complexity
+    """
+    if key is None:
+        key = keyGeneration()
+    subKeys = parse_subkeys(key, nround)
+    if dc is None:
+        if analyzer is None:
+            analyzer = CipherN_analyzer()
+            if not analyzer.load_sbox_perm_table():
+                analyzer.compute_sbox_perm_table()
+        dc, dc_prob = analyzer.search_best_differential_characteristics(nround - 1, verbose=False)[-1]
+    input_diff, target_diff = dc[0], dc[-1]
+    if num_pairs is None:
+        num_pairs = math.ceil(pairs_factor / dc_prob)
+
+    start_time = time.time()
+    pt1, pt2 = generate_chosen_pairs(num_pairs, input_diff, rng)
+    ct1 = encrypt_batch(pt1, subKeys, nround)
+    ct2 = encrypt_batch(pt2, subKeys, nround)
+    ct1, ct2 = filter_pairs(ct1, ct2, target_diff)
+    positions, mask = active_nibbles(target_diff)
+    candidates = subkey_candidates(positions)
+    counts = count_subkey_candidates(ct1, ct2, target_diff, candidates)
+    best = int(np.argmax(counts))
+    elapsed = time.time() - start_time
+
+    recovered = int(candidates[best])
+    real = int(subKeys[nround]) & mask
+    result = {
+        "nround": nround,
+        "dc": dc,
+        "dc_prob": dc_prob,
+        "active_nibbles": positions,
+        "recovered_subkey": recovered,
+        "real_subkey": real,
+        "success": recovered == real,
+        "right_pairs": int(counts[best]),
+        "expected_right_pairs": num_pairs * dc_prob if dc_prob else None,
+        "data_complexity": 2 * num_pairs,  # chosen plaintexts
+        "filtered_pairs": len(ct1),
+        "time_complexity": 2 * len(ct1) * len(candidates),  # partial decryptions (one sbox layer each)
+        "time": elapsed,
+    }
+    if verbose:
+        print(f"[+] {nround}-round CipherN, dc = {dc} with dc_probablity = {dc_prob}")
+        print(f"[+] active nibbles of the last round: {parse_Sbox_input(mask)}")
+        print(f"[+] data complexity = {result['data_complexity']} chosen plaintexts, "
+              f"{result['filtered_pairs']}/{num_pairs} pairs left after filtering")
+        print(f"[+] time complexity = {result['time_complexity']} partial decryptions, {elapsed:.3f}s")
+        print(f"[+] recovered subkey = {recovered:04x}, real subkey = {real:04x} "
+              f"({result['right_pairs']} right pairs), success = {result['success']}")
+        print()
+    return result
+
+
+if __name__ == "__main__":
+    analyzer = CipherN_analyzer()
+    if not analyzer.load_sbox_perm_table():
+        analyzer.compute_sbox_perm_table()
+    for nround in range(4, 7):
+        last_round_attack(nround, analyzer=analyzer)
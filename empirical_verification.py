@@ -0,0 +1,164 @@
+"""
+Empirical verification of the characteristic (and differential) probabilities predicted
+by CipherN_analyzer against the real reduced-round cipher.
+
+For every random key from keyGeneration, batches of random plaintext pairs (p, p ^ input_diff)
+are encrypted with the batch functions of CipherN and the right pairs are counted:
+    characteristic: the pair follows every difference of dc = [input_diff,..,output_diff]
+                    (checked after the S-box/P-box layer of every round)
+    differential:   only the output difference of encrypt(nround=len(dc)-1), i.e. the last
+                    difference of dc before the last permutation, is checked
+The (key, batch) jobs run on a process pool. The observed probability is reported with
+a Wilson confidence interval over the pairs and, since the probability of a fixed key
+varies around the average, with an interval over the per-key probabilities as well.
+
+Author: tl2cents 2022.11.22
+"""
+
+import math
+import time
+import multiprocessing
+from statistics import NormalDist
+import numpy as np
+from CipherN import keyGeneration, parse_subkeys, encrypt_batch, ROUND_FUNCTION, blockSize
+
+
+# number of pairs of pt1 (and pt1 ^ dc[0]) following dc, the subkeys come from parse_subkeys
+def count_right_pairs(pt1, subKeys, dc, characteristic=True):
+    nround = len(dc) - 1
+    pt2 = pt1 ^ np.uint16(dc[0])
+    if not characteristic:
+        out_diff = ROUND_FUNCTION.inv_perm(dc[-1])
+        diff = encrypt_batch(pt1, subKeys, nround) ^ encrypt_batch(pt2, subKeys, nround)
+        return int(np.count_nonzero(diff == out_diff))
+    state1, state2 = pt1, pt2
+    for roundN in range(nround):
+        state1 = ROUND_FUNCTION.SP[state1 ^ subKeys[roundN]]
+        state2 = ROUND_FUNCTION.SP[state2 ^ subKeys[roundN]]
+        # keep the pairs still on the characteristic only
+        keep = (state1 ^ state2) == dc[roundN + 1]
+        state1, state2 = state1[keep], state2[keep]
+    return len(state1)
+
+
+def _count_job(args):
+    key_index, subKeys, dc, num_pairs, characteristic, seed = args
+    rng = np.random.default_rng(seed)
+    pt1 = rng.integers(0, 1 << blockSize, num_pairs, dtype=np.uint16)
+    return key_index, count_right_pairs(pt1, subKeys, dc, characteristic), num_pairs
+
+
+# Wilson score interval of a binomial proportion
+def wilson_interval(successes, trials, confidence=0.95):
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z**2 / trials
+    center = (p + z**2 / (2 * trials)) / denominator
+    half = z * math.sqrt(p * (1 - p) / trials + z**2 / (4 * trials**2)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+# normal interval of the mean of the per-key probabilities (needs 2 keys at least)
+def key_interval(key_probs, confidence=0.95):
+    key_probs = np.asarray(key_probs, dtype=np.float64)
+    if len(key_probs) < 2:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    mean = key_probs.mean()
+    half = z * key_probs.std(ddof=1) / math.sqrt(len(key_probs))
+    return max(0.0, mean - half), min(1.0, mean + half)
+
+
+def verify_characteristic(dc, dc_prob=None, num_pairs=10**7, num_keys=16, batch_size=1 << 22,
+                          workers=None, characteristic=True, confidence=0.95, seed=None, verbose=True):
+    """Count the right pairs of dc over num_pairs random plaintext pairs, split over num_keys random keys.
+    dc: [input_diff,..,output_diff] as given by CipherN_analyzer (the last permutation included)
+    dc_prob: the predicted probability, or the exact count of the exact search (out of 2^(16 * rounds))
+    characteristic: check every round difference (True) or the output difference only (False)
+    Returns:
+        dict: observed probability, confidence interval, deviation and per-key probabilities
+    """
+    nround = len(dc) - 1
+    if isinstance(dc_prob, int):
+        dc_prob = dc_prob / 2**(blockSize * nround)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    seeds = np.random.SeedSequence(seed)
+    keys = [parse_subkeys(keyGeneration(), nround) for _ in range(num_keys)]
+    # every key gets num_pairs / num_keys pairs, in batches of at most batch_size
+    jobs = []
+    for key_index, subKeys in enumerate(keys):
+        key_pairs = num_pairs // num_keys + (key_index < num_pairs % num_keys)
+        for start in range(0, key_pairs, batch_size):
+            jobs.append((key_index, subKeys, dc, min(batch_size, key_pairs - start), characteristic,
+                         seeds.spawn(1)[0]))
+
+    start_time = time.time()
+    right = np.zeros(num_keys, dtype=np.int64)
+    trials = np.zeros(num_keys, dtype=np.int64)
+    if workers > 1:
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+        with context.Pool(workers) as pool:
+            for key_index, count, pairs in pool.imap_unordered(_count_job, jobs):
+                right[key_index] += count
+                trials[key_index] += pairs
+    else:
+        for job in jobs:
+            key_index, count, pairs = _count_job(job)
+            right[key_index] += count
+            trials[key_index] += pairs
+    elapsed = time.time() - start_time
+
+    total_right, total_pairs = int(right.sum()), int(trials.sum())
+    observed = total_right / total_pairs
+    low, high = wilson_interval(total_right, total_pairs, confidence)
+    key_probs = (right / np.maximum(trials, 1)).tolist()
+    key_low, key_high = key_interval(key_probs, confidence)
+    result = {
+        "dc": dc,
+        "mode": "characteristic" if characteristic else "differential",
+        "predicted_prob": dc_prob,
+        "observed_prob": observed,
+        "confidence": confidence,
+        "interval": (low, high),
+        "key_interval": (key_low, key_high),
+        "right_pairs": total_right,
+        "pairs": total_pairs,
+        "key_probs": key_probs,
+        "time": elapsed,
+    }
+    if dc_prob:
+        result["relative_deviation"] = (observed - dc_prob) / dc_prob
+        # deviation in standard deviations of the binomial with the predicted probability
+        result["z_score"] = (observed - dc_prob) / math.sqrt(dc_prob * (1 - dc_prob) / total_pairs) if dc_prob < 1 else 0.0
+        # the key-to-key variance dominates with many pairs, the key interval decides if there are 2 keys or more
+        if num_keys > 1:
+            result["consistent"] = key_low <= dc_prob <= key_high
+        else:
+            result["consistent"] = low <= dc_prob <= high
+    if verbose:
+        print(f"[+] {nround}-round {result['mode']} dc = {dc}")
+        print(f"[+] {total_pairs} pairs over {num_keys} keys in {elapsed:.3f}s, {total_right} right pairs")
+        print(f"[+] observed prob = {observed}, {confidence:.0%} interval = [{low}, {high}] (pairs), "
+              f"[{key_low}, {key_high}] (keys)")
+        if dc_prob:
+            print(f"[+] predicted prob = {dc_prob}, relative deviation = {result['relative_deviation']:+.4f}, "
+                  f"z = {result['z_score']:+.2f}, consistent = {result['consistent']}")
+        print(f"[+] per-key prob: min = {min(key_probs)}, max = {max(key_probs)}")
+        print()
+    return result
+
+
+if __name__ == "__main__":
+    from differential_analysis import CipherN_analyzer
+    analyzer = CipherN_analyzer()
+    if not analyzer.load_sbox_perm_table():
+        analyzer.compute_sbox_perm_table()
+    for dc, dc_prob in analyzer.search_best_differential_characteristics(5, verbose=False):
+        verify_characteristic(dc, dc_prob)
+        verify_characteristic(dc, dc_prob, characteristic=False)
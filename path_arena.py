@@ -0,0 +1,147 @@
+"""
+Array-backed storage of differential characteristics (paths) as a parent-pointer arena.
+
+Level r holds one entry per r-round path, in numpy columns:
+    parents[r][i]  -> index of the (r-1)-round prefix in level r-1 (-1 on level 0)
+    diffs[r][i]    -> the last difference of the path
+    probs[r][i]    -> the path probability
+    actives[r][i]  -> active sbox number of the path (the last difference not included)
+    counts[r][i]   -> exact count of the last transition (only if built with counts)
+so a path is never copied while it is extended: a level is made from the previous one
+with a few vectorized gathers over the sp_table rows. Full paths [input_diff,..,output_diff]
+are rebuilt by following the parents, for the selected entries only.
+
+The entries of a level keep the order of expand_differential_characteristics
+(inputs in order, then every parent's row in sp_table order).
+
+Author: tl2cents 2022.11.22
+"""
+
+import numpy as np
+
+
+class PathArena():
+    parents = None
+    diffs = None
+    probs = None
+    actives = None
+    counts = None
+
+    def __init__(self, inputs) -> None:
+        inputs = np.asarray(inputs, dtype=np.uint16)
+        self.parents = [np.full(len(inputs), -1, dtype=np.int64)]
+        self.diffs = [inputs]
+        self.probs = [np.ones(len(inputs), dtype=np.float64)]
+        self.actives = [np.zeros(len(inputs), dtype=np.uint16)]
+        self.counts = [np.ones(len(inputs), dtype=np.uint32)]
+
+    @property
+    def num_rounds(self):
+        return len(self.diffs) - 1
+
+    def level_size(self, round_num):
+        return len(self.diffs[round_num])
+
+    def __len__(self):
+        return sum(len(level) for level in self.diffs)
+
+    def nbytes(self):
+        return sum(column.nbytes for columns in (self.parents, self.diffs, self.probs, self.actives, self.counts)
+                   for column in columns)
+
+    def level_nbytes(self, round_num):
+        return sum(columns[round_num].nbytes for columns in
+                   (self.parents, self.diffs, self.probs, self.actives, self.counts))
+
+    def extend(self, sp_table, active_table, min_prob=0.0, counts=None, bound=None, block_size=1 << 16):
+        """Add the next level: every path of the last level extended by its sp_table row,
+        the paths with prob < min_prob are dropped.
+        active_table: numpy array differential -> active sbox number
+        counts: the exact counts of sp_table entries (see SPTable.counts), stored if given
+        bound: optional array, bound[d] is the best probability the rest of a path at d can reach,
+               the paths with prob * bound[last diff] < min_prob are dropped
+        Returns:
+            int: the number of generated successors (before the min_prob filter)
+        """
+        last_diffs, last_probs, last_actives = self.diffs[-1], self.probs[-1], self.actives[-1]
+        offsets = sp_table.offsets
+        columns = {"parents": [], "diffs": [], "probs": [], "actives": [], "counts": []}
+        generated = 0
+        # the parents are taken in blocks to bound the size of the temporary arrays
+        for start in range(0, len(last_diffs), block_size):
+            diffs = last_diffs[start:start + block_size].astype(np.int64)
+            starts = offsets[diffs]
+            lengths = offsets[diffs + 1] - starts
+            total = int(lengths.sum())
+            generated += total
+            # indices of all the entries of the parents' rows, row after row
+            index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+            probs = np.repeat(last_probs[start:start + block_size], lengths) * sp_table.probs[index]
+            dests = np.asarray(sp_table.dests[index], dtype=np.uint16)
+            if bound is None:
+                keep = np.nonzero(probs >= min_prob)[0]
+            else:
+                keep = np.nonzero(probs * bound[dests] >= min_prob)[0]
+            index = index[keep]
+            parents = np.repeat(np.arange(start, start + len(diffs), dtype=np.int64), lengths)[keep]
+            columns["parents"].append(parents)
+            columns["diffs"].append(dests[keep])
+            columns["probs"].append(probs[keep])
+            columns["actives"].append((last_actives[parents] + active_table[last_diffs[parents]]).astype(np.uint16))
+            if counts is not None:
+                columns["counts"].append(counts[index].astype(np.uint32))
+        empty = {"parents": np.int64, "diffs": np.uint16, "probs": np.float64, "actives": np.uint16, "counts": np.uint32}
+        for name, dtype in empty.items():
+            blocks = columns[name]
+            getattr(self, name).append(np.concatenate(blocks) if len(blocks) != 0 else np.zeros(0, dtype=dtype))
+        return generated
+
+    def paths(self, round_num, indices):
+        # differences of the paths of level round_num at indices, one row [input_diff,..,output_diff] per path
+        indices = np.asarray(indices, dtype=np.int64)
+        paths = np.zeros((len(indices), round_num + 1), dtype=np.int64)
+        for r in range(round_num, -1, -1):
+            paths[:, r] = self.diffs[r][indices]
+            indices = self.parents[r][indices]
+        return paths
+
+    def exact_counts(self, round_num, indices):
+        # exact path counts (python ints, out of 2^(state_bits * round_num)), needs an arena built with counts
+        indices = np.asarray(indices, dtype=np.int64)
+        result = [1] * len(indices)
+        for r in range(round_num, 0, -1):
+            assert len(self.counts[r]) == len(self.diffs[r]), "The arena was built without counts!"
+            result = [c * s for c, s in zip(result, self.counts[r][indices].tolist())]
+            indices = self.parents[r][indices]
+        return result
+
+    def characteristics(self, round_num, indices, exact=False):
+        # [(dc, active_sbox_num, prob)] as given by expand_differential_characteristics, exact: integer counts
+        paths = self.paths(round_num, indices).tolist()
+        actives = self.actives[round_num][indices].tolist()
+        probs = self.exact_counts(round_num, indices) if exact else self.probs[round_num][indices].tolist()
+        return list(zip(paths, actives, probs))
+
+    def iter_characteristics(self, round_num, exact=False, block_size=1 << 12):
+        # all the characteristics of level round_num in order, rebuilt block by block
+        for start in range(0, self.level_size(round_num), block_size):
+            indices = np.arange(start, min(start + block_size, self.level_size(round_num)))
+            yield from self.characteristics(round_num, indices, exact)
+
+    def top(self, round_num, topN=10):
+        """Indices of the topN paths of level round_num, in the order of top_differential_characteristics:
+        by prob (desc), then active sbox number (asc), then position, and by active sbox number first.
+        Returns:
+            (by_prob, by_active_sbox_num): index arrays
+        """
+        probs, actives = self.probs[round_num], self.actives[round_num]
+        if len(probs) <= topN:
+            by_prob = by_active_sbox_num = np.arange(len(probs))
+        else:
+            # only the entries reaching the topN-th value (ties included) are sorted
+            by_prob = np.nonzero(probs >= -np.partition(-probs, topN - 1)[topN - 1])[0]
+            by_active_sbox_num = np.nonzero(actives <= np.partition(actives, topN - 1)[topN - 1])[0]
+        by_prob = by_prob[np.lexsort((by_prob, actives[by_prob], -probs[by_prob]))][:topN]
+        by_active_sbox_num = by_active_sbox_num[np.lexsort(
+            (by_active_sbox_num, -probs[by_active_sbox_num], actives[by_active_sbox_num]))][:topN]
+        return by_prob, by_active_sbox_num
@@ -0,0 +1,164 @@
+"""
+Precomputed round-function layer of an SPN: S-box layer, bit permutation
+and the fused S∘P step, shared by CipherN and the analyzers.
+
+The tables are built once from a Sbox dict and a Pbox dict:
+    - sbox_byte / sbox_inv_byte : 8-bit tables applying the S-box to every sub-block of a byte
+    - pbox_byte / pbox_inv_byte : one table per state byte, giving the permuted bits of that byte
+    - S, S_INV, P, P_INV, SP, INV_SP : full state tables (only for states of at most 16 bits)
+
+Author: tl2cents 2022.11.22
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+
+class RoundFunction():
+    def __init__(self, sbox: dict, pbox: dict, SBOX_BITS=4, NUM_SBOXES=4) -> None:
+        assert 8 % SBOX_BITS == 0, "Sbox size must divide a byte!"
+        self.SBOX_BITS = SBOX_BITS
+        self.NUM_SBOXES = NUM_SBOXES
+        self.block_bits = SBOX_BITS * NUM_SBOXES
+        assert self.block_bits % 8 == 0, "State must be made of whole bytes!"
+        self.num_bytes = self.block_bits // 8
+        assert sorted(pbox.values()) == list(range(self.block_bits)), "Pbox must be a permutation!"
+        self.sbox = {i: sbox[i] for i in range(1 << SBOX_BITS)}
+        self.sbox_inv = {sbox[i]: i for i in range(1 << SBOX_BITS)}
+        self.pbox = {i: pbox[i] for i in range(self.block_bits)}
+        self.pbox_inv = {pbox[i]: i for i in range(self.block_bits)}
+
+        # split 8-bit S-box tables
+        self.sbox_byte = self._byte_sbox_table(self.sbox)
+        self.sbox_inv_byte = self._byte_sbox_table(self.sbox_inv)
+        # P-box byte tables, P(x) = OR of pbox_byte[j][byte j of x]
+        self.pbox_byte = self._byte_pbox_tables(self.pbox)
+        self.pbox_inv_byte = self._byte_pbox_tables(self.pbox_inv)
+        self._sbox_byte_ls = self.sbox_byte.tolist()
+        self._sbox_inv_byte_ls = self.sbox_inv_byte.tolist()
+        self._pbox_byte_ls = [table.tolist() for table in self.pbox_byte]
+        self._pbox_inv_byte_ls = [table.tolist() for table in self.pbox_inv_byte]
+
+        self.S = self.S_INV = self.P = self.P_INV = self.SP = self.INV_SP = None
+        if self.block_bits <= 16:
+            x = np.arange(1 << self.block_bits, dtype=np.uint32)
+            self.S = self.sub_array(x).astype(np.uint16)
+            self.S_INV = self.inv_sub_array(x).astype(np.uint16)
+            self.P = self.perm_array(x).astype(np.uint16)
+            self.P_INV = self.inv_perm_array(x).astype(np.uint16)
+            self.SP = self.P[self.S]
+            self.INV_SP = self.S_INV[self.P_INV]
+            self._sp_ls = self.SP.tolist()
+            self._inv_sp_ls = self.INV_SP.tolist()
+
+    def _byte_sbox_table(self, box):
+        x = np.arange(256, dtype=np.uint32)
+        values = np.array([box[i] for i in range(1 << self.SBOX_BITS)], dtype=np.uint32)
+        mask = (1 << self.SBOX_BITS) - 1
+        table = np.zeros(256, dtype=np.uint32)
+        for shift in range(0, 8, self.SBOX_BITS):
+            table |= values[(x >> shift) & mask] << shift
+        return table
+
+    def _byte_pbox_tables(self, box):
+        dtype = np.uint64 if self.block_bits > 32 else np.uint32
+        x = np.arange(256, dtype=dtype)
+        tables = []
+        for j in range(self.num_bytes):
+            table = np.zeros(256, dtype=dtype)
+            for bitIdx in range(8):
+                table |= ((x >> dtype(bitIdx)) & dtype(1)) << dtype(box[8 * j + bitIdx])
+            tables.append(table)
+        return tables
+
+    # scalar versions, for single python ints
+    def sub(self, state):
+        out = 0
+        for j in range(self.num_bytes):
+            out |= self._sbox_byte_ls[(state >> (8 * j)) & 0xff] << (8 * j)
+        return out
+
+    def inv_sub(self, state):
+        out = 0
+        for j in range(self.num_bytes):
+            out |= self._sbox_inv_byte_ls[(state >> (8 * j)) & 0xff] << (8 * j)
+        return out
+
+    def perm(self, state):
+        out = 0
+        for j, table in enumerate(self._pbox_byte_ls):
+            out |= table[(state >> (8 * j)) & 0xff]
+        return out
+
+    def inv_perm(self, state):
+        out = 0
+        for j, table in enumerate(self._pbox_inv_byte_ls):
+            out |= table[(state >> (8 * j)) & 0xff]
+        return out
+
+    def sp(self, state):
+        if self.SP is not None:
+            return self._sp_ls[state]
+        return self.perm(self.sub(state))
+
+    def inv_sp(self, state):
+        if self.INV_SP is not None:
+            return self._inv_sp_ls[state]
+        return self.inv_sub(self.inv_perm(state))
+
+    # numpy versions, for whole arrays of states
+    def sub_array(self, states):
+        states = np.asarray(states)
+        out = np.zeros_like(states)
+        for j in range(self.num_bytes):
+            byte = (states >> (8 * j)) & 0xff
+            out |= self.sbox_byte[byte].astype(states.dtype) << (8 * j)
+        return out
+
+    def inv_sub_array(self, states):
+        states = np.asarray(states)
+        out = np.zeros_like(states)
+        for j in range(self.num_bytes):
+            byte = (states >> (8 * j)) & 0xff
+            out |= self.sbox_inv_byte[byte].astype(states.dtype) << (8 * j)
+        return out
+
+    def perm_array(self, states):
+        states = np.asarray(states)
+        out = np.zeros_like(states)
+        for j, table in enumerate(self.pbox_byte):
+            out |= table[(states >> (8 * j)) & 0xff].astype(states.dtype)
+        return out
+
+    def inv_perm_array(self, states):
+        states = np.asarray(states)
+        out = np.zeros_like(states)
+        for j, table in enumerate(self.pbox_inv_byte):
+            out |= table[(states >> (8 * j)) & 0xff].astype(states.dtype)
+        return out
+
+    def sp_array(self, states):
+        if self.SP is not None:
+            return self.SP[states]
+        return self.perm_array(self.sub_array(states))
+
+    def inv_sp_array(self, states):
+        if self.INV_SP is not None:
+            return self.INV_SP[states]
+        return self.inv_sub_array(self.inv_perm_array(states))
+
+
+# one RoundFunction per (Sbox, Pbox, SBOX_BITS, NUM_SBOXES), built on first use
+# the least recently used ones are dropped beyond MAX_ROUND_FUNCTIONS (design exploration builds thousands)
+_ROUND_FUNCTIONS = OrderedDict()
+MAX_ROUND_FUNCTIONS = 16
+
+
+def get_round_function(sbox: dict, pbox: dict, SBOX_BITS=4, NUM_SBOXES=4):
+    key = (tuple(sorted(sbox.items())), tuple(sorted(pbox.items())), SBOX_BITS, NUM_SBOXES)
+    if key not in _ROUND_FUNCTIONS:
+        _ROUND_FUNCTIONS[key] = RoundFunction(sbox, pbox, SBOX_BITS, NUM_SBOXES)
+        while len(_ROUND_FUNCTIONS) > MAX_ROUND_FUNCTIONS:
+            _ROUND_FUNCTIONS.popitem(last=False)
+    _ROUND_FUNCTIONS.move_to_end(key)
+    return _ROUND_FUNCTIONS[key]
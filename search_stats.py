@@ -0,0 +1,110 @@
+"""
+Opt-in instrumentation of the searches: counters (nodes expanded, successors generated,
+paths pruned by MIN_PROB / PATH_MIN_PROB / the search bound), per-round live paths and
+approximate bytes, and the time spent in every phase.
+
+    stats = analyzer.enable_stats("search_stats.jsonl")
+    analyzer.rank_differential_characteristics(5)
+    stats.print_summary()
+
+Every finished phase (and every round a search reports as it goes) is also written as
+one JSON line to the optional stream, so long runs can be followed and tuned from data.
+
+Author: tl2cents 2022.11.22
+"""
+
+import contextlib
+import json
+import time
+
+
+# approximate size in bytes of one characteristic (dc, active_sbox_num, prob) with a dc of length path_len:
+# tuple (64) + list (56 + 8 per item) + ints (28 per diff) + int (28) + float (24)
+def approx_path_bytes(path_len):
+    return 64 + 56 + 36 * path_len + 28 + 24
+
+
+class SearchStats():
+    counters = None
+    rounds = None
+    phases = None
+
+    def __init__(self, stream=None) -> None:
+        # stream: None, a path (opened in append mode) or a writable file object
+        self.counters = {}
+        self.rounds = {}
+        self.phases = {}
+        self.start_time = time.time()
+        self.own_stream = isinstance(stream, str)
+        self.stream = open(stream, "a") if self.own_stream else stream
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_round(self, round_num, live_paths, nbytes=0, emit=False, **extra):
+        # live paths and bytes are summed over the calls (e.g. over the input differentials), the peaks kept
+        entry = self.rounds.setdefault(round_num, {"live_paths": 0, "bytes": 0, "peak_live_paths": 0, "peak_bytes": 0})
+        entry["live_paths"] += live_paths
+        entry["bytes"] += nbytes
+        entry["peak_live_paths"] = max(entry["peak_live_paths"], live_paths)
+        entry["peak_bytes"] = max(entry["peak_bytes"], nbytes)
+        for name, value in extra.items():
+            entry[name] = entry.get(name, 0) + value
+        if emit:
+            self.emit("round", round=round_num, live_paths=live_paths, bytes=nbytes, **extra)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            self.emit("phase", name=name, seconds=elapsed, counters=dict(self.counters))
+
+    def emit(self, event, **data):
+        if self.stream is None:
+            return
+        self.stream.write(json.dumps({"event": event, "time": time.time() - self.start_time, **data}) + "\n")
+        self.stream.flush()
+
+    def as_dict(self):
+        return {
+            "counters": dict(self.counters),
+            "rounds": {str(r): dict(entry) for r, entry in sorted(self.rounds.items())},
+            "phases": dict(self.phases),
+        }
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def reset(self):
+        self.counters, self.rounds, self.phases = {}, {}, {}
+
+    def close(self):
+        if self.own_stream and self.stream is not None:
+            self.stream.close()
+        self.stream = None
+
+    def print_summary(self):
+        print("[+] Search stats")
+        for name, value in self.counters.items():
+            print(f"    {name} = {value}")
+        for r, entry in sorted(self.rounds.items()):
+            print(f"    round {r}: live_paths = {entry['live_paths']}, bytes ~ {entry['bytes']}, "
+                  f"peak_live_paths = {entry['peak_live_paths']}")
+        for name, seconds in self.phases.items():
+            print(f"    phase {name}: {seconds:.3f}s")
+        print()
+
+    def __repr__(self):
+        return f"SearchStats({self.as_dict()})"
+
+
+# stats.phase(name) if stats are enabled, otherwise a context doing nothing
+def stats_phase(stats, name):
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.phase(name)
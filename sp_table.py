@@ -0,0 +1,133 @@
+"""
+Compact CSR storage of the S-box/P-box transition table (sp_table).
+
+Row i lists every (output difference, probability) of one S-box layer plus
+permutation for input difference i:
+    dests[offsets[i]:offsets[i+1]]  -> output differences (uint16)
+    probs[offsets[i]:offsets[i+1]]  -> transition probabilities (float64)
+
+The probabilities are DDT count products divided by 2^n (n the state bits), so they
+are dyadic and counts(n) gives back the exact integer counts.
+
+On disk the table is a directory holding offsets.npy, dests.npy and probs.npy,
+which are opened with memory mapping so several processes share one page-cache copy.
+
+Author: tl2cents 2022.11.22
+"""
+
+import os
+import numpy as np
+
+SP_TABLE_FILES = ("offsets", "dests", "probs")
+
+
+class SPTable():
+    offsets = None
+    dests = None
+    probs = None
+
+    def __init__(self, offsets, dests, probs) -> None:
+        assert len(dests) == len(probs) == offsets[-1], "Broken CSR table!"
+        self.offsets = offsets
+        self.dests = dests
+        self.probs = probs
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows: [[(out_diff, prob)]] as stored in the old pickled sp_table
+        lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        dests = np.fromiter((diff for row in rows for diff, _ in row),
+                            dtype=np.uint16, count=offsets[-1])
+        probs = np.fromiter((p for row in rows for _, p in row),
+                            dtype=np.float64, count=offsets[-1])
+        return cls(offsets, dests, probs)
+
+    @classmethod
+    def from_arrays(cls, row_dests, row_probs):
+        # row_dests, row_probs: one numpy array per input difference
+        lengths = np.array([len(row) for row in row_dests], dtype=np.int64)
+        offsets = np.zeros(len(row_dests) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        dests = np.concatenate(row_dests).astype(np.uint16)
+        probs = np.concatenate(row_probs).astype(np.float64)
+        return cls(offsets, dests, probs)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, IN_NUM):
+        # compatible with the list-of-tuples table, prefer row() in hot loops
+        dests, probs = self.row(IN_NUM)
+        return list(zip(dests.tolist(), probs.tolist()))
+
+    def row(self, IN_NUM):
+        # numpy views of one row, no python objects are built
+        start, end = self.offsets[IN_NUM], self.offsets[IN_NUM + 1]
+        return self.dests[start:end], self.probs[start:end]
+
+    def row_lengths(self):
+        return np.diff(self.offsets)
+
+    def propagate(self, vector, threshold=0.0):
+        """One round of the Markov chain: out[j] = sum_i vector[i] * T[i, j].
+        Entries of vector not above threshold are dropped before the product (pruning),
+        only their rows are gathered when few entries are left.
+        """
+        active = np.nonzero(vector > threshold)[0]
+        if len(active) > len(self) // 8:
+            weights = np.repeat(np.where(vector > threshold, vector, 0), self.row_lengths()) * self.probs
+            return np.bincount(self.dests, weights=weights, minlength=len(self))
+        starts = self.offsets[active]
+        lengths = self.offsets[active + 1] - starts
+        # indices of all the entries of the active rows
+        index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        weights = np.repeat(vector[active], lengths) * self.probs[index]
+        return np.bincount(self.dests[index], weights=weights, minlength=len(self))
+
+    def counts(self, state_bits=16):
+        # exact number of pairs (out of 2^state_bits) of every transition, int64
+        return np.rint(np.ldexp(self.probs, state_bits)).astype(np.int64)
+
+    def transpose(self):
+        # the backward table: row j lists every (i, T[i, j]), the input differences reaching j
+        sources = np.repeat(np.arange(len(self), dtype=np.uint16), self.row_lengths())
+        order = np.argsort(self.dests, kind="stable")
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.dests, minlength=len(self)), out=offsets[1:])
+        return SPTable(offsets, sources[order], np.asarray(self.probs)[order])
+
+    def max_propagate(self, vector):
+        # max-product step: out[i] = max_j T[i, j] * vector[j] (0 for an empty row)
+        out = np.zeros(len(self), dtype=np.float64)
+        non_empty = np.nonzero(self.row_lengths())[0]
+        values = self.probs * vector[self.dests]
+        out[non_empty] = np.maximum.reduceat(values, self.offsets[non_empty])
+        return out
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.dests.nbytes + self.probs.nbytes
+
+    def save(self, path="./sp_table"):
+        os.makedirs(path, exist_ok=True)
+        for name in SP_TABLE_FILES:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def create(cls, path, offsets):
+        # empty on-disk table with the given row offsets, rows are written in place later
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "offsets.npy"), offsets)
+        np.lib.format.open_memmap(os.path.join(path, "dests.npy"), mode="w+",
+                                  dtype=np.uint16, shape=(int(offsets[-1]),)).flush()
+        np.lib.format.open_memmap(os.path.join(path, "probs.npy"), mode="w+",
+                                  dtype=np.float64, shape=(int(offsets[-1]),)).flush()
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path="./sp_table", mmap=True):
+        mmap_mode = "r" if mmap else None
+        arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+                  for name in SP_TABLE_FILES]
+        return cls(*arrays)
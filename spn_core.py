@@ -0,0 +1,98 @@
+"""
+Shared core of CipherN and the analyzers: the default Sbox and Pbox, the sbox
+input/output helpers and the active sbox tables.
+
+Nothing is computed at import time, the tables are built on first use with numpy
+and cached per (SBOX_BITS, NUM_SBOXES).
+
+Author: tl2cents 2022.11.22
+"""
+
+from functools import lru_cache
+import numpy as np
+from round_function import get_round_function
+
+# (1) Substitution: 4x4 bijective, one sbox used for all 4 sub-blocks of size 4. Nibble wise
+sbox = {0: 0xE, 1: 0x4, 2: 0xD, 3: 0x1, 4: 0x2, 5: 0xF, 6: 0xB, 7: 0x8, 8: 0x3,
+        9: 0xA, 0xA: 0x6, 0xB: 0xC, 0xC: 0x5, 0xD: 0x9, 0xE: 0x0, 0xF: 0x7}  # key:value
+sbox_inv = {0xE: 0, 0x4: 1, 0xD: 2, 0x1: 3, 0x2: 4, 0xF: 5, 0xB: 6, 0x8: 7,
+            0x3: 8, 0xA: 9, 0x6: 0xA, 0xC: 0xB, 0x5: 0xC, 0x9: 0xD, 0x0: 0xE, 0x7: 0xF}
+
+# (2) Permutation. Applied bit-wise
+pbox = {0: 0, 1: 4, 2: 8, 3: 12, 4: 1, 5: 5, 6: 9, 7: 13,
+        8: 2, 9: 6, 10: 10, 11: 14, 12: 3, 13: 7, 14: 11, 15: 15}
+pbox_inv = {0: 0, 4: 1, 8: 2, 12: 3, 1: 4, 5: 5, 9: 6, 13: 7,
+            2: 8, 6: 9, 10: 10, 14: 11, 3: 12, 7: 13, 11: 14, 15: 15}
+
+
+# precomputed S-box/P-box tables of the default boxes
+@lru_cache(maxsize=None)
+def default_round_function():
+    return get_round_function(sbox, pbox)
+
+# modify accordingly
+def do_sbox(number):
+    return sbox[number]
+
+# modify accordingly
+def do_inv_sbox(number):
+    return sbox_inv[number]
+
+# modify accordingly
+def do_pbox(number):
+    return default_round_function().perm(number)
+
+# modify accordingly
+def do_inv_pbox(state):
+    return default_round_function().inv_perm(state)
+
+# convert an integer to the input of Sbox
+def parse_Sbox_input(input_number, SBOX_BITS=4, NUM_SBOXES=4):
+    mask = (1 << SBOX_BITS) - 1
+    STATE = []
+    for i in range(NUM_SBOXES):
+        STATE.append(mask & input_number)
+        input_number = input_number >> SBOX_BITS
+    return STATE[::-1]
+
+# merge the output of Sbox to an integer
+def merge_Sbox_output(STATE, SBOX_BITS=4, NUM_SBOXES=4):
+    assert len(STATE) == NUM_SBOXES
+    out_number = 0
+    for state in STATE:
+        out_number = (out_number << SBOX_BITS) | state
+    return out_number
+
+# differential -> the number of active sbox of the differential, as a read-only numpy array
+# every sbox is folded into its lowest bit, then the bits are counted
+@lru_cache(maxsize=None)
+def active_sbox_array(SBOX_BITS=4, NUM_SBOXES=4):
+    assert SBOX_BITS * NUM_SBOXES <= 32, "the state is too large for a full table"
+    states = np.arange(1 << (SBOX_BITS * NUM_SBOXES), dtype=np.uint64)
+    folded = np.zeros_like(states)
+    for bit in range(SBOX_BITS):
+        folded |= states >> np.uint64(bit)
+    lowest_bits = np.uint64(sum(1 << (SBOX_BITS * j) for j in range(NUM_SBOXES)))
+    folded &= lowest_bits
+    if hasattr(np, "bitwise_count"):
+        table = np.bitwise_count(folded).astype(np.uint8)
+    else:
+        table = np.zeros(len(states), dtype=np.uint8)
+        for j in range(NUM_SBOXES):
+            table += ((folded >> np.uint64(SBOX_BITS * j)) & np.uint64(1)).astype(np.uint8)
+    table.setflags(write=False)
+    return table
+
+# the same table as a list, for fast lookups of single python ints
+@lru_cache(maxsize=None)
+def active_sbox_table(SBOX_BITS=4, NUM_SBOXES=4):
+    return active_sbox_array(SBOX_BITS, NUM_SBOXES).tolist()
+
+# compute the active sbox number table of 16-bit differential
+def compute_active_sbox_table(SBOX_BITS=4, NUM_SBOXES=4):
+    return list(active_sbox_table(SBOX_BITS, NUM_SBOXES))
+
+# count the number of of active sbox of the input differential characteristics
+def count_active_sbox(dc, SBOX_BITS=4, NUM_SBOXES=4):
+    table = active_sbox_table(SBOX_BITS, NUM_SBOXES)
+    return sum([table[diff] for diff in dc])
@@ -0,0 +1,197 @@
+"""
+Content-addressed cache of the derived tables (sp_table, active sbox bounds, best weights).
+
+An entry is keyed by the SHA-256 of the kind of table and the parameters it depends on
+(Sbox, Pbox, sizes, MIN_PROB filter, ...), so a table made for other parameters is never
+found. It is a directory <kind>-<key> of the cache directory:
+    meta.json        -> kind, key, parameters, and size + SHA-256 of every array file
+    <name>.npy       -> the arrays of the table
+Entries are written to a temporary directory and renamed, so they are complete or absent.
+They are validated on load (parameters, sizes and, by default, checksums), a broken entry
+is removed and reported as a miss. The least recently used entries are evicted once the
+cache is bigger than max_bytes.
+
+    cache = TableCache("./table_cache", max_bytes=2 << 30)
+    analyzer.use_table_cache(cache)
+    analyzer.load_or_compute_sbox_perm_table()
+
+Author: tl2cents 2022.11.22
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+# bump when the layout of an entry or the way a table is computed changes
+CACHE_VERSION = 1
+
+
+# parameters -> canonical JSON (dict keys sorted, Sbox/Pbox dicts as sorted item lists)
+def canonical_parameters(parameters):
+    def canonical(value):
+        if isinstance(value, dict):
+            if all(isinstance(k, int) for k in value):
+                return [[k, canonical(v)] for k, v in sorted(value.items())]
+            return {str(k): canonical(v) for k, v in sorted(value.items())}
+        if isinstance(value, (list, tuple)):
+            return [canonical(v) for v in value]
+        if hasattr(value, "item"):
+            return value.item()
+        return value
+    return canonical(parameters)
+
+
+def cache_key(kind, parameters):
+    text = json.dumps({"kind": kind, "version": CACHE_VERSION, "parameters": canonical_parameters(parameters)},
+                      sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TableCache():
+    def __init__(self, cache_dir="./table_cache", max_bytes=4 << 30, verify=True) -> None:
+        # verify: check the SHA-256 of the files on every load (otherwise only their sizes)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.hits = self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, kind, key):
+        return os.path.join(self.cache_dir, f"{kind}-{key}")
+
+    def get(self, kind, parameters, mmap=False):
+        """The arrays stored for (kind, parameters), None if there is no valid entry.
+        Returns:
+            dict: name -> numpy array (memory mapped if mmap)
+        """
+        key = cache_key(kind, parameters)
+        path = self.entry_path(kind, key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+        try:
+            arrays = self.load_entry(path, kind, key, parameters, mmap)
+        except Exception as error:
+            print(f"[!] broken cache entry {path} removed: {error}")
+            shutil.rmtree(path, ignore_errors=True)
+            self.misses += 1
+            return None
+        # the directory mtime is the last use, for the LRU eviction
+        os.utime(path)
+        self.hits += 1
+        return arrays
+
+    def load_entry(self, path, kind, key, parameters, mmap=False):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        assert meta["kind"] == kind and meta["key"] == key and meta["version"] == CACHE_VERSION, "wrong entry"
+        assert meta["parameters"] == canonical_parameters(parameters), "parameters do not match"
+        arrays = {}
+        for name, info in meta["files"].items():
+            file_path = os.path.join(path, name + ".npy")
+            assert os.path.getsize(file_path) == info["size"], f"{name}.npy has a wrong size"
+            if self.verify:
+                assert file_sha256(file_path) == info["sha256"], f"{name}.npy has a wrong checksum"
+            arrays[name] = np.load(file_path, mmap_mode="r" if mmap else None)
+        return arrays
+
+    def put(self, kind, parameters, arrays):
+        # store the arrays (name -> numpy array) of (kind, parameters), then evict down to max_bytes
+        key = cache_key(kind, parameters)
+        path = self.entry_path(kind, key)
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp_")
+        try:
+            files = {}
+            for name, array in arrays.items():
+                file_path = os.path.join(tmp_path, name + ".npy")
+                np.save(file_path, np.asarray(array))
+                files[name] = {"size": os.path.getsize(file_path), "sha256": file_sha256(file_path)}
+            meta = {"kind": kind, "key": key, "version": CACHE_VERSION, "created": time.time(),
+                    "parameters": canonical_parameters(parameters), "files": files}
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=2)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path)
+        self.evict(keep=path)
+        return path
+
+    def get_or_compute(self, kind, parameters, compute, mmap=False):
+        # compute() returns the arrays (name -> numpy array) on a miss
+        arrays = self.get(kind, parameters, mmap)
+        if arrays is None:
+            computed = compute()
+            self.put(kind, parameters, computed)
+            # the entry may already be gone (evicted, removed by another process, broken on disk)
+            arrays = self.get(kind, parameters, mmap)
+            if arrays is None:
+                arrays = {name: np.asarray(array) for name, array in computed.items()}
+        return arrays
+
+    def entries(self):
+        # [(path, bytes, last use)] of the stored entries, least recently used first
+        result = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".tmp_") or not os.path.isdir(path):
+                continue
+            nbytes = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            result.append((path, nbytes, os.path.getmtime(path)))
+        return sorted(result, key=lambda entry: entry[2])
+
+    def nbytes(self):
+        return sum(nbytes for _, nbytes, _ in self.entries())
+
+    def evict(self, keep=None):
+        # remove the least recently used entries (but keep) until the cache fits in max_bytes
+        entries = self.entries()
+        total = sum(nbytes for _, nbytes, _ in entries)
+        for path, nbytes, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= nbytes
+        return total
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# the parameters every table of an SPN depends on
+def box_parameters(cipherN_paras):
+    return {
+        "Sbox": cipherN_paras["Sbox"],
+        "Pbox": cipherN_paras["Pbox"],
+        "SBOX_BITS": cipherN_paras["SBOX_BITS"],
+        "NUM_SBOXES": cipherN_paras["NUM_SBOXES"],
+    }
+
+
+def cached_bounds(cache, kind, parameters, max_rounds, compute):
+    # bounds of round 1, ..., max_rounds: the first ones of a longer stored list are reused,
+    # compute(max_rounds) -> list otherwise, and the longer list is stored
+    arrays = cache.get(kind, parameters)
+    if arrays is not None and len(arrays["bounds"]) >= max_rounds:
+        return arrays["bounds"][:max_rounds].tolist()
+    bounds = compute(max_rounds)
+    if len(bounds) == max_rounds:
+        cache.put(kind, parameters, {"bounds": np.array(bounds)})
+    return bounds
@@ -0,0 +1,308 @@
+"""
+Truncated differential (activity pattern) analysis of SPNs.
+
+A pattern is a NUM_SBOXES-bit mask of the active sboxes, bit j for the sbox on
+bits SBOX_BITS*j, ..., SBOX_BITS*j + SBOX_BITS - 1 (so CipherN has 16 patterns).
+Pattern a can go to pattern b in one round if every active sbox j of a can output some
+nonzero difference y_j (any output of the DDT support) such that the permuted outputs
+activate exactly the sboxes of b. Every concrete characteristic follows a pattern trail,
+so the active sbox numbers found on the pattern graph are lower bounds.
+
+The pattern transitions only depend on the Pbox and the DDT support: for every sbox
+position the distinct sets of sboxes its outputs reach are computed once, the successors
+of a pattern are the unions of one such set per active sbox. Patterns are generated
+lazily, so wide ciphers (PRESENT: 2^16 patterns) work the same way. Only the winning
+pattern trails / cycles are expanded to concrete differences: search_concrete_min_active_trail
+concretizes the pattern trails by increasing active sbox number, along the pattern search.
+
+Author: tl2cents 2022.11.22
+"""
+
+from functools import lru_cache
+import numpy as np
+from SBox import Sbox
+from round_function import get_round_function
+from spn_core import sbox, pbox
+from active_sbox_analysis import prune_dead_ends, min_mean_cycle
+
+
+# the number of active sboxes of a pattern
+def pattern_weight(pattern):
+    return bin(pattern).count("1")
+
+
+class TruncatedDifferential_analyzer():
+    cipherN_paras = {
+        "NUM_ROUNDS": 10,
+        "SBOX_BITS": 4,
+        "NUM_SBOXES": 4,
+        "Sbox": sbox,
+        "Pbox": pbox,
+    }
+
+    def __init__(self, cipherN_paras = None) -> None:
+        if cipherN_paras != None:
+            self.cipherN_paras = cipherN_paras
+        self.SBOX_BITS = self.cipherN_paras["SBOX_BITS"]
+        self.NUM_SBOXES = self.cipherN_paras["NUM_SBOXES"]
+        self.Sbox = Sbox(self.cipherN_paras["Sbox"])
+        self.round_function = get_round_function(
+            self.cipherN_paras["Sbox"], self.cipherN_paras["Pbox"], self.SBOX_BITS, self.NUM_SBOXES)
+        ddt = self.Sbox.difference_distribution_table()
+        # DDT rows [(out_diff, prob)] of every nonzero input, for the concrete expansion
+        self.ddt_rows = {a: [(b, ddt[a, b] / self.Sbox.box_size) for b in np.nonzero(ddt[a])[0].tolist()]
+                         for a in range(1, self.Sbox.box_size)}
+        # sbox_images[j][a]: [(permuted output difference, its pattern, prob)] of input difference a on sbox j
+        self.sbox_images = []
+        for j in range(self.NUM_SBOXES):
+            images = {}
+            for a, row in self.ddt_rows.items():
+                permed = [self.round_function.perm(b << (self.SBOX_BITS * j)) for b, _ in row]
+                images[a] = [(v, self.pattern_of(v), p) for v, (_, p) in zip(permed, row)]
+            self.sbox_images.append(images)
+        # nonzero sbox outputs reachable from some nonzero input
+        outputs = np.nonzero(ddt[1:].any(axis=0))[0].tolist()
+        # target_sets[j]: the distinct patterns reached by the outputs of sbox j after the permutation
+        self.target_sets = []
+        for j in range(self.NUM_SBOXES):
+            targets = set(self.pattern_of(self.round_function.perm(y << (self.SBOX_BITS * j))) for y in outputs)
+            self.target_sets.append(sorted(targets, key=lambda t: (pattern_weight(t), t)))
+        self._successors = lru_cache(maxsize=1 << 16)(self._pattern_successors)
+        self._concrete_cache = {}
+
+    def pattern_of(self, diff):
+        mask = (1 << self.SBOX_BITS) - 1
+        pattern = 0
+        for j in range(self.NUM_SBOXES):
+            if (diff >> (self.SBOX_BITS * j)) & mask:
+                pattern |= 1 << j
+        return pattern
+
+    def _pattern_successors(self, pattern, max_weight):
+        reach = {0}
+        for j in range(self.NUM_SBOXES):
+            if (pattern >> j) & 1:
+                reach = {p | t for p in reach for t in self.target_sets[j]}
+                if max_weight is not None:
+                    # a union only grows, too heavy partial unions can be dropped
+                    reach = {p for p in reach if pattern_weight(p) <= max_weight}
+        reach.discard(0)
+        return sorted(reach, key=lambda p: (pattern_weight(p), p))
+
+    def pattern_successors(self, pattern, max_weight=None):
+        """The patterns reachable from pattern in one round (with at most max_weight active sboxes),
+        sorted by their number of active sboxes, cached.
+        """
+        return self._successors(pattern, max_weight)
+
+    def pattern_transition_table(self, max_weight=None):
+        """The pattern graph on the patterns with 1 ... max_weight active sboxes (all if None), in CSR form.
+        Returns:
+            (nodes, offsets, targets): node i is the pattern nodes[i], its successors are the
+            node indices targets[offsets[i]:offsets[i+1]]
+        """
+        if max_weight is None:
+            max_weight = self.NUM_SBOXES
+        nodes = [p for p in range(1, 1 << self.NUM_SBOXES) if pattern_weight(p) <= max_weight]
+        node_index = {p: i for i, p in enumerate(nodes)}
+        rows = [[node_index[q] for q in self.pattern_successors(p, max_weight)] for p in nodes]
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in rows], out=offsets[1:])
+        targets = np.array([i for row in rows for i in row], dtype=np.int64)
+        return np.array(nodes, dtype=np.int64), offsets, targets
+
+    def search_min_active_trails(self, max_rounds=None, verbose=True):
+        """Branch-and-bound search of the pattern trail with the fewest active sboxes, round 1, ..., max_rounds.
+        Returns:
+            list: [(trail, active_sbox_num)], trail = [pattern of every sbox layer input]
+        """
+        if max_rounds is None:
+            max_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        first_patterns = sorted(range(1, 1 << self.NUM_SBOXES), key=lambda p: (pattern_weight(p), p))
+        A = [0]
+        results = []
+        for r in range(1, max_rounds + 1):
+            best = {"num": None, "trail": None}
+
+            def search(trail, num, rounds_left):
+                if rounds_left == 0:
+                    if num < best["num"]:
+                        best["num"], best["trail"] = num, trail
+                    return
+                bound = best["num"] - num - A[rounds_left - 1] - 1
+                for q in self.pattern_successors(trail[-1], bound):
+                    search(trail + [q], num + pattern_weight(q), rounds_left - 1)
+
+            # look for a trail with A[r-1] + 1, A[r-1] + 2, ... active sboxes in turn
+            target = A[r - 1] + 1
+            while best["trail"] is None:
+                best["num"] = target + 1
+                for p in first_patterns:
+                    if pattern_weight(p) + A[r - 1] >= best["num"]:
+                        break
+                    search([p], pattern_weight(p), r - 1)
+                target += 1
+            A.append(best["num"])
+            results.append((best["trail"], best["num"]))
+            if verbose:
+                print(f"[+] round {r}: minimum number of active sboxes of a pattern trail = {best['num']}, "
+                      f"trail = {[bin(p) for p in best['trail']]}")
+        return results
+
+    def find_min_mean_pattern_cycle(self, max_weight=2, verbose=True):
+        """The cycle of patterns with the lowest average number of active sboxes per round,
+        among the patterns with at most max_weight active sboxes (Howard's algorithm, see active_sbox_analysis).
+        Returns:
+            (cycle, avg_active_sbox_num), cycle is a list of patterns (None if there is no cycle)
+        """
+        nodes, offsets, targets = self.pattern_transition_table(max_weight)
+        kept, offsets, targets = prune_dead_ends(offsets, targets)
+        if len(kept) == 0:
+            if verbose:
+                print("[+] no pattern cycle found")
+            return None, None
+        nodes = nodes[kept]
+        weights = np.array([pattern_weight(p) for p in nodes.tolist()])
+        cycle, avg_active_sbox = min_mean_cycle(offsets, targets, weights)
+        cycle = nodes[cycle].tolist()
+        if verbose:
+            print(f"[+] pattern cycle {[bin(p) for p in cycle]} with avg_active_sbox {avg_active_sbox}")
+        return cycle, avg_active_sbox
+
+    def concrete_successors(self, diff, pattern=None):
+        # (permuted output difference, prob) of diff through one round, only the ones with the given pattern (if any)
+        key = (diff, pattern)
+        if key not in self._concrete_cache:
+            mask = (1 << self.SBOX_BITS) - 1
+            # the Pbox is linear: the permuted output is the union of the permuted outputs of every sbox,
+            # partial outputs already leaving the target pattern are dropped
+            outs = [(0, 0, 1.0)]
+            for j in range(self.NUM_SBOXES):
+                a = (diff >> (self.SBOX_BITS * j)) & mask
+                if a:
+                    outs = [(out | v, pt | vt, prob * p) for out, pt, prob in outs for v, vt, p in self.sbox_images[j][a]
+                            if pattern is None or (pt | vt) & ~pattern == 0]
+            self._concrete_cache[key] = [(out, prob) for out, pt, prob in outs if pattern is None or pt == pattern]
+        return self._concrete_cache[key]
+
+    def differences_of_pattern(self, pattern):
+        # all the concrete differences with exactly the active sboxes of pattern
+        diffs = [0]
+        for j in range(self.NUM_SBOXES):
+            if (pattern >> j) & 1:
+                diffs = [d | (v << (self.SBOX_BITS * j)) for d in diffs for v in range(1, 1 << self.SBOX_BITS)]
+        return diffs
+
+    def concrete_step(self, best, pattern=None):
+        """One round of the max-product dynamic program behind the concretization.
+        best: {diff: (prob, dc)}, the best partial characteristic dc ending at every diff
+        Returns:
+            the same dict one round later, restricted to the differences of pattern (if not None)
+        """
+        next_best = {}
+        for d, (prob, dc) in best.items():
+            for e, p in self.concrete_successors(d, pattern):
+                if e not in next_best or prob * p > next_best[e][0]:
+                    next_best[e] = (prob * p, dc + (e,))
+        return next_best
+
+    def concrete_start(self, pattern):
+        return {d: (1.0, (d,)) for d in self.differences_of_pattern(pattern)}
+
+    def concrete_result(self, best):
+        # the best (dc, dc_prob) of a finished dynamic program
+        if len(best) == 0:
+            return None, 0.0
+        prob, dc = max(best.values(), key=lambda entry: entry[0])
+        return list(dc), prob
+
+    def concretize_trail(self, trail, verbose=True):
+        """The best concrete characteristic following a pattern trail, by a max-product dynamic program
+        over the concrete differences of the trail's patterns only. trail[i] is the pattern of the
+        input of round i, the output difference of the last round is free.
+        Returns:
+            (dc, dc_prob): dc = [input_diff,..,output_diff] as in differential_analysis (len(trail) rounds),
+            (None, 0.0) if no concrete characteristic follows the trail
+        """
+        best = self.concrete_start(trail[0])
+        for pattern in trail[1:] + [None]:
+            best = self.concrete_step(best, pattern)
+            if len(best) == 0:
+                break
+        dc, dc_prob = self.concrete_result(best)
+        if verbose:
+            if dc is None:
+                print(f"[+] no concrete characteristic follows {[bin(p) for p in trail]}")
+            else:
+                print(f"[+] concrete characteristic of {[bin(p) for p in trail]}")
+                print(f"dc = {[hex(d) for d in dc]}")
+                print(f"dc_probablity = {dc_prob}")
+        return dc, dc_prob
+
+    def concretize_cycle(self, cycle, repeats=2, verbose=True):
+        # the best concrete characteristic going repeats times around a pattern cycle
+        return self.concretize_trail(cycle * repeats, verbose)
+
+    def iter_pattern_trails(self, round_num, max_active, lower_bounds=None, concrete=False):
+        """All the pattern trails of round_num rounds with at most max_active active sboxes (depth first).
+        lower_bounds[k]: a lower bound of the active sbox number of k rounds, used to prune
+        concrete: run the concretization along the search, the common prefixes are concretized once and
+                  the subtrees without any concrete characteristic are cut
+        Yields:
+            (trail, active_sbox_num), or (trail, active_sbox_num, dc, dc_prob) if concrete
+        """
+        if lower_bounds is None:
+            lower_bounds = [0] * round_num
+        first_patterns = sorted(range(1, 1 << self.NUM_SBOXES), key=lambda p: (pattern_weight(p), p))
+
+        def search(trail, num, rounds_left, best):
+            if rounds_left == 0:
+                if not concrete:
+                    yield trail, num
+                    return
+                dc, dc_prob = self.concrete_result(self.concrete_step(best))
+                if dc is not None:
+                    yield trail, num, dc, dc_prob
+                return
+            bound = max_active - num - lower_bounds[rounds_left - 1]
+            for q in self.pattern_successors(trail[-1], bound):
+                next_best = self.concrete_step(best, q) if concrete else None
+                if concrete and len(next_best) == 0:
+                    continue
+                yield from search(trail + [q], num + pattern_weight(q), rounds_left - 1, next_best)
+
+        for p in first_patterns:
+            if pattern_weight(p) + lower_bounds[round_num - 1] > max_active:
+                break
+            yield from search([p], pattern_weight(p), round_num - 1, self.concrete_start(p) if concrete else None)
+
+    def search_concrete_min_active_trail(self, round_num, max_extra=8, verbose=True):
+        """The concrete characteristic of round_num rounds with the fewest active sboxes (best probability
+        among them): the pattern trails are concretized by increasing active sbox number, starting from
+        the pattern bound, until one of them has a concrete characteristic.
+        Returns:
+            (dc, active_sbox_num, dc_prob), (None, None, 0.0) if nothing is found within max_extra extra sboxes
+        """
+        lower_bounds = [0] + [num for _, num in self.search_min_active_trails(round_num, verbose=False)]
+        for active in range(lower_bounds[round_num], lower_bounds[round_num] + max_extra + 1):
+            best_dc, best_prob = None, 0.0
+            for trail, num, dc, dc_prob in self.iter_pattern_trails(round_num, active, lower_bounds, concrete=True):
+                if num == active and dc_prob > best_prob:
+                    best_dc, best_prob = dc, dc_prob
+            if verbose:
+                print(f"[+] {active} active sboxes: concrete characteristic found = {best_dc is not None}")
+            if best_dc is not None:
+                if verbose:
+                    print(f"[+] round {round_num}: minimum number of active sboxes = {active}")
+                    print(f"dc = {[hex(d) for d in best_dc]}")
+                    print(f"dc_probablity = {best_prob}")
+                return best_dc, active, best_prob
+        return None, None, 0.0
+
+
+if __name__ == "__main__":
+    analyzer = TruncatedDifferential_analyzer()
+    trails = analyzer.search_min_active_trails(8)
+    analyzer.search_concrete_min_active_trail(4)
+    cycle, _ = analyzer.find_min_mean_pattern_cycle(2)
+    analyzer.concretize_cycle(cycle)
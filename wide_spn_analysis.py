@@ -0,0 +1,232 @@
+"""
+Differential analysis of wide SPNs (32-bit, 64-bit states like PRESENT) without
+enumerating the state space: no 2^n loop, no ACTIVE_SBOX_TABLE and no dense sp_table.
+
+The successors of a difference are generated lazily from the DDT of the sbox, one
+active sbox at a time, and permuted with the general bit permutation built from Pbox
+(see round_function.py). Both searches below are depth-first branch-and-bound, so the
+memory only grows with the number of rounds.
+
+Author: tl2cents 2022.11.22
+"""
+
+from SBox import Sbox
+from round_function import get_round_function
+
+# PRESENT sbox and bit permutation, a 64-bit example
+present_sbox = {0: 0xC, 1: 0x5, 2: 0x6, 3: 0xB, 4: 0x9, 5: 0x0, 6: 0xA, 7: 0xD,
+                8: 0x3, 9: 0xE, 0xA: 0xF, 0xB: 0x8, 0xC: 0x4, 0xD: 0x7, 0xE: 0x1, 0xF: 0x2}
+present_pbox = {i: (16 * i) % 63 if i != 63 else 63 for i in range(64)}
+
+
+# the number of active sbox of a difference of any width
+def count_active_sbox_of_diff(diff, SBOX_BITS=4):
+    mask = (1 << SBOX_BITS) - 1
+    cnt = 0
+    while diff:
+        if diff & mask:
+            cnt += 1
+        diff >>= SBOX_BITS
+    return cnt
+
+
+class WideSPN_analyzer():
+    cipherN_paras = {
+        "NUM_ROUNDS": 10,
+        "SBOX_BITS": 4,
+        "NUM_SBOXES": 16,
+        "MIN_PROB": 0,
+        "Sbox": present_sbox,
+        "Pbox": present_pbox,
+    }
+
+    def __init__(self, cipherN_paras = None) -> None:
+        if cipherN_paras != None:
+            self.cipherN_paras = cipherN_paras
+        self.SBOX_BITS = self.cipherN_paras["SBOX_BITS"]
+        self.NUM_SBOXES = self.cipherN_paras["NUM_SBOXES"]
+        self.Sbox = Sbox(self.cipherN_paras["Sbox"])
+        self.round_function = get_round_function(
+            self.cipherN_paras["Sbox"], self.cipherN_paras["Pbox"], self.SBOX_BITS, self.NUM_SBOXES)
+        # DDT rows [(out_diff, prob)] sorted by prob (descending)
+        prob_dict = self.Sbox.difference_prob_dict()
+        self.ddt_rows = {a: sorted(prob_dict[a], key=lambda x: -x[1]) for a in prob_dict}
+        self.max_sbox_prob = max(self.ddt_rows[a][0][1] for a in range(1, self.Sbox.box_size))
+        # all (input_diff, out_diff, prob) of one active sbox, sorted by prob
+        self.ddt_pairs = sorted([(a, b, p) for a in range(1, self.Sbox.box_size) for b, p in self.ddt_rows[a]],
+                                key=lambda x: -x[2])
+
+    def active_positions(self, diff):
+        mask = (1 << self.SBOX_BITS) - 1
+        return [j for j in range(self.NUM_SBOXES) if (diff >> (self.SBOX_BITS * j)) & mask]
+
+    def successors(self, diff, min_prob=0.0):
+        """Lazily yield (permuted output difference, prob) of one round from diff,
+        skipping the transitions with prob < min_prob (and < MIN_PROB).
+        Every active sbox goes through its DDT row in descending order, so a branch
+        is left as soon as it can not reach min_prob.
+        """
+        min_prob = max(min_prob, self.cipherN_paras["MIN_PROB"])
+        mask = (1 << self.SBOX_BITS) - 1
+        positions = self.active_positions(diff)
+        rows = [self.ddt_rows[(diff >> (self.SBOX_BITS * j)) & mask] for j in positions]
+        # best_rest[k]: the best prob of the sboxes k, k+1, ...
+        best_rest = [1.0] * (len(rows) + 1)
+        for k in range(len(rows) - 1, -1, -1):
+            best_rest[k] = best_rest[k + 1] * rows[k][0][1]
+
+        def extend(k, out, prob):
+            if k == len(rows):
+                yield self.round_function.perm(out), prob
+                return
+            for b, p in rows[k]:
+                if prob * p * best_rest[k + 1] < min_prob:
+                    break
+                yield from extend(k + 1, out | (b << (self.SBOX_BITS * positions[k])), prob * p)
+
+        yield from extend(0, 0, 1.0)
+
+    def best_successor(self, diff):
+        mask = (1 << self.SBOX_BITS) - 1
+        out, prob = 0, 1.0
+        for j in self.active_positions(diff):
+            b, p = self.ddt_rows[(diff >> (self.SBOX_BITS * j)) & mask][0]
+            out |= b << (self.SBOX_BITS * j)
+            prob *= p
+        return self.round_function.perm(out), prob
+
+    def first_round_transitions(self, min_prob):
+        """Yield (input_diff, permuted output difference, prob) of one round with prob >= min_prob,
+        choosing for every sbox position either no difference or one (in, out) DDT pair.
+        """
+        min_prob = max(min_prob, self.cipherN_paras["MIN_PROB"])
+
+        def extend(j, diff, out, prob):
+            if j == self.NUM_SBOXES:
+                if diff != 0:
+                    yield diff, self.round_function.perm(out), prob
+                return
+            yield from extend(j + 1, diff, out, prob)
+            for a, b, p in self.ddt_pairs:
+                if prob * p < min_prob:
+                    break
+                shift = self.SBOX_BITS * j
+                yield from extend(j + 1, diff | (a << shift), out | (b << shift), prob * p)
+
+        yield from extend(0, 0, 0, 1.0)
+
+    def search_best_differential_characteristics(self, max_rounds=None, verbose=True):
+        """Matsui-style branch-and-bound search of the best characteristic, round 1, ..., max_rounds.
+        A partial path is pruned with B[rounds left], the best probability of the shorter characteristics,
+        which is never looser than (best sbox prob)^(active sbox lower bound). The search is still
+        exponential in the number of rounds: for PRESENT it is practical up to about 4 rounds (a few
+        seconds), round 5 does not finish within minutes.
+        Returns:
+            list: [(dc, dc_prob)], dc = [input_diff,..,output_diff] (the last permutation included)
+        """
+        if max_rounds is None:
+            max_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        B = [1.0]
+        results = []
+        for r in range(1, max_rounds + 1):
+            best = {"prob": 0.0, "dc": None}
+
+            def search(dc, prob, rounds_left):
+                if rounds_left == 0:
+                    if prob >= best["prob"]:
+                        best["prob"], best["dc"] = prob, dc
+                    return
+                for diff, p in self.successors(dc[-1], best["prob"] / (prob * B[rounds_left - 1])):
+                    search(dc + [diff], prob * p, rounds_left - 1)
+
+            # Matsui's estimate: start from B[r-1] * (best sbox prob) and halve the bound until
+            # a path is found, the best (r-1)-round path extended by its best transition is a floor
+            greedy = None
+            if r > 1:
+                diff, p = self.best_successor(results[-1][0][-1])
+                greedy = (results[-1][0] + [diff], results[-1][1] * p)
+            bound = B[r - 1] * self.max_sbox_prob
+            while True:
+                if greedy is not None and bound <= greedy[1]:
+                    best["dc"], best["prob"] = greedy
+                else:
+                    best["prob"] = bound
+                for IN_NUM, diff, p in self.first_round_transitions(best["prob"] / B[r - 1]):
+                    if p * B[r - 1] < best["prob"]:
+                        continue
+                    search([IN_NUM, diff], p, r - 1)
+                if best["dc"] is not None:
+                    break
+                bound = bound / 2
+            B.append(best["prob"])
+            results.append((best["dc"], best["prob"]))
+            if verbose:
+                dc = best["dc"]
+                print(f"[+] Best differential_characteristic (dc) of round {r}")
+                print(f"dc = {[hex(s) for s in dc[:-1] + [self.round_function.inv_perm(dc[-1])]]}")
+                print(f"dc_probablity = {best['prob']}")
+                print(f"active_sbox_num = {sum(count_active_sbox_of_diff(s, self.SBOX_BITS) for s in dc[:-1])}")
+        return results
+
+    def search_min_active_sboxes(self, max_rounds=None, verbose=True):
+        """Branch-and-bound search of the minimum number of active sboxes, round 1, ..., max_rounds.
+        Counted over the input differences of the max_rounds sbox layers, every DDT transition allowed.
+        Practical up to about 4 rounds of PRESENT, as search_best_differential_characteristics.
+        Returns:
+            list: [(dc, active_sbox_num)], dc = [input_diff,..] of the sbox layers
+        """
+        if max_rounds is None:
+            max_rounds = self.cipherN_paras["NUM_ROUNDS"]
+        mask = (1 << self.SBOX_BITS) - 1
+        # the sbox outputs reachable from every input difference
+        supports = {a: [b for b, _ in self.ddt_rows[a]] for a in self.ddt_rows}
+        A = [0]
+        results = []
+
+        def next_diffs(diff):
+            positions = self.active_positions(diff)
+            outs = [0]
+            for j in positions:
+                shift = self.SBOX_BITS * j
+                outs = [out | (b << shift) for out in outs for b in supports[(diff >> shift) & mask]]
+            return sorted(set(self.round_function.perm(out) for out in outs),
+                          key=lambda d: count_active_sbox_of_diff(d, self.SBOX_BITS))
+
+        for r in range(1, max_rounds + 1):
+            best = {"num": None, "dc": None}
+
+            def search(dc, num, rounds_left):
+                if rounds_left == 0:
+                    if num < best["num"]:
+                        best["num"], best["dc"] = num, dc
+                    return
+                for diff in next_diffs(dc[-1]):
+                    n = count_active_sbox_of_diff(diff, self.SBOX_BITS)
+                    if num + n + A[rounds_left - 1] >= best["num"]:
+                        # sorted by active sbox number, the rest can not do better
+                        break
+                    search(dc + [diff], num + n, rounds_left - 1)
+
+            # first round: input differences with fewer active sboxes than the bound allows
+            def first_round(j, diff, num):
+                if num + A[r - 1] >= best["num"]:
+                    return
+                if j == self.NUM_SBOXES:
+                    if diff != 0:
+                        search([diff], num, r - 1)
+                    return
+                first_round(j + 1, diff, num)
+                for a in range(1, 1 << self.SBOX_BITS):
+                    first_round(j + 1, diff | (a << (self.SBOX_BITS * j)), num + 1)
+
+            # look for a trail with A[r-1] + 1, A[r-1] + 2, ... active sboxes in turn
+            target = A[r - 1] + 1
+            while best["dc"] is None:
+                best["num"] = target + 1
+                first_round(0, 0, 0)
+                target += 1
+            A.append(best["num"])
+            results.append((best["dc"], best["num"]))
+            if verbose:
+                print(f"[+] Minimum number of active sboxes of round {r} = {best['num']}, dc = {[hex(s) for s in best['dc']]}")
+        return results